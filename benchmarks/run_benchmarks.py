@@ -0,0 +1,375 @@
+""" Benchmarks of the parsing stages
+
+Times each stage separately on the documents in data/ and on
+synthetically scaled versions of them (more questions), records
+peak memory and throughput, saves everything as JSON and compares
+it against a locally stored baseline:
+
+python benchmarks/run_benchmarks.py --save-baseline
+(change something)
+python benchmarks/run_benchmarks.py
+
+Stages that read files (PDF and DOCX extraction) only run on the
+original documents; the other stages also run on 10x and 100x
+copies of the extracted lines.
+"""
+import os
+import re
+import sys
+import json
+import time
+import inspect
+import argparse
+import platform
+import tracemalloc
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+import pdf_parsing.pdf_extractor as pdf_e  # noqa
+from similarity_parser import SimilarityParser  # noqa
+from nlp_models.structured_incremental_parser import IncrementalParser  # noqa
+
+
+DATA_FOLDER = os.path.join(parentdir, 'data')
+RESULTS_FOLDER = os.path.join(currentdir, 'results')
+BASELINE_FILE = os.path.join(RESULTS_FOLDER, 'baseline.json')
+LATEST_FILE = os.path.join(RESULTS_FOLDER, 'latest.json')
+
+PDF_FILE = os.path.join(DATA_FOLDER, 'ENEM_PPL_1_DIA_CADERNO_1_AZUL.pdf')
+PDF_ANSWERS_FILE = os.path.join(DATA_FOLDER,
+                                'ENEM_PPL_1_DIA_CADERNO_1_AZUL_gab.pdf')
+DOCX_FILES = [os.path.join(DATA_FOLDER, x) for x in
+              ['Questionario_exemplo_parser.docx', 'Open_questions.docx']]
+
+DEFAULT_SCALES = [1, 10, 100]
+# differences below these are noise, never regressions
+MIN_COMPARED = {'time_s': 0.005, 'peak_mb': 0.5}
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks the parsing stages and compares '
+                    'the results with a stored baseline'
+    )
+    parser.add_argument(
+        '--stages',
+        nargs='+',
+        default=None,
+        help=f'Stages to run (default: all). Available: {", ".join(STAGES)}'
+    )
+    parser.add_argument(
+        '--scales',
+        nargs='+',
+        type=int,
+        default=DEFAULT_SCALES,
+        help='Number of copies of each document used by the in-memory stages'
+    )
+    parser.add_argument(
+        '-r',
+        '--repeat',
+        type=int,
+        default=3,
+        help='Runs per measurement. The fastest one is kept'
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        default=LATEST_FILE,
+        help='JSON file to save the results to'
+    )
+    parser.add_argument(
+        '--baseline',
+        default=BASELINE_FILE,
+        help='JSON file with the baseline results'
+    )
+    parser.add_argument(
+        '--save-baseline',
+        action='store_true',
+        help='Save the results as the new baseline instead of comparing'
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=0.2,
+        help='Relative slowdown (or memory increase) flagged as a regression'
+    )
+    return parser.parse_args(sys.argv[1:])
+
+
+class _Inputs:
+    """ Extracts the documents once and builds
+        the scaled inputs of each stage lazily
+    """
+    def __init__(self):
+        self.sp = SimilarityParser()
+        self._cache = {}
+
+    def _get(self, name, build):
+        if name not in self._cache:
+            self._cache[name] = build()
+        return self._cache[name]
+
+    def pdf_lines(self, scale):
+        lines = self._get('pdf_lines', lambda: pdf_e.read_pdf_lines(PDF_FILE))
+        return lines * scale
+
+    def pdf_lines_no_html(self, scale):
+        lines = self._get(
+            'pdf_lines_no_html',
+            lambda: self.sp._extract_lines_without_html(self.pdf_lines(1))
+        )
+        return lines * scale
+
+    def answer_lines_no_html(self, scale):
+        lines = self._get(
+            'answer_lines_no_html',
+            lambda: self.sp._extract_lines_without_html(
+                pdf_e.read_pdf_lines(PDF_ANSWERS_FILE)
+            )
+        )
+        return lines * scale
+
+    def questions(self, scale):
+        """ Lines of each question, as handed to _parse_question_tags
+        """
+        def build():
+            lines = list(self.pdf_lines(1))
+            lines_no_html = list(self.pdf_lines_no_html(1))
+            idxs = self.sp._split_questions(lines, lines_no_html)
+            idxs.append(len(lines))
+            return [(lines[n1:n2], lines_no_html[n1:n2])
+                    for n1, n2 in zip(idxs[:-1], idxs[1:])]
+        return self._get('questions', build) * scale
+
+    def numbered_lines(self, scale):
+        """ Lines with incremental question numbers only, so that
+            scaled copies keep counting up
+        """
+        def build():
+            lines = list(self.sp._iter_docx_lines(DOCX_FILES[1]))
+            return lines, self.sp._extract_lines_without_html(lines)
+
+        lines, lines_no_html = self._get('numbered_lines', build)
+        n_questions = sum(1 for x in lines_no_html
+                          if re.match(r'\s*\d+', x) is not None)
+        scaled, scaled_no_html = [], []
+        for copy_idx in range(scale):
+            def renumber(m):
+                return m.group(1) + str(int(m.group(2)) +
+                                        copy_idx * n_questions)
+            for line, line_no_html in zip(lines, lines_no_html):
+                scaled.append(re.sub(r'^(\s*)(\d+)', renumber, line))
+                scaled_no_html.append(
+                    re.sub(r'^(\s*)(\d+)', renumber, line_no_html)
+                )
+        return scaled, scaled_no_html
+
+
+# each stage: (uses scaled inputs, function(inputs, scale) -> prepared
+# call). The prepared call runs the stage and returns the number of lines
+def _stage_read_pdf_lines(inputs, scale):
+    return lambda: len(pdf_e.read_pdf_lines(PDF_FILE))
+
+
+def _stage_docx_to_lines(inputs, scale):
+    def run():
+        n_lines = 0
+        for docx_file in DOCX_FILES:
+            n_lines += sum(1 for _ in inputs.sp._iter_docx_lines(docx_file))
+        return n_lines
+    return run
+
+
+def _stage_extract_lines_without_html(inputs, scale):
+    lines = inputs.pdf_lines(scale)
+    return lambda: len(inputs.sp._extract_lines_without_html(lines))
+
+
+def _stage_split_questions(inputs, scale):
+    lines = inputs.pdf_lines(scale)
+    lines_no_html = inputs.pdf_lines_no_html(scale)
+
+    def run():
+        # _split_questions edits the lists it gets
+        inputs.sp._split_questions(list(lines), list(lines_no_html))
+        return len(lines)
+    return run
+
+
+def _stage_parse_question_tags(inputs, scale):
+    questions = inputs.questions(scale)
+
+    def run():
+        for lines, lines_no_html in questions:
+            inputs.sp._parse_question_tags(lines, lines_no_html)
+        return sum(len(x[0]) for x in questions)
+    return run
+
+
+def _stage_incremental_parser(inputs, scale):
+    lines, lines_no_html = inputs.numbered_lines(scale)
+    ip = IncrementalParser()
+
+    def run():
+        ip.parse_text_lines_inc_numbers(lines, lines_no_html)
+        return len(lines)
+    return run
+
+
+def _stage_parse_answers(inputs, scale):
+    lines_no_html = inputs.answer_lines_no_html(scale)
+
+    def run():
+        inputs.sp._parse_answers(lines_no_html)
+        return len(lines_no_html)
+    return run
+
+
+STAGES = {
+    'read_pdf_lines': (False, _stage_read_pdf_lines),
+    'docx_to_lines': (False, _stage_docx_to_lines),
+    'extract_lines_without_html': (True, _stage_extract_lines_without_html),
+    'split_questions': (True, _stage_split_questions),
+    'parse_question_tags': (True, _stage_parse_question_tags),
+    'incremental_parser': (True, _stage_incremental_parser),
+    'parse_answers': (True, _stage_parse_answers),
+}
+
+
+def measure(run, repeat):
+    """ Times a prepared stage call
+
+    Returns dictionary with the fastest time, the peak memory
+    of a separate traced run, number of lines and lines/sec
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        n_lines = run()
+        times.append(time.perf_counter() - start)
+
+    # tracing slows the stage down, so it gets a run of its own
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best = min(times)
+    return {
+        'time_s': best,
+        'peak_mb': peak / 2 ** 20,
+        'lines': n_lines,
+        'lines_per_s': n_lines / best if best > 0 else None
+    }
+
+
+def run_benchmarks(stages=None, scales=DEFAULT_SCALES, repeat=3):
+    """ Runs the benchmarks
+
+    Arguments:
+
+    stages: names of the stages to run, all if None
+    scales: number of copies of each document for the in-memory stages
+    repeat: runs per measurement
+
+    Returns dictionary {'meta': {...}, 'results': {<stage>[x<scale>]: {...}}}
+    """
+    if stages is None:
+        stages = list(STAGES)
+    for stage in stages:
+        assert stage in STAGES, f'Unknown stage: {stage}'
+
+    inputs = _Inputs()
+    results = {}
+    for stage in stages:
+        scaled, prepare = STAGES[stage]
+        for scale in (scales if scaled else [1]):
+            run = prepare(inputs, scale)
+            name = f'{stage}[x{scale}]'
+            results[name] = measure(run, repeat)
+            print(f'{name}: {results[name]["time_s"]:.4f}s, '
+                  f'{results[name]["peak_mb"]:.1f}MB')
+
+    meta = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'repeat': repeat
+    }
+    return {'meta': meta, 'results': results}
+
+
+def compare(current, baseline, tolerance=0.2):
+    """ Compares results with a baseline
+
+    Arguments:
+
+    current, baseline: results of run_benchmarks
+    tolerance: relative increase of time or peak memory
+        that is considered a regression. Values below
+        MIN_COMPARED are not compared
+
+    Returns list of (benchmark, metric, baseline value, current value)
+    for every regression
+    """
+    regressions = []
+    for name, cur in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        for metric, min_value in MIN_COMPARED.items():
+            if cur[metric] < min_value:
+                continue
+            if cur[metric] > max(base[metric], min_value) * (1 + tolerance):
+                regressions.append((name, metric, base[metric], cur[metric]))
+    return regressions
+
+
+def format_regression(name, metric, base, cur):
+    """ Describes a regression found by compare. As in compare,
+        the increase is relative to at least MIN_COMPARED, so
+        baselines of 0 are fine
+    """
+    increase = cur / max(base, MIN_COMPARED[metric]) - 1
+    return (f'REGRESSION {name} {metric}: {base:.4f} -> {cur:.4f} '
+            f'({increase:+.0%})')
+
+
+def _save(results, file_name):
+    os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+    with open(file_name, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=1)
+
+
+def main(args):
+    """ Runs the benchmarks, saves them and compares them with the baseline
+
+    Returns list of regressions (see compare)
+    """
+    results = run_benchmarks(args.stages, args.scales, args.repeat)
+    _save(results, args.output)
+
+    if args.save_baseline:
+        _save(results, args.baseline)
+        print(f'Baseline saved to {args.baseline}')
+        return []
+
+    if not os.path.isfile(args.baseline):
+        print(f'No baseline in {args.baseline}, use --save-baseline')
+        return []
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(format_regression(*regression))
+    if len(regressions) == 0:
+        print('No regressions')
+    return regressions
+
+
+if __name__ == '__main__':  # pragma: no cover
+    sys.exit(1 if len(main(parse_arguments())) > 0 else 0)
@@ -0,0 +1,693 @@
+""" Synthetic questionnaires for scaling tests
+
+Generates DOCX and PDF questionnaires with any number of questions,
+plus the questions the parser is expected to find in them (ground
+truth), so that throughput and memory can be measured as documents
+grow and parsing mistakes show up at any size:
+
+python benchmarks/synthetic_documents.py -o synthetic -n 500 5000 \
+    --images 0.05 --tables 0.05 --noise 0.3 --evaluate
+
+writes, for each number of questions N:
+
+synthetic_N.docx, synthetic_N.pdf - the questionnaires
+synthetic_N_docx.json, synthetic_N_pdf.json - their ground truth
+synthetic_N_gab.pdf - answers file of the PDF (--answers)
+
+and, with --evaluate, parses them and reports time, peak memory
+and how many questions came out as expected. The folder can also be
+given to parse_doc.py as input.
+
+Ground truth follows the format of parse_docx / parse_pdf, except
+that every text field holds plain text: markup depends on how each
+format is extracted. normalize_questions(parsed) gives the same form.
+
+Noise only adds what the parser is meant to absorb: misspelled
+question headers and tags (within the edit distance tolerances of
+the default configuration), mixed question and choice delimiters,
+letter case, zero padded numbers and headers on lines of their own.
+"""
+import os
+import re
+import sys
+import html
+import json
+import time
+import zlib
+import random
+import struct
+import inspect
+import zipfile
+import argparse
+import tracemalloc
+
+import fitz
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from similarity_parser import SimilarityParser  # noqa
+
+
+# alphabetic words, far (in edit distance) from question headers and tags
+WORDS = [
+    'análise', 'bacia', 'cálculo', 'cidade', 'clima', 'conjunto',
+    'energia', 'escola', 'função', 'governo', 'história', 'imagem',
+    'indústria', 'leitura', 'lógica', 'mercado', 'método', 'modelo',
+    'movimento', 'natureza', 'oceano', 'padrão', 'planeta', 'política',
+    'processo', 'produção', 'química', 'região', 'relação', 'sistema',
+    'sociedade', 'solução', 'teoria', 'território', 'texto', 'trabalho',
+    'valor', 'variável', 'velocidade', 'volume', 'cultura', 'economia',
+    'fração', 'gráfico', 'mapa', 'medida', 'papel', 'razão', 'tempo',
+    'vetor', 'água', 'árvore', 'espaço', 'forma', 'grupo', 'limite',
+    'massa', 'ordem', 'rede'
+]
+SOURCES = ['UNICAMP', 'FUVEST 2018', 'UFMG', 'ITA 2015', 'Autoral']
+TITLE = 'Questionário sintético'
+
+HEADER = 'Questão'
+# within exercise_dist_tol of an exercise string
+NOISY_HEADERS = ['Qestão', 'Questao', 'QUESTÃO', 'questão', 'Exercício',
+                 'Exercico', 'Exercise', 'Pergunta', 'Perguta']
+QUESTION_DELIMITER = '.'
+NOISY_QUESTION_DELIMITERS = ['.', ')', '-', ':', ']']
+# without headers: the same_char_list of the IncrementalParser
+NOISY_NUMBER_DELIMITERS = ['.', ')', '-', ']']
+CHOICE_DELIMITER = ')'
+NOISY_CHOICE_DELIMITERS = [')', ']', '-', ' -', '.']
+# tag type: (tag, misspelled tags within tag_dist_tol)
+TAGS = {
+    'correct_answer': ('Resposta', ['Respota', 'RESPOSTA']),
+    'hint': ('Dica', ['Dika', 'dica']),
+    'detailed_answer': ('Resposta detalhada', ['Resposta detalhda']),
+    'category': ('Tags', ['Tag']),
+    'difficulty': ('Dificuldade', ['Dificudade']),
+}
+LOWERCASE_CHARS = 'abcdefghijklmnopqrstuvwxyz'
+MAX_LINE_CHARS = 80
+
+# page layout of the PDF, in points
+PAGE_WIDTH, PAGE_HEIGHT = fitz.paper_size('a4')
+MARGIN = 50
+FONT_SIZE = 10
+LINE_HEIGHT = 16
+IMAGE_SIZE = 60
+CELL_WIDTH = 90
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+R_NS = ('http://schemas.openxmlformats.org/officeDocument/2006/'
+        'relationships')
+IMAGE_REL = R_NS + '/image'
+DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'content-types">'
+    '<Default Extension="rels" ContentType="application/'
+    'vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Default Extension="png" ContentType="image/png"/>'
+    '<Override PartName="/word/document.xml" ContentType="application/'
+    'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+    'relationships">'
+    f'<Relationship Id="rId1" Type="{R_NS}/officeDocument" '
+    'Target="word/document.xml"/>'
+    '</Relationships>'
+)
+DOCX_IMAGE = (
+    '<w:p><w:r><w:drawing><wp:inline>'
+    '<wp:extent cx="{size}" cy="{size}"/>'
+    '<wp:docPr id="{idx}" name="Picture {idx}"/>'
+    '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/'
+    'drawingml/2006/picture"><pic:pic>'
+    '<pic:nvPicPr><pic:cNvPr id="{idx}" name="image{idx}.png"/>'
+    '<pic:cNvPicPr/></pic:nvPicPr>'
+    '<pic:blipFill><a:blip r:embed="rIdImg{idx}"/>'
+    '<a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+    '<pic:spPr><a:xfrm><a:off x="0" y="0"/>'
+    '<a:ext cx="{size}" cy="{size}"/></a:xfrm>'
+    '<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></pic:spPr>'
+    '</pic:pic></a:graphicData></a:graphic>'
+    '</wp:inline></w:drawing></w:r></w:p>'
+)
+
+
+def _sentence(rnd, max_chars=MAX_LINE_CHARS):
+    """ Capitalized sentence of random words, without digits
+        or punctuation that the parser could take for delimiters
+    """
+    words = [rnd.choice(WORDS)]
+    while rnd.random() < 0.85:
+        word = rnd.choice(WORDS)
+        if sum(len(x) + 1 for x in words) + len(word) > max_chars:
+            break
+        words.append(word)
+    return ' '.join(words).capitalize()
+
+
+def _png(rnd, size=8):
+    """ Small PNG of random colored pixels, so that images differ
+    """
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data +\
+            struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    rows = b''.join(b'\x00' + bytes(rnd.randrange(256)
+                                    for _ in range(3 * size))
+                    for _ in range(size))
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(rows)),
+        chunk(b'IEND', b'')
+    ])
+
+
+def _noisy(rnd, noise, clean, noisy):
+    return rnd.choice(noisy) if rnd.random() < noise else clean
+
+
+def generate_questions(n_questions, n_choices=5, open_ratio=0.2,
+                       tag_density=0.5, image_ratio=0.0, table_ratio=0.0,
+                       noise=0.0, headers=True, seed=0):
+    """ Generates the contents of a questionnaire
+
+    Arguments:
+
+    n_questions: number of questions
+    n_choices: number of choices of multiple choice questions (3 to 26)
+    open_ratio: fraction of open (free answer) questions
+    tag_density: probability of each optional tag (hint, detailed
+        answer, tags, difficulty, source) in a question. Multiple
+        choice questions always have their answer
+    image_ratio: fraction of questions with an image
+    table_ratio: fraction of questions with a table
+    noise: probability of each kind of noise, see the module docstring
+    headers: False to number questions without headers (`12. text`),
+        which makes the parser fall back to the IncrementalParser.
+        Table cells of PDFs are lines of their own then, and numbers
+        in many of them can outnumber the question numbers
+    seed: random seed, the same arguments give the same questions
+
+    Returns list of questions, each a dictionary with:
+        'items': what the document holds, in order: ('text', line),
+            ('image', PNG bytes) or ('table', list of rows of cells)
+        'truth': expected question (see ground_truth), where the
+            stem is a list of texts and image indexes
+    """
+    assert 3 <= n_choices <= len(LOWERCASE_CHARS),\
+        f'Expected 3 to {len(LOWERCASE_CHARS)} choices, got {n_choices}'
+    rnd = random.Random(seed)
+    questions = []
+    n_images = 0
+    for number in range(1, n_questions + 1):
+        items = []
+        stem = []
+        source = None
+
+        number_txt = str(number)
+        if rnd.random() < noise:
+            number_txt = number_txt.zfill(3)
+        delimiter = _noisy(rnd, noise, QUESTION_DELIMITER,
+                           NOISY_QUESTION_DELIMITERS if headers
+                           else NOISY_NUMBER_DELIMITERS)
+        first_line = _sentence(rnd)
+        # header on a line of its own
+        own_line = headers and rnd.random() < noise
+        if headers and rnd.random() < tag_density:
+            source = rnd.choice(SOURCES)
+            first_line = f'({source}) {first_line}'
+            if own_line:
+                # only the line of the header is searched for sources
+                source = None
+        stem.append(first_line[len(source) + 3:]
+                    if source is not None else first_line)
+
+        if not headers:
+            # the IncrementalParser keeps the number in the text
+            items.append(('text', f'{number_txt}{delimiter} {first_line}'))
+            stem[0] = items[-1][1]
+        elif own_line:
+            header = _noisy(rnd, noise, HEADER, NOISY_HEADERS)
+            items.append(('text', f'{header} {number_txt}'))
+            items.append(('text', first_line))
+        else:
+            header = _noisy(rnd, noise, HEADER, NOISY_HEADERS)
+            items.append(('text',
+                          f'{header} {number_txt}{delimiter} {first_line}'))
+
+        for _ in range(rnd.randrange(3)):
+            stem.append(_sentence(rnd))
+            items.append(('text', stem[-1]))
+        if rnd.random() < table_ratio:
+            rows = [[rnd.choice(WORDS) for _ in range(3)]]
+            rows += [[str(rnd.randrange(1, 1000)) for _ in range(3)]
+                     for _ in range(rnd.randrange(1, 4))]
+            items.append(('table', rows))
+            stem.append(' '.join(x for row in rows for x in row))
+        if rnd.random() < image_ratio:
+            items.append(('image', _png(rnd)))
+            stem.append(n_images)
+            n_images += 1
+
+        if rnd.random() >= open_ratio:
+            delimiter = _noisy(rnd, noise, CHOICE_DELIMITER,
+                               NOISY_CHOICE_DELIMITERS)
+            upper = rnd.random() < noise
+            choices = []
+            for letter in LOWERCASE_CHARS[:n_choices]:
+                choices.append(_sentence(rnd))
+                letter = letter.upper() if upper else letter
+                items.append(('text', f'{letter}{delimiter} {choices[-1]}'))
+            answer = rnd.randrange(n_choices)
+            truth = {'type': 'choice',
+                     'choices': [{'text': x} for x in choices],
+                     'correct_answer': answer}
+            tags = [('correct_answer', LOWERCASE_CHARS[answer])]
+        else:
+            truth = {'type': 'long'}
+            tags = []
+
+        if rnd.random() < tag_density:
+            tags.append(('hint', _sentence(rnd)))
+        if rnd.random() < tag_density:
+            tags.append(('detailed_answer', _sentence(rnd)))
+        if rnd.random() < tag_density:
+            tags.append(('category', ', '.join(rnd.sample(WORDS, 2))))
+        if rnd.random() < tag_density:
+            tags.append(('difficulty', str(rnd.randrange(1, 6))))
+        rnd.shuffle(tags)
+
+        for tag_type, value in tags:
+            tag, misspelled = TAGS[tag_type]
+            tag = _noisy(rnd, noise, tag, misspelled)
+            items.append(('text', f'{tag}: {value}'))
+
+        truth['stem'] = stem
+        truth['hints'] = [v for t, v in tags if t == 'hint']
+        for tag_type, key in [('detailed_answer', 'comment'),
+                              ('category', 'tags')]:
+            for t, v in tags:
+                if t == tag_type:
+                    truth[key] = v
+        # the source, found in the first line, comes after the tags
+        if source is not None:
+            tags.append(('source', source))
+        truth['all_parsed_tags'] = {'types': [x[0] for x in tags],
+                                    'values': [x[1] for x in tags]}
+        questions.append({'items': items, 'truth': truth})
+    return questions
+
+
+def docx_image_name(idx):
+    """ Placeholder name of image idx (0 based) of a DOCX questionnaire
+    """
+    return f'media/image{idx + 1}.png'
+
+
+def pdf_image_name(idx):
+    """ Placeholder name of image idx (0 based) of a PDF questionnaire
+    """
+    return f'media/{str(idx + 1).zfill(8)}.png'
+
+
+def ground_truth(questions, image_name):
+    """ Questions a parser should find in a questionnaire
+
+    Arguments:
+
+    questions: list returned by generate_questions
+    image_name: docx_image_name or pdf_image_name
+
+    Returns list of questions in the format of parse_docx /
+    parse_pdf, with plain text fields (see normalize_questions)
+    """
+    truth = []
+    for question in questions:
+        question = dict(question['truth'])
+        question['stem'] = ' '.join(
+            x if isinstance(x, str) else f'----{image_name(x)}----'
+            for x in question['stem']
+        )
+        truth.append(question)
+    return truth
+
+
+def _plain_text(markup):
+    """ Text of a parsed field: tags become spaces, entities are
+        decoded and whitespace is collapsed
+    """
+    return ' '.join(html.unescape(re.sub('<[^>]*>', ' ', markup)).split())
+
+
+def normalize_questions(questions):
+    """ Parsed questions with the plain text of every text field,
+        comparable with the ground truth
+    """
+    normalized = []
+    for question in questions:
+        question = dict(question)
+        for key in ['stem', 'comment', 'tags']:
+            if key in question:
+                question[key] = _plain_text(question[key])
+        if 'choices' in question:
+            question['choices'] = [{'text': _plain_text(x['text'])}
+                                   for x in question['choices']]
+        if isinstance(question.get('correct_answer'), str):
+            question['correct_answer'] = _plain_text(
+                question['correct_answer']
+            )
+        question['hints'] = [_plain_text(x) for x in question['hints']]
+        tags = question['all_parsed_tags']
+        question['all_parsed_tags'] = {
+            'types': list(tags['types']),
+            'values': [_plain_text(x) for x in tags['values']]
+        }
+        normalized.append(question)
+    return normalized
+
+
+def _docx_paragraph(text):
+    return ('<w:p><w:r><w:t xml:space="preserve">'
+            f'{html.escape(text, quote=False)}</w:t></w:r></w:p>')
+
+
+def _docx_table(rows):
+    n_cols = max(len(x) for x in rows)
+    xml = ['<w:tbl><w:tblPr><w:tblW w:w="0" w:type="auto"/></w:tblPr>',
+           '<w:tblGrid>', '<w:gridCol/>' * n_cols, '</w:tblGrid>']
+    for row in rows:
+        xml.append('<w:tr>')
+        xml.extend(f'<w:tc>{_docx_paragraph(x)}</w:tc>' for x in row)
+        xml.append('</w:tr>')
+    xml.append('</w:tbl>')
+    return ''.join(xml)
+
+
+def write_docx(file_name, questions):
+    """ Writes questions made by generate_questions as a DOCX file
+
+    The body is streamed into the zip file, only images are
+    kept until the end
+
+    Returns the ground truth of the document
+    """
+    images = []
+    with zipfile.ZipFile(file_name, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        zipf.writestr('[Content_Types].xml', DOCX_CONTENT_TYPES)
+        zipf.writestr('_rels/.rels', DOCX_RELS)
+        with zipf.open('word/document.xml', 'w') as f:
+            f.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                f'<w:document xmlns:w="{W_NS}" xmlns:r="{R_NS}" '
+                'xmlns:wp="http://schemas.openxmlformats.org/'
+                'drawingml/2006/wordprocessingDrawing" '
+                'xmlns:a="http://schemas.openxmlformats.org/'
+                'drawingml/2006/main" '
+                'xmlns:pic="http://schemas.openxmlformats.org/'
+                'drawingml/2006/picture"><w:body>' +
+                _docx_paragraph(TITLE)
+            ).encode('utf-8'))
+            for question in questions:
+                xml = []
+                for kind, value in question['items']:
+                    if kind == 'text':
+                        xml.append(_docx_paragraph(value))
+                    elif kind == 'table':
+                        xml.append(_docx_table(value))
+                    else:
+                        images.append(value)
+                        xml.append(DOCX_IMAGE.format(
+                            idx=len(images), size=IMAGE_SIZE * 12700
+                        ))
+                f.write(''.join(xml).encode('utf-8'))
+            f.write(b'<w:sectPr/></w:body></w:document>')
+
+        rels = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/'
+                'package/2006/relationships">']
+        for idx, image in enumerate(images):
+            zipf.writestr('word/' + docx_image_name(idx), image)
+            rels.append(f'<Relationship Id="rIdImg{idx + 1}" '
+                        f'Type="{IMAGE_REL}" '
+                        f'Target="{docx_image_name(idx)}"/>')
+        rels.append('</Relationships>')
+        zipf.writestr('word/_rels/document.xml.rels', ''.join(rels))
+    return ground_truth(questions, docx_image_name)
+
+
+class _PdfPages:
+    """ Places lines, images and tables one below the other,
+        adding pages as they fill up. Text is written in batches, up to
+        the next image (page.insert_text per line is much slower)
+    """
+    def __init__(self):
+        self.doc = fitz.open()
+        self.font = fitz.Font('helv')
+        self.page = None
+        self.writer = None
+        self.y = 0
+
+    def _flush(self):
+        if self.writer is not None:
+            self.writer.write_text(self.page)
+
+    def _reserve(self, height):
+        if self.page is None or self.y + height > PAGE_HEIGHT - MARGIN:
+            self._flush()
+            self.page = self.doc.new_page(width=PAGE_WIDTH,
+                                          height=PAGE_HEIGHT)
+            self.writer = fitz.TextWriter(self.page.rect)
+            self.y = MARGIN
+        y = self.y
+        self.y += height
+        return y
+
+    def text(self, text, x=MARGIN, y=None):
+        if y is None:
+            y = self._reserve(LINE_HEIGHT)
+        self.writer.append((x, y + FONT_SIZE + 2), text, font=self.font,
+                           fontsize=FONT_SIZE)
+
+    def image(self, image):
+        y = self._reserve(IMAGE_SIZE + LINE_HEIGHT - FONT_SIZE)
+        # keep the reading order: text before the image goes first
+        self._flush()
+        self.writer = fitz.TextWriter(self.page.rect)
+        self.page.insert_image(
+            fitz.Rect(MARGIN, y, MARGIN + IMAGE_SIZE, y + IMAGE_SIZE),
+            stream=image
+        )
+
+    def table(self, rows):
+        for row in rows:
+            y = self._reserve(LINE_HEIGHT)
+            for idx, cell in enumerate(row):
+                x = MARGIN + idx * CELL_WIDTH
+                self.page.draw_rect(
+                    fitz.Rect(x, y, x + CELL_WIDTH, y + LINE_HEIGHT)
+                )
+                self.text(cell, x + 4, y)
+
+    def save(self, file_name):
+        self._flush()
+        self.doc.save(file_name, deflate=True)
+        self.doc.close()
+
+
+def write_pdf(file_name, questions, answers_file=None):
+    """ Writes questions made by generate_questions as a PDF file
+
+    Arguments:
+
+    file_name: PDF file to write
+    questions: list returned by generate_questions
+    answers_file: optional PDF file to write the answers into,
+        in the format parse_pdf reads (`<number> - <letter>`).
+        Every question must be multiple choice
+
+    Returns the ground truth of the document
+    """
+    pages = _PdfPages()
+    pages.text(TITLE)
+    for question in questions:
+        for kind, value in question['items']:
+            getattr(pages, kind)(value)
+    pages.save(file_name)
+
+    truth = ground_truth(questions, pdf_image_name)
+    if answers_file is not None:
+        assert all('correct_answer' in x for x in truth),\
+            'An answers file needs multiple choice questions only'
+        pages = _PdfPages()
+        pages.text('Gabarito')
+        for number, question in enumerate(truth, 1):
+            letter = LOWERCASE_CHARS[question['correct_answer']]
+            pages.text(f'{number} - {letter.upper()}')
+        pages.save(answers_file)
+    return truth
+
+
+def generate_documents(output_folder, n_questions, formats=('docx', 'pdf'),
+                       answers=False, **options):
+    """ Writes a questionnaire in each format and its ground truth
+
+    Arguments:
+
+    output_folder: folder to write into
+    n_questions: number of questions
+    formats: 'docx' and / or 'pdf'
+    answers: also write an answers file for the PDF
+    options: passed to generate_questions
+
+    Returns list of dictionaries {'document', 'truth', 'answers'}
+        with the files of each format ('answers' is None for DOCX
+        and without answers)
+    """
+    for fmt in formats:
+        assert fmt in ['docx', 'pdf'], f'Unknown format: {fmt}'
+    os.makedirs(output_folder, exist_ok=True)
+    questions = generate_questions(n_questions, **options)
+
+    name = os.path.join(output_folder, f'synthetic_{n_questions}')
+    documents = []
+    for fmt in formats:
+        document = {'document': f'{name}.{fmt}',
+                    'truth': f'{name}_{fmt}.json',
+                    'answers': None}
+        if fmt == 'docx':
+            truth = write_docx(document['document'], questions)
+        else:
+            if answers:
+                document['answers'] = f'{name}_gab.pdf'
+            truth = write_pdf(document['document'], questions,
+                              document['answers'])
+        with open(document['truth'], 'w', encoding='utf-8') as f:
+            json.dump(truth, f)
+        documents.append(document)
+    return documents
+
+
+def evaluate(document, sp=None):
+    """ Parses a generated document and compares it with its truth
+
+    Arguments:
+
+    document: dictionary returned by generate_documents
+    sp: SimilarityParser to use, a new one if None
+
+    Returns dictionary with the time and peak memory of parsing
+    (from a separate traced run), the number of parsed and
+    expected questions and how many of them match, in order
+    """
+    if sp is None:
+        sp = SimilarityParser()
+    with open(document['truth'], encoding='utf-8') as f:
+        truth = json.load(f)
+
+    def parse():
+        if document['document'].endswith('.docx'):
+            return sp.parse_docx(document['document'])
+        return sp.parse_pdf(document['document'],
+                            answers=document['answers'])
+
+    start = time.perf_counter()
+    questions = parse()
+    time_s = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        parse()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    questions = normalize_questions(questions)
+    return {
+        'time_s': time_s,
+        'peak_mb': peak / 2 ** 20,
+        'questions': len(questions),
+        'expected': len(truth),
+        'matched': sum(x == y for x, y in zip(questions, truth)),
+        'questions_per_s': len(questions) / time_s if time_s > 0 else None
+    }
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description='Generates synthetic DOCX and PDF questionnaires '
+                    'with their ground truth'
+    )
+    parser.add_argument('-o', '--output', default='synthetic',
+                        help='Folder to write the documents into')
+    parser.add_argument('-n', '--questions', nargs='+', type=int,
+                        default=[100, 1000],
+                        help='Number of questions, one document '
+                             'per format for each number')
+    parser.add_argument('--format', nargs='+', choices=['docx', 'pdf'],
+                        default=['docx', 'pdf'],
+                        help='Formats of the documents')
+    parser.add_argument('--choices', type=int, default=5,
+                        help='Number of choices of multiple '
+                             'choice questions')
+    parser.add_argument('--open', type=float, default=0.2,
+                        help='Fraction of open questions')
+    parser.add_argument('--tags', type=float, default=0.5,
+                        help='Probability of each optional tag')
+    parser.add_argument('--images', type=float, default=0.0,
+                        help='Fraction of questions with an image')
+    parser.add_argument('--tables', type=float, default=0.0,
+                        help='Fraction of questions with a table')
+    parser.add_argument('--noise', type=float, default=0.0,
+                        help='Probability of each kind of noise: '
+                             'misspelled headers and tags, mixed '
+                             'delimiters...')
+    parser.add_argument('--no-headers', action='store_true',
+                        help='Number questions without headers, so '
+                             'that the IncrementalParser splits them')
+    parser.add_argument('--answers', action='store_true',
+                        help='Also write an answers file for the PDF. '
+                             'Needs --open 0')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed')
+    parser.add_argument('--evaluate', action='store_true',
+                        help='Parse the documents and report time, '
+                             'memory and matched questions')
+    return parser.parse_args(sys.argv[1:])
+
+
+def main(args):
+    """ Generates (and evaluates) the documents
+
+    Returns list of evaluations, empty without args.evaluate
+    """
+    assert not args.answers or args.open == 0,\
+        'An answers file needs multiple choice questions only (--open 0)'
+    sp = SimilarityParser() if args.evaluate else None
+    results = []
+    for n_questions in args.questions:
+        documents = generate_documents(
+            args.output, n_questions, args.format, args.answers,
+            n_choices=args.choices, open_ratio=args.open,
+            tag_density=args.tags, image_ratio=args.images,
+            table_ratio=args.tables, noise=args.noise,
+            headers=not args.no_headers, seed=args.seed
+        )
+        for document in documents:
+            print(f'Wrote {document["document"]}')
+            if args.evaluate:
+                result = evaluate(document, sp)
+                result['document'] = document['document']
+                results.append(result)
+                print(f'  {result["time_s"]:.3f}s, '
+                      f'{result["peak_mb"]:.1f}MB, '
+                      f'{result["matched"]}/{result["expected"]} '
+                      f'questions match ({result["questions"]} parsed)')
+    return results
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(parse_arguments())
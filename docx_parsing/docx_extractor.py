@@ -0,0 +1,303 @@
+import os
+import re
+import shutil
+import zipfile
+from pathlib import Path
+from contextlib import suppress
+from xml.etree import ElementTree
+
+from docx2python.namespace import qn
+from docx2python.depth_collector import DepthCollector
+from docx2python.docx_context import get_context
+from docx2python.forms import get_checkBox_entry, get_ddList_entry
+from docx2python.text_runs import get_run_style, style_close, style_open
+from docx2python.docx_text import (
+    get_text, _get_bullet_string, TABLE, TABLE_ROW, TABLE_CELL, PARAGRAPH,
+    RUN, TEXT, IMAGE, IMAGEDATA, TAB, FOOTNOTE_REFERENCE, ENDNOTE_REFERENCE,
+    FOOTNOTE, ENDNOTE, HYPERLINK, FORM_CHECKBOX, FORM_DDLIST
+)
+
+
+# elements whose contents docx2python reads when it enters them:
+# they are only handled once they have been read completely
+_WHOLE_ELEMENT_TAGS = {PARAGRAPH, RUN, TEXT, FORM_CHECKBOX, FORM_DDLIST}
+
+
+class _TextCollector:
+    """ Port of docx2python.docx_text.get_text (docx2python 1.27.1,
+        html=True) that can be fed one element at a time and hands
+        out the tables it has finished
+
+    Tables are lists [row][cell][paragraph] of strings, as in
+    DocxContent.document
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.tables = DepthCollector(5)
+
+    def open(self, child):
+        """ What get_text does when entering an element
+        """
+        tables = self.tables
+        context = self.context
+        tag = child.tag
+
+        # set caret depth
+        if tag == TABLE:
+            tables.set_caret(1)
+        elif tag == TABLE_ROW:
+            tables.set_caret(2)
+        elif tag == TABLE_CELL:
+            tables.set_caret(3)
+        elif tag == PARAGRAPH:
+            tables.set_caret(4)
+
+        # open elements
+        if tag == PARAGRAPH:
+            tables.insert(_get_bullet_string(child, context))
+
+        elif tag == RUN:
+            # new text run
+            run_style = get_run_style(child)
+            open_style = getattr(tables, "open_style", ())
+            if run_style != open_style:
+                tables.insert(style_close(open_style))
+                tables.insert(style_open(run_style))
+                tables.open_style = run_style
+
+        elif tag == TEXT:
+            # new text object. oddly enough, these don't all contain text
+            text = child.text if child.text is not None else ""
+            text = text.replace("<", "&lt;")
+            text = text.replace(">", "&gt;")
+            tables.insert(text)
+
+        elif tag == FOOTNOTE:
+            if "separator" not in child.attrib.get(qn("w:type"), "").lower():
+                tables.insert("footnote{})\t".format(child.attrib[qn("w:id")]))
+
+        elif tag == ENDNOTE:
+            if "separator" not in child.attrib.get(qn("w:type"), "").lower():
+                tables.insert("endnote{})\t".format(child.attrib[qn("w:id")]))
+
+        elif tag == HYPERLINK:
+            # look for an href, ignore internal references (anchors)
+            with suppress(KeyError):
+                rId = child.attrib[qn("r:id")]
+                link = context["rId2Target"][rId]
+                tables.insert('<a href="{}">'.format(link))
+
+        elif tag == FORM_CHECKBOX:
+            tables.insert(get_checkBox_entry(child))
+
+        elif tag == FORM_DDLIST:
+            tables.insert(get_ddList_entry(child))
+
+        # add placeholders
+        elif tag == FOOTNOTE_REFERENCE:
+            tables.insert(
+                "----footnote{}----".format(child.attrib[qn("w:id")])
+            )
+
+        elif tag == ENDNOTE_REFERENCE:
+            tables.insert(
+                "----endnote{}----".format(child.attrib[qn("w:id")])
+            )
+
+        elif tag == IMAGE:
+            with suppress(KeyError):
+                rId = child.attrib[qn("r:embed")]
+                image = context["rId2Target"][rId]
+                tables.insert("----{}----".format(image))
+
+        elif tag == IMAGEDATA:
+            with suppress(KeyError):
+                rId = child.attrib[qn("r:id")]
+                image = context["rId2Target"][rId]
+                tables.insert("----{}----".format(image))
+
+        elif tag == TAB:
+            tables.insert("\t")
+
+    def close(self, child):
+        """ What get_text does when leaving an element
+        """
+        tables = self.tables
+        tag = child.tag
+        if tag == PARAGRAPH:
+            tables.insert(style_close(getattr(tables, "open_style", ())))
+            tables.open_style = ()
+
+        if tag in {TABLE_ROW, TABLE_CELL, PARAGRAPH}:
+            tables.raise_caret()
+
+        elif tag == TABLE:
+            tables.set_caret(1)
+
+        elif tag == HYPERLINK:
+            tables.insert("</a>")
+
+    def walk(self, branch):
+        """ get_text's recursion over the children of a complete element
+        """
+        for child in branch:
+            self.open(child)
+            self.walk(child)
+            self.close(child)
+
+    def pop_finished(self, keep_last=True):
+        """ Returns the tables that cannot change anymore (all of them
+            if keep_last is False) and forgets them
+        """
+        tree = self.tables.tree
+        n_finished = len(tree) - 1 if keep_last else len(tree)
+        if n_finished <= 0:
+            return []
+        finished = tree[:n_finished]
+        del tree[:n_finished]
+        return [[[[''.join(paragraph) for paragraph in cell]
+                  for cell in row] for row in table] for table in finished]
+
+
+def _set_content_file(context, file_name):
+    """ Points the relationships of the context to a content file
+    """
+    context["rId2Target"] = {
+        x["Id"]: x["Target"] for x in context["content_path2rels"][file_name]
+    }
+
+
+def _open_content_file(zipf, file_name):
+    """ Opens a content file. Like docx2python, tries again without the
+        first folder: some documents specify the content folder twice
+    """
+    try:
+        return zipf.open(file_name)
+    except KeyError:
+        return zipf.open("/".join(Path(file_name).parts[1:]))
+
+
+def _iter_streamed_tables(xml_file, context):
+    """ Tables of a content file, as get_text would return them,
+        yielded as soon as they are complete. Only the element
+        being read is kept in memory
+    """
+    collector = _TextCollector(context)
+    open_elements = []
+    whole_element = None
+    for event, elem in ElementTree.iterparse(xml_file,
+                                             events=('start', 'end')):
+        if event == 'start':
+            # get_text walks the children of the root element
+            if whole_element is None and len(open_elements) > 0:
+                if elem.tag in _WHOLE_ELEMENT_TAGS:
+                    whole_element = elem
+                else:
+                    collector.open(elem)
+            open_elements.append(elem)
+            continue
+
+        open_elements.pop()
+        if len(open_elements) == 0:
+            break
+        if whole_element is None:
+            collector.close(elem)
+        elif elem is whole_element:
+            collector.open(elem)
+            collector.walk(elem)
+            collector.close(elem)
+            whole_element = None
+        else:
+            # still reading the whole element
+            continue
+
+        elem.clear()
+        open_elements[-1].remove(elem)
+        yield from collector.pop_finished()
+
+    yield from collector.pop_finished(keep_last=False)
+
+
+def iter_docx_tables(file_name):
+    """ Lazily reads the tables of a DOCX file, the same ones
+        docx2python(file_name, html=True).document holds
+
+    The body (word/document.xml) is streamed: each table is yielded
+    as soon as it is complete and is the only part of the document
+    kept in memory. Headers, footers, footnotes and endnotes are small
+    and are read with docx2python. Images are not read, see
+    save_docx_images
+
+    Arguments:
+
+    file_name: DOCX file to read
+
+    Yields tables, lists [row][cell][paragraph] of strings
+    """
+    with zipfile.ZipFile(file_name) as zipf:
+        context = get_context(zipf)
+        context["do_html"] = True
+
+        def file_tables(content_file):
+            _set_content_file(context, content_file)
+            with _open_content_file(zipf, content_file) as f:
+                return get_text(f.read(), context)
+
+        # same order as DocxContent.document
+        for content_file in context["headers"]:
+            yield from file_tables(content_file)
+
+        _set_content_file(context, context["officeDocument"])
+        with _open_content_file(zipf, context["officeDocument"]) as f:
+            yield from _iter_streamed_tables(f, context)
+
+        for files in ['footers', 'footnotes', 'endnotes']:
+            for content_file in context[files]:
+                yield from file_tables(content_file)
+
+
+def table_to_html(table):
+    """ html of a table as in docx2python's html_map,
+        without the index of each paragraph
+    """
+    return '<table border="1">{}</table>'.format(''.join(
+        '<tr>{}</tr>'.format(''.join(
+            '<td>{}</td>'.format(''.join(
+                '<pre>{}</pre>'.format(paragraph) for paragraph in cell
+            )) for cell in row
+        )) for row in table
+    ))
+
+
+def save_docx_images(file_name, image_folder=None, image_store=None):
+    """ Copies the images of a DOCX file, one at a time
+
+    Arguments:
+
+    file_name: DOCX file to read
+    image_folder: folder to copy images to, with their names
+    image_store: ImageStore to save images into instead of image_folder
+
+    Returns dictionary {image name: name of the saved image}
+    """
+    names = {}
+    with zipfile.ZipFile(file_name) as zipf:
+        content_dir = get_context(zipf)["content_dir"]
+        images = [x for x in zipf.namelist()
+                  if re.match(content_dir + r"/media/image\d+", x)]
+        if image_folder is not None and image_store is None:
+            os.makedirs(image_folder, exist_ok=True)
+
+        for image in images:
+            name = os.path.basename(image)
+            if image_store is not None:
+                names[name] = image_store.put(
+                    zipf.read(image), os.path.splitext(name)[1][1:]
+                )
+            elif image_folder is not None:
+                with zipf.open(image) as src,\
+                        open(os.path.join(image_folder, name), 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                names[name] = name
+    return names
@@ -0,0 +1,55 @@
+import os
+import uuid
+import hashlib
+
+
+class ImageStore:
+    """ Content-addressed image folder
+
+    Images are named by the sha256 of their contents, so the logos,
+    headers and figures that documents repeat are stored only once,
+    no matter how many pages or documents use them.
+
+    Several processes can share a store: an image is written to a
+    temporary file and renamed, so readers never see half of it.
+    """
+    def __init__(self, folder):
+        """ Opens (and creates if needed) an image store
+
+        Arguments:
+
+        folder: folder that holds the images
+        """
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    @staticmethod
+    def image_name(img_data, extension):
+        """ Name of an image in the store: <sha256>.<extension>
+        """
+        return f'{hashlib.sha256(img_data).hexdigest()}.{extension}'
+
+    def put(self, img_data, extension, name=None):
+        """ Stores an image if it is not stored yet
+
+        Arguments:
+
+        img_data: encoded image bytes
+        extension: image format, e.g. png
+        name: name computed with image_name, if already known
+
+        Returns the name of the image in the store
+        """
+        if name is None:
+            name = self.image_name(img_data, extension)
+        file_name = os.path.join(self.folder, name)
+        if not os.path.isfile(file_name):
+            tmp_file = os.path.join(self.folder,
+                                    f'.{name}.{uuid.uuid4().hex}.tmp')
+            with open(tmp_file, 'wb') as f:
+                f.write(img_data)
+            os.replace(tmp_file, file_name)
+        return name
+
+    def __contains__(self, name):
+        return os.path.isfile(os.path.join(self.folder, name))
@@ -1,6 +1,9 @@
 import re
+from operator import itemgetter
+from collections import Counter
 
-import numpy as np
+
+NUMBER_PATTERN = re.compile('[0-9]+')
 
 
 class IncrementalParser:
@@ -47,6 +50,13 @@ class IncrementalParser:
         self.max_num_questions = max_num_questions
         self.same_char_list = same_char_list
 
+        # (char, replacement) pairs applied to every line. str.replace
+        # beats str.translate here: translate loses its fast path on
+        # non-ASCII text (accents)
+        self._replacements = [(' ', '')] if ignore_spaces else []
+        self._replacements += [(c, same_char_list[0])
+                               for c in same_char_list[1:]]
+
     def parse_text_lines_inc_numbers(self, lines, lines_without_html):
         """ Parses a list of strings into coherent split indexes
             using as logic splitter an incremental sequence of numbers
@@ -64,53 +74,44 @@ class IncrementalParser:
             'Expected `lines` and `lines_without_html` to have the same length'
 
         question_idxs = []
-        rep_txts = []
 
-        # identify first number and their positions
+        # identify first number and their positions, counting the
+        # strings around them as we go:
+        # (line number, number start, number end, normalized text)
         number_infos = []
+        ahead_windows = Counter()
+        behind_windows = Counter()
+        look_ahead = self.look_ahead
+        # never less than a char, so that the window is empty
+        # only when the number starts the line
+        look_behind = max(self.look_behind, 1)
         for idx, line_no_html in enumerate(lines_without_html):
             cur_txt = line_no_html.strip().lower()
-            if self.ignore_spaces:
-                cur_txt = cur_txt.replace(' ', '')
-            # same chars
-            for c in self.same_char_list:
-                cur_txt = cur_txt.replace(c, self.same_char_list[0])
-            rep_txts.append(cur_txt)
-            first_number_info = re.search('[0-9]+', cur_txt)
+            for c, same_c in self._replacements:
+                cur_txt = cur_txt.replace(c, same_c)
+            first_number_info = NUMBER_PATTERN.search(cur_txt)
             if first_number_info is not None:
-                cur_span = first_number_info.span()
-                number_infos.append({
-                    'line_number': idx,
-                    'span': cur_span,
-                    'value': int(first_number_info.group()),
-                    # reverse the look_behind
-                    'look_behind': cur_txt[:cur_span[0]][::-1],
-                    'look_ahead': cur_txt[
-                        cur_span[1]:cur_span[1] + self.look_ahead
-                    ]
-                })
-
-        look_ahead_texts = [s['look_ahead'] for s in number_infos
-                            if s is not None]
-        ahead_cands = self._find_common_string_pattern(look_ahead_texts, self.look_ahead)
-        look_behind_texts = [s['look_behind'] for s in number_infos
-                             if s is not None]
-        behind_cands = self._find_common_string_pattern(look_behind_texts, self.look_behind)
-
-        ahead_cands = [x for x in ahead_cands if x[1] <= self.max_num_questions]
-        behind_cands = [x for x in behind_cands if x[1] <= self.max_num_questions]
-        # logging.debug(f'Behind string: {behind_cands}\nAhead: {ahead_cands}')
+                start, end = first_number_info.span()
+                number_infos.append((idx, start, end, cur_txt))
+                ahead_windows[cur_txt[end:end + look_ahead]] += 1
+                # reverse the look_behind
+                behind_windows[
+                    cur_txt[max(0, start - look_behind):start][::-1]
+                ] += 1
+
+        ahead_counts = self._count_prefixes(ahead_windows, self.look_ahead)
+        behind_counts = self._count_prefixes(behind_windows,
+                                             self.look_behind)
 
         # find matches
-        behind_str = behind_cands[0][0][::-1]
-        ahead_str = ahead_cands[0][0]
-        for info in number_infos:
-            idx = info['line_number']
-            behind_txt = rep_txts[idx][info['span'][0] - len(behind_str):info['span'][0]]
-            ahead_txt = rep_txts[idx][info['span'][1]:info['span'][1] + len(ahead_str)]
+        behind_str = self._most_common(behind_counts)[0][::-1]
+        ahead_str = self._most_common(ahead_counts)[0]
+        for idx, start, end, cur_txt in number_infos:
+            behind_txt = cur_txt[start - len(behind_str):start]
+            ahead_txt = cur_txt[end:end + len(ahead_str)]
             if behind_str == '':
-                # require ahead match + info['span'][0] == 0
-                if info['span'][0] == 0 and ahead_txt == ahead_str:
+                # require ahead match + start == 0
+                if start == 0 and ahead_txt == ahead_str:
                     question_idxs.append(idx)
             else:
                 # require ahead and behind match
@@ -118,27 +119,36 @@ class IncrementalParser:
                     question_idxs.append(idx)
         return question_idxs
 
-    def _find_common_string_pattern(self, text_list, max_chars):
-        """ Attempts to find a string pattern in a text list
+    @staticmethod
+    def _count_prefixes(text_counts, max_chars):
+        """ Counts the prefixes with up to max_chars characters
+            of counted texts (or the empty string, for empty texts)
 
-        Returns: sorted list with decreasing number of matches
-        """
-        # first attempt: exact match
-        # TODO: implement approximate search?
+        Arguments:
+
+        text_counts: dictionary {text: number of times it was seen},
+            in the order texts were first seen
+        max_chars: length of the longest prefix
 
-        candidates = {}
-        for text in text_list:
+        Returns: Counter {prefix: count}, in the order prefixes
+            were first seen
+        """
+        counts = Counter()
+        for text, n in text_counts.items():
             if len(text) > 0:
-                for k in range(min(len(text), max_chars)):
-                    cur_text = text[0:k + 1]
-                    candidates[cur_text] = candidates.get(cur_text, 0) + 1
+                for k in range(1, min(len(text), max_chars) + 1):
+                    counts[text[:k]] += n
             else:
-                candidates[''] = candidates.get('', 0) + 1
-        cand_text, cand_score = zip(*candidates.items())
-        sorted_idxs = np.argsort(-np.array(cand_score))
-
-        cand_score = [cand_score[x] for x in sorted_idxs]
-        cand_text = [cand_text[x] for x in sorted_idxs]
-        ans = list(zip(cand_text, cand_score))
-        # logging.debug(ans)
-        return ans
+                counts[''] += n
+        return counts
+
+    def _most_common(self, counts):
+        """ Most common string that does not appear more than
+            max_num_questions times. Ties go to the string seen first
+
+        Returns: (string, count)
+        """
+        return max(
+            (x for x in counts.items() if x[1] <= self.max_num_questions),
+            key=itemgetter(1)
+        )
@@ -1,11 +1,34 @@
+import io
 import os
 import re
 import sys
+import gzip
+import json
+import hashlib
+import logging
 import argparse
+import traceback
+import multiprocessing
 
 from tqdm import tqdm
 
-from similarity_parser import SimilarityParser
+from image_store import ImageStore
+from parse_stats import StatsAggregator
+from question_store import QuestionStoreWriter
+from result_cache import ResultCache, hash_file
+from similarity_parser import SimilarityParser, ParserSession,\
+    PARSER_VERSION
+
+
+# per-document fingerprints of incremental builds, inside the output folder
+MANIFEST_FILE = 'manifest.json'
+# images shared by all documents with --shared-images, inside the output folder
+SHARED_IMAGES_FOLDER = '_images'
+# questions of all documents parsed in a run with --format jsonl
+JSONL_FILE = 'questions.jsonl'
+# columnar store of the same questions with --format store
+QUESTION_STORE_FOLDER = 'question_store'
+OUTPUT_FORMATS = ['html', 'jsonl', 'store']
 
 
 def parse_arguments():
@@ -26,15 +49,116 @@ def parse_arguments():
         default='output',
         help='Output folder that will contain the parsed HTML files'
     )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of worker processes used to parse documents in parallel'
+    )
+    parser.add_argument(
+        '--pdf-workers',
+        type=int,
+        default=1,
+        help='Number of processes that extract the pages of each PDF in '
+             'parallel. Only used with 1 document worker'
+    )
+    parser.add_argument(
+        '--unordered',
+        action='store_true',
+        help='With more than 1 worker, collect each document as soon as '
+             'it is done instead of keeping the input order'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=None,
+        help='Folder of a result cache: documents whose contents were '
+             'already parsed with the same configuration are not parsed again'
+    )
+    parser.add_argument(
+        '--cache-size-mb',
+        type=int,
+        default=1024,
+        help='Size of the result cache. Least recently used entries are '
+             'removed when it grows beyond that'
+    )
+    parser.add_argument(
+        '--refresh-cache',
+        action='store_true',
+        help='Ignore cached results, parse everything again '
+             'and update the cache'
+    )
+    parser.add_argument(
+        '--clear-cache',
+        action='store_true',
+        help='Remove all cached results before parsing'
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help='Only parse documents that changed since the last '
+             'incremental run and only rewrite pages that changed'
+    )
+    parser.add_argument(
+        '--stats',
+        default=None,
+        metavar='STATS_FILE',
+        help='Measure every parsing stage and save the timings and '
+             'counters of each document and their totals as JSON'
+    )
+    parser.add_argument(
+        '--shared-images',
+        action='store_true',
+        help=f'Store images once, named by their contents, in '
+             f'<output>/{SHARED_IMAGES_FOLDER} instead of copying them '
+             'into the folder of every document'
+    )
+    parser.add_argument(
+        '--format',
+        nargs='+',
+        choices=OUTPUT_FORMATS,
+        default=['html'],
+        help=f'html: one page per question. jsonl: the questions of '
+             f'every document parsed in the run, one JSON object per line, '
+             f'in <output>/{JSONL_FILE}. store: the same questions in a '
+             f'columnar store with random access (question_store.py), in '
+             f'<output>/{QUESTION_STORE_FOLDER}'
+    )
+    parser.add_argument(
+        '--compress',
+        action='store_true',
+        help='Compress the jsonl output with gzip (.gz)'
+    )
     return parser.parse_args(sys.argv[1:])
 
 
-def _adjust_img_url(x):
-    ans = re.sub('----media/(.+?[^-])----', '<img src="images/\\1">', x)
+# docx2python / pdf_extractor image strings: ----media/<image name>----
+IMAGE_URL_PATTERN = re.compile('----media/(.+?[^-])----')
+
+
+def _adjust_img_url(x, img_folder='images'):
+    if '----media/' not in x:
+        # most strings have no image
+        return x
+    ans = IMAGE_URL_PATTERN.sub(f'<img src="{img_folder}/\\1">', x)
     return ans
 
 
-def replace_image_url(cur_dict):
+def _replace_value_url(value, img_folder='images'):
+    """ replace_image_url for a single value: dictionaries
+        and strings in lists are kept, other list items are dropped
+    """
+    if type(value) == dict:
+        return replace_image_url(value, img_folder)
+    elif type(value) == list:
+        return [_replace_value_url(x, img_folder) for x in value
+                if type(x) in (dict, str)]
+    elif type(value) == str:
+        return _adjust_img_url(value, img_folder)
+    return value
+
+
+def replace_image_url(cur_dict, img_folder='images'):
     """ Replace all docx2python image strings
         with a proper path for visualization
 
@@ -42,127 +166,611 @@ def replace_image_url(cur_dict):
 
     cur_dict: dictionary whose values that contain
         images will get replaced by URLs
+    img_folder: folder of the images, relative to the HTML files
     """
-    new_dict = {}
-    for k in cur_dict:
-        if type(cur_dict[k]) == dict:
-            new_v = replace_image_url(cur_dict[k])
-            new_dict[k] = new_v
-        elif type(cur_dict[k]) == list:
-            new_list = []
-            for item in cur_dict[k]:
-                if type(item) == dict:
-                    new_item = replace_image_url(item)
-                    new_list.append(new_item)
-                elif type(item) == str:
-                    new_item = _adjust_img_url(item)
-                    new_list.append(new_item)
-
-            new_dict[k] = new_list
-        elif type(cur_dict[k]) == str:
-            new_v = _adjust_img_url(cur_dict[k])
-            new_dict[k] = new_v
-        else:
-            new_dict[k] = cur_dict[k]
-    return new_dict
+    return {k: _replace_value_url(v, img_folder) for k, v in cur_dict.items()}
 
 
-def question2html(orig_question, prev_html=None, next_html=None):
-    """ Generates the HTML code to
-        visualize question parsing
+def write_question_html(f, question, prev_html=None, next_html=None,
+                        img_folder='images'):
+    """ Writes the HTML code to visualize question parsing
+
+    Only the fields that are rendered get their image URLs
+    replaced, as they are written. The question is not changed
+
+    Arguments:
+
+    f: text file (or anything with a write method) to write to
+    question: parsed question
+    prev_html, next_html: pages to link to, if any
+    img_folder: folder of the images, relative to the HTML file
     """
-    question = replace_image_url(orig_question)
-    ans = ['<html><body>']
+    def url(value):
+        return _replace_value_url(value, img_folder)
+
+    # fields every question has, read before anything is written
+    stem = url(question['stem'])
+    is_choice = url(question['type']) == 'choice'
+    all_parsed_tags = question['all_parsed_tags']
+
+    f.write('<html><body>')
     # add links to prev and next
     if prev_html is not None:
-        ans.append(f'<a href="{prev_html}">Previous</a>  ')
+        f.write(f'<a href="{prev_html}">Previous</a>  ')
     if next_html is not None:
-        ans.append(f'<a href="{next_html}">Next</a>')
+        f.write(f'<a href="{next_html}">Next</a>')
 
-    ans.append('<br><hr>')
+    f.write('<br><hr>')
 
     # read question text
-    stem = question.pop('stem')
-    ans.append(stem)
-    if question['type'] == 'choice':
-        options = question.pop('choices')
-        correct_answer = question.get('correct_answer', -1)
+    f.write(stem)
+    rendered = {'stem', 'all_parsed_tags'}
+    if is_choice:
+        rendered.add('choices')
+        correct_answer = url(question.get('correct_answer', -1))
+        options = (x for x in question['choices'] if type(x) in (dict, str))
         for idx, opt in enumerate(options):
-            option_text = f'<br><br>Option {idx + 1}:<br>{opt["text"]}'
+            option_text = f'<br><br>Option {idx + 1}:<br>{url(opt["text"])}'
             if correct_answer == idx:
                 option_text = '<p style="color:green; font-weight: bold">' +\
                               f'{option_text}</p>'
-            ans.append(option_text)
+            f.write(option_text)
 
-    ans.append('<hr>Remaining info:<hr><br>')
-    all_parsed_tags = question.pop('all_parsed_tags')
+    f.write('<hr>Remaining info:<hr><br>')
     for k in question:
-        ans.append(f'<br><br>{k}:<br>{question[k]}')
+        if k not in rendered:
+            f.write(f'<br><br>{k}:<br>{url(question[k])}')
+
+    f.write('<br><br><hr>All parsed tags:<hr>')
+    for tag, val in zip(url(all_parsed_tags['types']),
+                        url(all_parsed_tags['values'])):
+        f.write(f'<br><br>{tag}:<br>{val}')
+
+    f.write('</body></html>')
 
-    ans.append('<br><br><hr>All parsed tags:<hr>')
-    for tag, val in zip(all_parsed_tags['types'], all_parsed_tags['values']):
-        ans.append(f'<br><br>{tag}:<br>{val}')
 
-    ans.append('</body></html>')
-    return ''.join(ans)
+def question2html(orig_question, prev_html=None, next_html=None,
+                  img_folder='images'):
+    """ Generates the HTML code to
+        visualize question parsing
+    """
+    ans = io.StringIO()
+    write_question_html(ans, orig_question, prev_html, next_html, img_folder)
+    return ans.getvalue()
+
+
+class _HashingWriter:
+    """ Writes to a text file and hashes what is written
+    """
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def write(self, text):
+        self.sha256.update(text.encode('utf-8'))
+        return self.f.write(text)
 
 
 def _gen_html_name(z):
     return str(z).zfill(8) + '.html'
 
 
+def _list_documents(input_folder):
+    """ Lists the documents to parse in a folder.
+        Answer files (<file>_gab.pdf) are picked up with their questions
+    """
+    return [x for x in os.listdir(input_folder)
+            if x.lower().endswith('.docx')
+            or x.lower().endswith('.pdf')
+            and not x.lower().endswith('_gab.pdf')]
+
+
+def _answers_file(input_folder, document):
+    """ Returns the answers file (<file>_gab.pdf) of a PDF document,
+        None if there is none
+    """
+    if not document.lower().endswith('.pdf'):
+        return None
+    ans_candidate = os.path.join(
+        input_folder, document
+    ).replace('.pdf', '_gab.pdf')
+
+    if os.path.isfile(ans_candidate):
+        return ans_candidate
+    return None
+
+
+def parse_document(sp, input_folder, document, output_folder,
+                   previous_pages=None, image_store=None, formats=('html',),
+                   questions_hook=None):
+    """ Parses a single document and writes one HTML file per question
+
+    Arguments:
+
+    sp: SimilarityParser used to parse the document
+    input_folder: folder containing the document
+    document: name of the DOCX or PDF file to parse
+    output_folder: folder that will contain one subfolder per document
+    previous_pages: optional {html name: sha256} of the pages written by
+        a previous run. Pages whose contents did not change are not
+        written again and pages that no longer exist are removed
+    image_store: ImageStore shared by all documents, inside output_folder.
+        If None, images are saved in the folder of each document
+    formats: output formats (see OUTPUT_FORMATS). HTML files are
+        only written if 'html' is one of them
+    questions_hook: optional function called with the parsed questions
+
+    Returns dictionary {html name: sha256 of its contents}
+    """
+    cur_out_folder = os.path.join(
+        output_folder, document.split('.')[0]
+    )
+    if image_store is None:
+        img_folder = 'images'
+        cur_out_imgs = os.path.join(cur_out_folder, img_folder)
+        os.makedirs(cur_out_imgs, exist_ok=True)
+    else:
+        img_folder = os.path.relpath(
+            image_store.folder, cur_out_folder
+        ).replace(os.sep, '/')
+        cur_out_imgs = None
+        os.makedirs(cur_out_folder, exist_ok=True)
+    if document.lower().endswith('.docx'):
+        cur_parse = sp.parse_docx(
+            os.path.join(input_folder, document),
+            image_folder=cur_out_imgs,
+            image_store=image_store
+        )
+    elif document.lower().endswith('.pdf'):
+        cur_parse = sp.parse_pdf(
+            os.path.join(input_folder, document),
+            image_folder=cur_out_imgs,
+            answers=_answers_file(input_folder, document),
+            image_store=image_store
+        )
+
+    if questions_hook is not None:
+        questions_hook(cur_parse)
+    if previous_pages is None:
+        previous_pages = {}
+
+    pages = {}
+    if 'html' in formats:
+        pages = _write_pages(cur_parse, cur_out_folder, img_folder,
+                             previous_pages)
+
+    for html_name in previous_pages:
+        html_file = os.path.join(cur_out_folder, html_name)
+        if html_name not in pages and os.path.isfile(html_file):
+            os.remove(html_file)
+
+    return pages
+
+
+def _write_pages(questions, cur_out_folder, img_folder, previous_pages):
+    """ Writes one HTML file per question, skipping the
+        files whose contents are in previous_pages already
+
+    Returns dictionary {html name: sha256 of its contents}
+    """
+    pages = {}
+    for idx, question in enumerate(questions):
+        html_name = _gen_html_name(idx + 1)
+        prev_html = _gen_html_name(idx) if idx > 0 else None
+        next_html = _gen_html_name(idx + 2)\
+            if idx + 1 < len(questions) else None
+
+        html_file = os.path.join(cur_out_folder, html_name)
+        if html_name in previous_pages and os.path.isfile(html_file):
+            # the page may not need to be written again
+            cur_txt = question2html(
+                question, prev_html=prev_html, next_html=next_html,
+                img_folder=img_folder
+            )
+            pages[html_name] = \
+                hashlib.sha256(cur_txt.encode('utf-8')).hexdigest()
+            if previous_pages[html_name] != pages[html_name]:
+                with open(html_file, 'w', encoding='utf-8') as f:
+                    f.write(cur_txt)
+            continue
+
+        # new page: written as it is rendered
+        with open(html_file, 'w', encoding='utf-8') as f:
+            writer = _HashingWriter(f)
+            write_question_html(
+                writer, question, prev_html=prev_html,
+                next_html=next_html, img_folder=img_folder
+            )
+        pages[html_name] = writer.sha256.hexdigest()
+    return pages
+
+
+def _file_fingerprint(file_name, previous=None):
+    """ Size, modification time and sha256 of a file. The hash is
+        taken from the previous fingerprint if size and time match
+    """
+    stat = os.stat(file_name)
+    if previous is not None and previous['size'] == stat.st_size\
+            and previous['mtime'] == stat.st_mtime:
+        return previous
+    return {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'sha256': hash_file(file_name)
+    }
+
+
+def _document_fingerprint(input_folder, document, previous=None,
+                          shared_images=False, formats=('html',)):
+    """ Fingerprint of everything a document is parsed from
+    """
+    previous_files = {} if previous is None else previous['files']
+    files = {}
+    for file_name in [os.path.join(input_folder, document),
+                      _answers_file(input_folder, document)]:
+        if file_name is not None:
+            name = os.path.basename(file_name)
+            files[name] = _file_fingerprint(
+                file_name, previous_files.get(name)
+            )
+    return {'parser_version': PARSER_VERSION,
+            'shared_images': shared_images,
+            'formats': sorted(set(formats)),
+            'files': files}
+
+
+def _same_inputs(fingerprint1, fingerprint2):
+    """ Compares contents only, times may differ
+    """
+    def contents(fingerprint):
+        return (fingerprint['parser_version'],
+                fingerprint.get('shared_images', False),
+                fingerprint.get('formats', ['html']),
+                {k: (v['size'], v['sha256'])
+                 for k, v in fingerprint['files'].items()})
+    return contents(fingerprint1) == contents(fingerprint2)
+
+
+def _load_manifest(output_folder):
+    """ Reads the manifest of an incremental build.
+        Empty manifest if there is none yet
+    """
+    manifest_file = os.path.join(output_folder, MANIFEST_FILE)
+    if os.path.isfile(manifest_file):
+        with open(manifest_file, encoding='utf-8') as f:
+            return json.load(f)
+    return {'documents': {}}
+
+
+def _save_manifest(output_folder, manifest):
+    manifest_file = os.path.join(output_folder, MANIFEST_FILE)
+    with open(manifest_file + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+
+def _is_up_to_date(output_folder, document, entry, fingerprint):
+    """ Checks if a document's inputs are unchanged since the
+        last run and all of its pages are still there
+    """
+    if entry is None or not _same_inputs(entry['inputs'], fingerprint):
+        return False
+    cur_out_folder = os.path.join(output_folder, document.split('.')[0])
+    return all(os.path.isfile(os.path.join(cur_out_folder, x))
+               for x in entry['pages'])
+
+
+def _save_stats(stats_file, aggregator):
+    """ Writes the stats of a run and prints where the time went
+    """
+    summary = aggregator.summary()
+    with open(stats_file, 'w', encoding='utf-8') as f:
+        json.dump({'summary': summary, 'documents': aggregator.documents},
+                  f, indent=1)
+
+    print(f'Parsed {summary["documents"]} documents in '
+          f'{summary["total_time"]:.2f}s')
+    for stage, seconds in sorted(summary['stage_times'].items(),
+                                 key=lambda x: -x[1]):
+        print(f'  {stage}: {seconds:.2f}s')
+
+
+def _jsonl_file(output_folder, compress=False):
+    jsonl_file = os.path.join(output_folder, JSONL_FILE)
+    return jsonl_file + '.gz' if compress else jsonl_file
+
+
+def _open_text(file_name, mode, compress=False):
+    """ Opens a text file, gzip compressed or not
+    """
+    if compress:
+        return gzip.open(file_name, mode + 't', encoding='utf-8')
+    return open(file_name, mode, encoding='utf-8', buffering=2 ** 20)
+
+
+def _open_jsonl(output_folder, compress=False, keep_documents=None):
+    """ Opens the JSONL file of a run. It is written aside and only
+        replaces the previous one in _close_jsonl
+
+    Arguments:
+
+    output_folder, compress: where the file goes and whether it is gzipped
+    keep_documents: optional ids of documents whose lines are copied
+        from the previous file (compressed or not), e.g. the documents
+        that did not change in an incremental run. They come first
+
+    Returns (file, ids of keep_documents not found in the previous file)
+    """
+    f = _open_text(_jsonl_file(output_folder, compress) + '.tmp', 'w',
+                   compress)
+    if keep_documents is None:
+        return f, []
+
+    previous = [x for x in [_jsonl_file(output_folder, compress),
+                            _jsonl_file(output_folder, not compress)]
+                if os.path.isfile(x)]
+    keep = set(keep_documents)
+    found = set()
+    if len(previous) > 0:
+        with _open_text(previous[0], 'r',
+                        previous[0].endswith('.gz')) as previous_file:
+            for line in previous_file:
+                document = json.loads(line)['document_id']
+                if document in keep:
+                    f.write(line)
+                    found.add(document)
+        f.flush()
+    return f, [x for x in keep_documents if x not in found]
+
+
+def _close_jsonl(f, output_folder, compress=False):
+    """ Closes a file opened with _open_jsonl and puts it in place
+    """
+    f.close()
+    jsonl_file = _jsonl_file(output_folder, compress)
+    os.replace(jsonl_file + '.tmp', jsonl_file)
+
+
+def _write_jsonl(f, document, questions):
+    """ Appends the questions of a document to a JSONL file,
+        one {document_id, question_index, question} per line,
+        and flushes them so that readers see whole documents
+    """
+    for idx, question in enumerate(questions):
+        f.write(json.dumps({'document_id': document,
+                            'question_index': idx,
+                            'question': question},
+                           ensure_ascii=False))
+        f.write('\n')
+    f.flush()
+
+
+def _keeps_questions(formats):
+    """ Whether the questions are needed after writing the pages
+    """
+    return 'jsonl' in formats or 'store' in formats
+
+
+# each worker process builds its own parser once,
+# from the session prepared by the main process
+_worker_parser = None
+# ParseStats collected while parsing the current document
+_worker_stats = []
+
+
+def _init_worker(session, cache, collect_stats=False):
+    global _worker_parser
+    _worker_parser = SimilarityParser(
+        session=session, cache=cache,
+        stats_hook=_worker_stats.append if collect_stats else None
+    )
+
+
+def _drain_stats(stats):
+    """ Returns the collected stats as dictionaries and forgets them
+    """
+    ans = [x.to_dict() for x in stats]
+    stats.clear()
+    return ans
+
+
+def _run_job(sp, stats, job):
+    """ Parses the document of a job. Failures are reported back
+        so that one bad document does not abort the run
+
+    Arguments:
+
+    sp: SimilarityParser to use
+    stats: list the stats_hook of sp appends to
+    job: (input_folder, document, output_folder, previous_pages,
+        image_store, formats)
+
+    Returns tuple (document, pages, questions, error, stats). Questions
+    are only kept for the jsonl and store formats
+    """
+    input_folder, document, output_folder, previous_pages, image_store,\
+        formats = job
+    questions = []
+    try:
+        pages = parse_document(
+            sp, input_folder, document, output_folder,
+            previous_pages, image_store, formats,
+            questions.extend if _keeps_questions(formats) else None
+        )
+        return document, pages, questions, None, _drain_stats(stats)
+    except Exception:
+        return document, None, None, traceback.format_exc(),\
+            _drain_stats(stats)
+
+
+def _parse_document_job(job):
+    """ Worker entry point, see _run_job
+    """
+    return _run_job(_worker_parser, _worker_stats, job)
+
+
+def _parse_with_workers(args, jobs, session, cache):
+    """ Spreads documents across a process pool
+
+    Yields tuples (document, pages, questions, error, stats)
+    """
+    with multiprocessing.Pool(
+            args.workers, initializer=_init_worker,
+            initargs=(session, cache, args.stats is not None)
+    ) as pool:
+        if args.unordered:
+            results = pool.imap_unordered(_parse_document_job, jobs)
+        else:
+            results = pool.imap(_parse_document_job, jobs)
+
+        yield from results
+
+
+def _parse_sequentially(jobs, session, cache, pdf_workers=1,
+                        collect_stats=False):
+    """ Parses documents one after the other
+
+    Yields tuples (document, pages, questions, error, stats)
+    """
+    stats = []
+    sp = SimilarityParser(session=session, cache=cache,
+                          pdf_workers=pdf_workers,
+                          stats_hook=stats.append if collect_stats else None)
+    for job in jobs:
+        yield _run_job(sp, stats, job)
+
+
 def main(args):
+    """ Parses all documents in args.input into args.output
+
+    Returns the list of documents that could not be parsed
+    """
     assert os.path.isdir(args.input),\
         f'Input folder not found: {args.input}'
-    sp = SimilarityParser()
-    doc_files = [x for x in os.listdir(args.input)
-                 if x.lower().endswith('.docx')
-                 or x.lower().endswith('.pdf')
-                 and not x.lower().endswith('_gab.pdf')]
+    doc_files = _list_documents(args.input)
     os.makedirs(args.output, exist_ok=True)
 
-    pbar = tqdm(doc_files)
-    for document in pbar:
-        # show user what document is being processed
-        pbar.set_description(f'File: {document}')
+    cache = None
+    if args.cache_dir is not None:
+        cache = ResultCache(args.cache_dir, args.cache_size_mb,
+                            refresh=args.refresh_cache)
+        if args.clear_cache:
+            cache.clear()
+
+    session = ParserSession()
 
-        cur_out_folder = os.path.join(
-            args.output, document.split('.')[0]
+    image_store = None
+    if args.shared_images:
+        image_store = ImageStore(
+            os.path.join(args.output, SHARED_IMAGES_FOLDER)
         )
-        cur_out_imgs = os.path.join(cur_out_folder, 'images')
-        os.makedirs(cur_out_imgs, exist_ok=True)
-        if document.lower().endswith('.docx'):
-            cur_parse = sp.parse_docx(
-                os.path.join(args.input, document),
-                image_folder=cur_out_imgs
-            )
-        elif document.lower().endswith('.pdf'):
-            ans_file = None
-            ans_candidate = os.path.join(
-                args.input, document
-            ).replace('.pdf', '_gab.pdf')
-
-            if os.path.isfile(ans_candidate):
-                ans_file = ans_candidate
-
-            cur_parse = sp.parse_pdf(
-                os.path.join(args.input, document),
-                image_folder=cur_out_imgs,
-                answers=ans_file
+
+    manifest = None
+    fingerprints = {}
+    if args.incremental:
+        manifest = _load_manifest(args.output)
+        previous = manifest['documents']
+        # documents that are gone from the input are forgotten
+        manifest['documents'] = {}
+
+    jobs = []
+    up_to_date = []
+    for document in doc_files:
+        previous_pages = None
+        if manifest is not None:
+            entry = previous.get(document)
+            fingerprint = _document_fingerprint(
+                args.input, document,
+                None if entry is None else entry['inputs'],
+                args.shared_images, args.format
             )
+            if _is_up_to_date(args.output, document, entry, fingerprint):
+                entry['inputs'] = fingerprint
+                manifest['documents'][document] = entry
+                up_to_date.append(document)
+                continue
+
+            fingerprints[document] = fingerprint
+            if entry is not None:
+                previous_pages = entry['pages']
+        jobs.append((args.input, document, args.output, previous_pages,
+                     image_store, args.format))
+
+    if manifest is not None:
+        logging.info(f'{len(up_to_date)} of {len(doc_files)} '
+                     'documents are up to date')
+
+    if args.workers > 1:
+        results = _parse_with_workers(args, jobs, session, cache)
+    else:
+        results = _parse_sequentially(jobs, session, cache,
+                                      args.pdf_workers,
+                                      args.stats is not None)
 
-        for idx, question in enumerate(cur_parse):
-            html_name = _gen_html_name(idx + 1)
-            prev_html = _gen_html_name(idx) if idx > 0 else None
-            next_html = _gen_html_name(idx + 2)\
-                if idx + 1 < len(cur_parse) else None
-
-            with open(os.path.join(cur_out_folder, html_name),
-                      'w', encoding='utf-8') as f:
-                cur_txt = question2html(
-                    question, prev_html=prev_html, next_html=next_html
-                )
-                f.write(cur_txt)
+    # unchanged documents are carried over from the previous outputs
+    keep_documents = up_to_date if manifest is not None else None
+    missing = []
+    jsonl = None
+    if 'jsonl' in args.format:
+        jsonl, missing = _open_jsonl(args.output, args.compress,
+                                     keep_documents)
+    store = None
+    if 'store' in args.format:
+        store = QuestionStoreWriter(
+            os.path.join(args.output, QUESTION_STORE_FOLDER),
+            keep_documents
+        )
+        missing += store.missing_documents
+    if manifest is not None and len(missing) > 0:
+        # e.g. an interrupted run: parse them again next time
+        missing = sorted(set(missing))
+        logging.warning(f'{len(missing)} up to date documents are missing '
+                        f'from the previous outputs and will be parsed '
+                        f'again by the next run: {missing}')
+        for document in missing:
+            del manifest['documents'][document]
+
+    failed = []
+    aggregator = StatsAggregator()
+    try:
+        pbar = tqdm(results, total=len(jobs))
+        for document, pages, questions, error, stats in pbar:
+            # show user what document is being processed
+            pbar.set_description(f'File: {document}')
+            for x in stats:
+                aggregator.add(x)
+            if error is not None:
+                logging.error(f'Could not parse {document}:\n{error}')
+                failed.append(document)
+                # keep the previous entry: the pages are still there
+                if manifest is not None and document in previous:
+                    manifest['documents'][document] = previous[document]
+                continue
+
+            if jsonl is not None:
+                _write_jsonl(jsonl, document, questions)
+            if store is not None:
+                store.add_document(document, questions)
+            if manifest is not None:
+                manifest['documents'][document] = {
+                    'inputs': fingerprints[document],
+                    'pages': pages
+                }
+    finally:
+        if jsonl is not None:
+            _close_jsonl(jsonl, args.output, args.compress)
+        if store is not None:
+            store.close()
+        if manifest is not None:
+            _save_manifest(args.output, manifest)
+        if args.stats is not None:
+            _save_stats(args.stats, aggregator)
+
+    if len(failed) > 0:
+        logging.warning(
+            f'{len(failed)} of {len(doc_files)} documents failed: {failed}'
+        )
+    return failed
 
 
 if __name__ == '__main__':  # pragma: no cover
@@ -0,0 +1,136 @@
+import time
+
+import text_utils
+
+
+class ParseStats:
+    """ What happened while parsing one document
+
+    Attributes:
+
+    file_name: parsed file
+    method: 'parse_pdf' or 'parse_docx'
+    stage_times: dictionary {stage: wall time in seconds}. Stages are
+        extract (PyMuPDF / docx2python), html_to_lines (DOCX tables),
+        html_to_text, semantic_scores, split_questions,
+        incremental_parser, parse_questions and answers
+    counters: dictionary {name: count}: lines, questions,
+        answer_lines, distance_computations, distance_cache_hits
+    incremental_fallback: True if the IncrementalParser had to split
+        the document
+    answers: outcome of matching answers: None (no answers file),
+        'matched' or 'count_mismatch'
+    cache_hit: True if the result came from the result cache
+    total_time: wall time of the whole call
+
+    Stages are timed with a stopwatch: start_stage closes the running
+    stage, so only one clock read is needed per switch. Time spent by
+    the caller of a lazy parse (between questions) is not counted.
+    """
+
+    def __init__(self, file_name, method):
+        self.file_name = file_name
+        self.method = method
+        self.stage_times = {}
+        self.counters = {}
+        self.incremental_fallback = False
+        self.answers = None
+        self.cache_hit = False
+        self.total_time = None
+
+        self._stage = None
+        self._stage_start = None
+        self._start = time.perf_counter()
+        self._distance_info = text_utils.word_distance_cache_info()
+
+    def start_stage(self, name):
+        """ Closes the running stage (if any) and starts timing `name`.
+            None only stops the running stage
+        """
+        now = time.perf_counter()
+        if self._stage is not None:
+            self.stage_times[self._stage] =\
+                self.stage_times.get(self._stage, 0) +\
+                now - self._stage_start
+        self._stage = name
+        self._stage_start = now
+
+    def stop_stage(self):
+        self.start_stage(None)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def finish(self):
+        """ Stops timing and collects the counters kept elsewhere
+        """
+        self.stop_stage()
+        self.total_time = time.perf_counter() - self._start
+        # distances are computed by the (process wide) distance cache
+        info = text_utils.word_distance_cache_info()
+        self.count('distance_computations',
+                   info.misses - self._distance_info.misses)
+        self.count('distance_cache_hits',
+                   info.hits - self._distance_info.hits)
+
+    def to_dict(self):
+        """ JSON serializable version, e.g. for a metrics system
+        """
+        return {
+            'file_name': self.file_name,
+            'method': self.method,
+            'stage_times': dict(self.stage_times),
+            'counters': dict(self.counters),
+            'incremental_fallback': self.incremental_fallback,
+            'answers': self.answers,
+            'cache_hit': self.cache_hit,
+            'total_time': self.total_time
+        }
+
+
+class StatsAggregator:
+    """ Sums the stats of many documents. Can be used
+        directly as the stats_hook of a SimilarityParser
+    """
+
+    def __init__(self):
+        self.documents = []
+
+    def __call__(self, stats):
+        self.add(stats)
+
+    def add(self, stats):
+        """ Adds ParseStats (or the result of its to_dict)
+        """
+        if isinstance(stats, ParseStats):
+            stats = stats.to_dict()
+        self.documents.append(stats)
+
+    def summary(self):
+        """ Totals over all documents
+
+        Returns dictionary with the number of documents, total time,
+        total time of each stage, counters, number of cache hits and
+        incremental fallbacks and a count of each answers outcome
+        """
+        stage_times = {}
+        counters = {}
+        answers = {}
+        for doc in self.documents:
+            for k, v in doc['stage_times'].items():
+                stage_times[k] = stage_times.get(k, 0) + v
+            for k, v in doc['counters'].items():
+                counters[k] = counters.get(k, 0) + v
+            if doc['answers'] is not None:
+                answers[doc['answers']] = answers.get(doc['answers'], 0) + 1
+
+        return {
+            'documents': len(self.documents),
+            'total_time': sum(x['total_time'] for x in self.documents),
+            'stage_times': stage_times,
+            'counters': counters,
+            'cache_hits': sum(x['cache_hit'] for x in self.documents),
+            'incremental_fallbacks': sum(x['incremental_fallback']
+                                         for x in self.documents),
+            'answers': answers
+        }
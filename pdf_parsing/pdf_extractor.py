@@ -1,14 +1,73 @@
-import io
 import os
+import re
+import logging
+import threading
+import collections
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
 import fitz
-from PIL import Image
 
 
-def _save_png_from_b64(file_name, extension, img_data):
-    # im = Image.open(io.BytesIO(base64.b64decode(img_data)))
-    im = Image.open(io.BytesIO(img_data))
-    im.save(file_name + f'.{extension}', extension)
+# background threads that write images and how many
+# images can wait for them before text extraction blocks
+IMAGE_WRITER_THREADS = 4
+IMAGE_QUEUE_SIZE = 32
+# page ranges handed to each process when extracting in parallel
+PAGE_RANGES_PER_WORKER = 4
+# page ranges being extracted or waiting to be read, per process.
+# Bounds the memory held by results (with image bytes) that are
+# done before the ranges that come first
+RANGES_IN_FLIGHT_PER_WORKER = 2
+
+# text extraction without image data, see _text_only_blocks
+TEXT_ONLY_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+# extension PyMuPDF gives to images stored with each PDF filter
+IMAGE_FILTER_EXTENSIONS = {'DCTDecode': 'jpeg', 'FlateDecode': 'png'}
+
+
+def _save_image(file_name, img_data):
+    """ Saves image bytes as they are: PyMuPDF already
+        returns them encoded in the format of their extension
+    """
+    with open(file_name, 'wb') as f:
+        f.write(img_data)
+
+
+class _ImageWriter:
+    """ Saves images in background threads so that text
+    extraction does not wait on disk writes.
+
+    At most `queue_size` images are held in memory: `submit`
+    blocks when the writers fall behind. `close` waits for all
+    pending writes, logs every error and raises the first one.
+    """
+    def __init__(self, threads=IMAGE_WRITER_THREADS,
+                 queue_size=IMAGE_QUEUE_SIZE):
+        self.executor = ThreadPoolExecutor(threads)
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.errors = []
+
+    def submit(self, save_function, *args):
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(save_function, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self.slots.release()
+        if future.exception() is not None:
+            self.errors.append(future.exception())
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for e in self.errors:
+            logging.error(f'Could not save image: {e}')
+        if len(self.errors) > 0:
+            raise self.errors[0]
 
 
 def _build_html_from_span(span, dot_single_char=True):
@@ -35,36 +94,233 @@ def _build_html_from_span(span, dot_single_char=True):
     return ''.join(ans)
 
 
-def read_pdf_lines(file, image_folder=None):
-    """ Reads PDF lines from a file
+def _unreferenced_image_extension(page):
+    """ Extension that get_text('dict') gives to the images of a page
+        that have no xref: inline images and the images MuPDF renders
+        itself (e.g. transparency groups with a blend mode). They are
+        converted to png, unless they are stored as JPEG
+
+    Returns 'png', None if the page (or one of its forms) may hold
+    JPEG inline images
+    """
+    streams = [page.read_contents()] + [
+        page.parent.xref_stream(x[0]) for x in page.get_xobjects()
+    ]
+    for stream in streams:
+        if stream is not None and re.search(rb'\sID\s', stream) and\
+                (b'/DCT' in stream or b'/JPX' in stream):
+            return None
+    return 'png'
+
+
+def _text_only_blocks(page):
+    """ Text blocks of a page plus placeholders for its images,
+        without loading the image contents (which is most of the
+        cost of get_text('dict') on pages with images)
+
+    Text extracted without images can merge the blocks that an image
+    separates, so image positions come from the block list of a text
+    page that keeps images (cheap: images are only referenced there)
+    and lines are matched to blocks by their text.
+
+    Returns blocks like get_text('dict'), image blocks without 'image'.
+    None if the result could differ from get_text('dict'), e.g. for
+    images whose extension is not known beforehand
+    """
+    all_blocks = page.get_textpage(flags=fitz.TEXTFLAGS_DICT).extractBLOCKS()
+    text_blocks = page.get_textpage(flags=TEXT_ONLY_FLAGS).extractDICT()
+    text_blocks = text_blocks['blocks']
+    n_images = sum(1 for b in all_blocks if b[6] == 1)
+    if n_images == 0:
+        return text_blocks
+
+    image_info = page.get_image_info(xrefs=True)
+    if len(image_info) != n_images:
+        return None
+    filters = {x[0]: x[8] for x in page.get_images(full=True)}
+
+    lines = [x for b in text_blocks for x in b['lines']]
+    blocks = []
+    line_idx = 0
+    image_idx = 0
+    # found with the first image without xref
+    unreferenced_ext = ''
+    for b in all_blocks:
+        if b[6] == 1:
+            info = image_info[image_idx]
+            image_idx += 1
+            if info['xref'] == 0:
+                if unreferenced_ext == '':
+                    unreferenced_ext = _unreferenced_image_extension(page)
+                ext = unreferenced_ext
+            else:
+                ext = IMAGE_FILTER_EXTENSIONS.get(filters.get(info['xref']))
+            if ext is None or\
+                    fitz.Rect(info['bbox']) != fitz.Rect(b[:4]):
+                return None
+            blocks.append({
+                'number': b[5], 'type': 1, 'bbox': info['bbox'],
+                'width': info['width'], 'height': info['height'], 'ext': ext
+            })
+            continue
+
+        # blocks text is each line followed by a line break
+        block_text = ''
+        first_line = line_idx
+        while line_idx < len(lines) and len(block_text) < len(b[4]):
+            block_text += ''.join(
+                x['text'] for x in lines[line_idx]['spans']
+            ) + '\n'
+            line_idx += 1
+        if block_text != b[4]:
+            return None
+        blocks.append({'number': b[5], 'type': 0, 'bbox': b[:4],
+                       'lines': lines[first_line:line_idx]})
+
+    if line_idx != len(lines):
+        return None
+    return blocks
+
+
+def iter_pdf_lines(file, image_folder=None, image_store=None, workers=1):
+    """ Lazily reads PDF lines from a file, page by page
+
+    The lines of a page are only yielded once the whole page
+    has been converted, so that its text dictionary (and the
+    image blobs it holds) can be released before moving on.
+    Images are saved in the background; all of them are on
+    disk once the last line has been consumed. Without image_folder
+    and image_store, images are not even loaded: only their
+    placeholders are emitted
 
     Arguments:
 
     file: file to read from
+    image_folder: folder to save images
+    image_store: ImageStore to save images into instead of
+        image_folder. Images are then named by their contents
+    workers: number of processes that extract page ranges in
+        parallel. The lines are the same as with 1 worker
+    """
+    save_images = image_folder is not None or image_store is not None
+    writer = _ImageWriter() if save_images else None
+    completed = False
+    try:
+        yield from _iter_pages(file, image_folder, image_store, writer,
+                               workers)
+        completed = True
+    finally:
+        if writer is not None:
+            if completed:
+                writer.close()
+            else:
+                # abandoned or failed: still wait for the writes
+                writer.executor.shutdown(wait=True)
+
+
+def _iter_pages(file, image_folder, image_store, writer, workers):
+    """ Yields the lines of iter_pdf_lines, numbering images
+        and handing them to the writer
     """
-    all_lines = []
-    pdf_file = fitz.open(file)
     image_idx = 1
-    for page in pdf_file:
-        # text = page.get_text('html')
-        text = page.get_text('dict')
-        for b in text['blocks']:
-            lines = [x for x in b.get('lines', [])]
-            image = b.get('image', None)
-            lines = [' '.join([
-                _build_html_from_span(z) for z in x['spans']
-            ]) for x in lines]
-
-            all_lines += lines
-            if image is not None:
-                img_name = f'{str(image_idx).zfill(8)}'
-                all_lines.append(f'----media/{img_name}.{b["ext"]}----')
-                if image_folder is not None:
-                    _save_png_from_b64(
+    for items in _iter_page_items(file, writer is not None, workers):
+        page_lines = []
+        for item in items:
+            if isinstance(item, str):
+                page_lines.append(item)
+                continue
+
+            ext, image = item
+            if image_store is not None:
+                img_name = image_store.image_name(image, ext)
+                writer.submit(image_store.put, image, ext, img_name)
+            else:
+                img_name = f'{str(image_idx).zfill(8)}.{ext}'
+                if writer is not None:
+                    writer.submit(
+                        _save_image,
                         os.path.join(image_folder, img_name),
-                        b['ext'],
                         image
                     )
-                image_idx += 1
+            page_lines.append(f'----media/{img_name}----')
+            image_idx += 1
+
+        del items
+        yield from page_lines
+
+
+def _page_items(page, with_images):
+    """ Converts a page into a list of HTML lines and
+        (extension, image bytes) tuples, in reading order.
+        Image bytes are None if with_images is False
+    """
+    # text = page.get_text('html')
+    text = None
+    if not with_images:
+        text = _text_only_blocks(page)
+    if text is None:
+        text = page.get_text('dict')['blocks']
+
+    items = []
+    for b in text:
+        items += [' '.join([
+            _build_html_from_span(z) for z in x['spans']
+        ]) for x in b.get('lines', [])]
+        if b['type'] == 1:
+            items.append((b['ext'], b.get('image', None)))
+    return items
+
+
+def _page_range_items(job):
+    """ Worker entry point: _page_items of a range of pages
+    """
+    file, start, stop, with_images = job
+    with fitz.open(file) as pdf_file:
+        return [_page_items(pdf_file[idx], with_images)
+                for idx in range(start, stop)]
 
-    return all_lines
+
+def _iter_page_items(file, with_images, workers):
+    """ Yields _page_items of each page, in page order.
+        With more than 1 worker, ranges of pages are
+        extracted in parallel by processes that each
+        open the file on their own
+    """
+    if workers > 1 and multiprocessing.current_process().daemon:
+        # e.g. inside the worker of a multiprocessing.Pool
+        logging.debug('Daemonic process: extracting pages sequentially')
+        workers = 1
+
+    with fitz.open(file) as pdf_file:
+        if workers <= 1:
+            for page in pdf_file:
+                yield _page_items(page, with_images)
+            return
+        n_pages = pdf_file.page_count
+
+    # a few ranges per worker to even out page costs
+    range_size = max(1, -(-n_pages // (workers * PAGE_RANGES_PER_WORKER)))
+    jobs = [(file, start, min(start + range_size, n_pages), with_images)
+            for start in range(0, n_pages, range_size)]
+    n_processes = min(workers, len(jobs))
+    with multiprocessing.Pool(n_processes) as pool:
+        pending = collections.deque()
+        for job in jobs:
+            if len(pending) >= n_processes * RANGES_IN_FLIGHT_PER_WORKER:
+                yield from pending.popleft().get()
+            pending.append(pool.apply_async(_page_range_items, (job,)))
+        while len(pending) > 0:
+            yield from pending.popleft().get()
+
+
+def read_pdf_lines(file, image_folder=None, image_store=None, workers=1):
+    """ Reads PDF lines from a file
+
+    Arguments:
+
+    file: file to read from
+    image_folder: folder to save images
+    image_store: ImageStore to save images into instead of image_folder
+    workers: number of processes that extract page ranges in parallel
+    """
+    return list(iter_pdf_lines(file, image_folder, image_store, workers))
@@ -0,0 +1,368 @@
+import os
+import json
+import shutil
+import logging
+from array import array
+
+import numpy as np
+
+
+# version of the files written by QuestionStoreWriter
+STORE_VERSION = 1
+META_FILE = 'meta.json'
+STRINGS_FILE = 'strings.bin'
+
+# question fields with one string per question (-1 if missing)
+TEXT_FIELDS = ['stem', 'comment', 'tags', 'source']
+# question fields with a list of strings per question
+LIST_FIELDS = ['choices', 'hints']
+MISSING = -1
+
+
+def _question_source(question):
+    """ Source of a question: parsed questions only keep it in their
+        tags, questions read from a QuestionStore have it as a field
+    """
+    if 'source' in question:
+        return question['source']
+    tags = question.get('all_parsed_tags', {})
+    for t, val in zip(tags.get('types', []), tags.get('values', [])):
+        if t == 'source':
+            return val
+    return None
+
+
+class QuestionStoreWriter:
+    """ Writes parsed questions into a columnar folder that
+        QuestionStore memory maps
+
+    Files:
+
+    strings.bin - every string, utf-8 encoded, one after the other
+    string_offsets.npy - int64, where string i is: [offsets[i], offsets[i + 1])
+    <field>.npy - for stem, comment, tags and source: int64 string
+        of each question, -1 if it has none
+    <field>_offsets.npy, <field>_strings.npy - for choices and hints:
+        the strings of question i are <field>_strings[offsets[i]:offsets[i + 1]]
+    type.npy - int16 index of the type of each question in meta.json
+    correct_answer.npy - int64 index of the correct choice, -1 if none
+    correct_answer_text.npy - int64 string of textual correct answers
+        (e.g. from answer files of open questions), -1 if none
+    document_offsets.npy - int64, document i holds the questions
+        [offsets[i], offsets[i + 1])
+    meta.json - version, document ids and question types, written last
+
+    Strings are streamed to disk, only the (small) integer columns
+    are kept in memory until close.
+
+    Example:
+
+    with QuestionStoreWriter('questions') as writer:
+        writer.add_document('exam.pdf', sp.parse_pdf('exam.pdf'))
+    """
+
+    def __init__(self, folder, keep_documents=None):
+        """ Creates (or replaces) a store
+
+        Arguments:
+
+        folder: folder that will hold the store
+        keep_documents: optional ids of documents to copy from the
+            store that is being replaced (e.g. the documents that did
+            not change in an incremental run). They are added first.
+            The ids that the previous store does not hold are kept in
+            missing_documents
+        """
+        self.folder = folder
+        self.missing_documents = []
+        meta_file = os.path.join(folder, META_FILE)
+        # the previous store is read while the new one is written,
+        # and only removed once the new one is complete
+        self._previous = None
+        if keep_documents is not None:
+            self._previous = folder.rstrip('/\\') + '.previous'
+            if os.path.isfile(meta_file):
+                shutil.rmtree(self._previous, ignore_errors=True)
+                os.replace(folder, self._previous)
+            elif not os.path.isfile(os.path.join(self._previous,
+                                                 META_FILE)):
+                # otherwise, left aside by a writer that was interrupted
+                self._previous = None
+        os.makedirs(folder, exist_ok=True)
+        if os.path.isfile(meta_file):
+            # readers must not open a half written store
+            os.remove(meta_file)
+
+        self._strings = open(os.path.join(folder, STRINGS_FILE), 'wb')
+        self._string_offsets = array('q', [0])
+        self._columns = {x: array('q') for x in TEXT_FIELDS}
+        self._columns['correct_answer'] = array('q')
+        self._columns['correct_answer_text'] = array('q')
+        self._types = array('h')
+        self._type_ids = {}
+        self._lists = {x: (array('q', [0]), array('q')) for x in LIST_FIELDS}
+        self._documents = []
+        self._document_offsets = array('q', [0])
+
+        if keep_documents is not None:
+            self.missing_documents = self._copy_documents(keep_documents)
+
+    def _copy_documents(self, document_ids):
+        """ Adds documents of the previous store
+
+        Returns the ids that were not found
+        """
+        if self._previous is None:
+            missing = list(document_ids)
+        else:
+            store = QuestionStore(self._previous)
+            missing = []
+            for document_id in document_ids:
+                if document_id not in store._document_ids:
+                    missing.append(document_id)
+                    continue
+                self.add_document(document_id, [
+                    store[x] for x in store.document_rows(document_id)
+                ])
+            # release the memory maps before the files are removed
+            del store
+        if len(missing) > 0:
+            logging.warning(f'Documents not found in the previous question '
+                            f'store: {missing}')
+        return missing
+
+    def _add_string(self, text):
+        if text is None:
+            return MISSING
+        assert isinstance(text, str), f'Expected a string, got {text}'
+        data = text.encode('utf-8')
+        self._strings.write(data)
+        self._string_offsets.append(self._string_offsets[-1] + len(data))
+        return len(self._string_offsets) - 2
+
+    def add_document(self, document_id, questions):
+        """ Appends the questions of a document
+
+        Arguments:
+
+        document_id: name of the document, e.g. its file name
+        questions: list of questions, as returned by parse_pdf / parse_docx
+        """
+        for question in questions:
+            values = {x: question.get(x) for x in TEXT_FIELDS}
+            values['source'] = _question_source(question)
+            for field, value in values.items():
+                self._columns[field].append(self._add_string(value))
+
+            correct_answer = question.get('correct_answer')
+            if isinstance(correct_answer, int):
+                assert correct_answer >= 0, \
+                    f'Unexpected correct answer: {correct_answer}'
+                self._columns['correct_answer'].append(correct_answer)
+                correct_answer = None
+            else:
+                self._columns['correct_answer'].append(MISSING)
+            self._columns['correct_answer_text'].append(
+                self._add_string(correct_answer)
+            )
+
+            type_id = self._type_ids.setdefault(question['type'],
+                                                len(self._type_ids))
+            self._types.append(type_id)
+
+            choices = [x['text'] for x in question.get('choices', [])]
+            for field, items in [('choices', choices),
+                                 ('hints', question.get('hints', []))]:
+                offsets, strings = self._lists[field]
+                strings.extend(self._add_string(x) for x in items)
+                offsets.append(len(strings))
+
+        self._documents.append(document_id)
+        self._document_offsets.append(len(self._types))
+
+    def close(self):
+        """ Writes the columns. The store can be read after this
+        """
+        if self._strings.closed:
+            return
+        self._strings.close()
+
+        def save(name, values, dtype=np.int64):
+            np.save(os.path.join(self.folder, name + '.npy'),
+                    np.frombuffer(values, dtype=dtype)
+                    if len(values) > 0 else np.zeros(0, dtype=dtype))
+
+        save('string_offsets', self._string_offsets)
+        for field, values in self._columns.items():
+            save(field, values)
+        save('type', self._types, np.int16)
+        for field, (offsets, strings) in self._lists.items():
+            save(field + '_offsets', offsets)
+            save(field + '_strings', strings)
+        save('document_offsets', self._document_offsets)
+
+        with open(os.path.join(self.folder, META_FILE), 'w',
+                  encoding='utf-8') as f:
+            json.dump({'version': STORE_VERSION,
+                       'documents': self._documents,
+                       'types': list(self._type_ids)}, f)
+        if self._previous is not None:
+            shutil.rmtree(self._previous, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class QuestionStore:
+    """ Read-only questions written by QuestionStoreWriter
+
+    Every column is memory mapped, so opening a store is instant,
+    only the questions that are read get loaded from disk and
+    filters run over whole columns at once. Pickling only keeps
+    the folder, as in text_utils.EmbeddingStore
+
+    Example:
+
+    store = QuestionStore('questions')
+    question = store.get('exam.pdf', 3)
+    rows = store.find(type='choice', has_correct_answer=True)
+    questions = [store[x] for x in rows]
+    """
+
+    def __init__(self, folder):
+        """ Opens a store
+
+        Arguments:
+
+        folder: folder given to QuestionStoreWriter
+        """
+        self.folder = folder
+        with open(os.path.join(folder, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        assert meta['version'] == STORE_VERSION, \
+            f'Unsupported question store version: {meta["version"]}'
+        self.documents = meta['documents']
+        self.types = meta['types']
+        self._document_ids = {x: idx for idx, x in enumerate(self.documents)}
+
+        def load(name):
+            return np.load(os.path.join(folder, name + '.npy'),
+                           mmap_mode='r')
+
+        self._string_offsets = load('string_offsets')
+        self._columns = {x: load(x) for x in
+                         TEXT_FIELDS + ['correct_answer',
+                                        'correct_answer_text', 'type']}
+        self._lists = {x: (load(x + '_offsets'), load(x + '_strings'))
+                       for x in LIST_FIELDS}
+        self._document_offsets = load('document_offsets')
+        if self._string_offsets[-1] > 0:
+            self._strings = np.memmap(os.path.join(folder, STRINGS_FILE),
+                                      dtype=np.uint8, mode='r')
+        else:
+            # empty files cannot be memory mapped
+            self._strings = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self._columns['type'])
+
+    def _string(self, idx):
+        idx = int(idx)
+        if idx == MISSING:
+            return None
+        start, end = self._string_offsets[idx:idx + 2]
+        return self._strings[start:end].tobytes().decode('utf-8')
+
+    def __getitem__(self, row):
+        """ Question in a row, with the stored fields only
+            (stem, type, choices, correct_answer, hints,
+            tags, comment and source)
+        """
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(f'Question store row out of range: {row}')
+        question = {'stem': self._string(self._columns['stem'][row]),
+                    'type': self.types[self._columns['type'][row]]}
+
+        choices_offsets, choices = self._lists['choices']
+        start, end = choices_offsets[row:row + 2]
+        if question['type'] == 'choice' or end > start:
+            question['choices'] = [{'text': self._string(x)}
+                                   for x in choices[start:end]]
+
+        correct_answer = int(self._columns['correct_answer'][row])
+        if correct_answer == MISSING:
+            correct_answer = self._string(
+                self._columns['correct_answer_text'][row]
+            )
+        if correct_answer is not None:
+            question['correct_answer'] = correct_answer
+
+        hints_offsets, hints = self._lists['hints']
+        start, end = hints_offsets[row:row + 2]
+        question['hints'] = [self._string(x) for x in hints[start:end]]
+
+        for field in ['tags', 'comment', 'source']:
+            value = self._string(self._columns[field][row])
+            if value is not None:
+                question[field] = value
+        return question
+
+    def document_rows(self, document_id):
+        """ Rows of the questions of a document, in order
+        """
+        idx = self._document_ids[document_id]
+        return range(int(self._document_offsets[idx]),
+                     int(self._document_offsets[idx + 1]))
+
+    def get(self, document_id, question_index):
+        """ Question number question_index (0 based) of a document
+        """
+        rows = self.document_rows(document_id)
+        return self[rows[question_index]]
+
+    def document_of(self, row):
+        """ (document id, question index) of a row
+        """
+        idx = int(np.searchsorted(self._document_offsets, row,
+                                  side='right')) - 1
+        return self.documents[idx], \
+            row - int(self._document_offsets[idx])
+
+    def find(self, type=None, has_correct_answer=None, document_id=None):
+        """ Rows of the questions that match every given filter
+
+        Arguments:
+
+        type: question type, e.g. 'choice'
+        has_correct_answer: True / False to keep questions
+            with / without a correct answer
+        document_id: only look in this document
+
+        Returns numpy array of rows, in order
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if type is not None:
+            if type not in self.types:
+                return np.zeros(0, dtype=np.int64)
+            mask &= self._columns['type'] == self.types.index(type)
+        if has_correct_answer is not None:
+            has_answer = (self._columns['correct_answer'] != MISSING) |\
+                (self._columns['correct_answer_text'] != MISSING)
+            mask &= has_answer == has_correct_answer
+        if document_id is not None:
+            rows = self.document_rows(document_id)
+            in_document = np.zeros(len(self), dtype=bool)
+            in_document[rows.start:rows.stop] = True
+            mask &= in_document
+        return np.flatnonzero(mask)
+
+    def __getstate__(self):
+        return {'folder': self.folder}
+
+    def __setstate__(self, state):
+        self.__init__(state['folder'])
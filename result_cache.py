@@ -0,0 +1,241 @@
+import os
+import re
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+
+
+# images referenced by parsed questions, see parse_doc._adjust_img_url
+IMAGE_PATTERN = re.compile('----media/(.+?[^-])----')
+
+
+def hash_file(file_name, chunk_size=2 ** 20):
+    """ Computes the sha256 of a file's contents
+    """
+    h = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _referenced_images(obj):
+    """ Yields the names of all images referenced in
+        the strings of a parsed question structure
+    """
+    if isinstance(obj, str):
+        yield from IMAGE_PATTERN.findall(obj)
+    elif isinstance(obj, dict):
+        for v in obj.values():
+            yield from _referenced_images(v)
+    elif isinstance(obj, list):
+        for v in obj:
+            yield from _referenced_images(v)
+
+
+class ResultCache:
+    """ On-disk cache of parsed questions
+
+    Entries are keyed by the contents of the parsed files plus
+    everything else that changes the output (configuration,
+    parser version...), so a file that is uploaded again under
+    a different name is still a hit. Images referenced by the
+    questions are kept with the entry and copied back to the
+    image folder on a hit.
+
+    The cache is bounded: when it grows over `max_size_mb`, the
+    least recently used entries are removed. The size of every
+    entry is measured once: when the cache is opened, when it is
+    stored, or when put finds it was stored by another process
+    (e.g. the other parse_doc workers sharing the folder). The
+    whole folder is only walked again to evict entries.
+
+    Layout:
+
+    <cache_dir>/<key>/questions.json
+    <cache_dir>/<key>/images/<image files>
+    """
+    QUESTIONS_FILE = 'questions.json'
+    IMAGES_FOLDER = 'images'
+
+    def __init__(self, cache_dir, max_size_mb=1024, refresh=False):
+        """ Opens (and creates if needed) a cache folder
+
+        Arguments:
+
+        cache_dir: folder that holds the cache entries
+        max_size_mb: size above which old entries get evicted
+        refresh: if True, never read cached results but still
+            store new ones. Useful to rebuild stale entries
+        """
+        self.cache_dir = cache_dir
+        self.max_size_mb = max_size_mb
+        self.refresh = refresh
+        os.makedirs(cache_dir, exist_ok=True)
+        self._set_sizes(self._scan())
+
+    def make_key(self, files, config, version, options=None):
+        """ Builds the key of a parsing result
+
+        Arguments:
+
+        files: list of parsed files. None items are allowed
+            (e.g. a PDF without answers file)
+        config: parser configuration, must be JSON serializable
+        version: parser version, changing it invalidates old entries
+        options: anything else that changes the result, JSON serializable
+        """
+        h = hashlib.sha256()
+        for file_name in files:
+            h.update(b'-' if file_name is None
+                     else hash_file(file_name).encode())
+        extra = {'config': config, 'version': version, 'options': options}
+        h.update(json.dumps(extra, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def get(self, key, image_folder=None):
+        """ Returns the cached questions, None if missing
+
+        Arguments:
+
+        key: key built with make_key
+        image_folder: if not None, cached images are copied there
+        """
+        if self.refresh:
+            return None
+
+        entry = os.path.join(self.cache_dir, key)
+        questions_file = os.path.join(entry, self.QUESTIONS_FILE)
+        try:
+            with open(questions_file, encoding='utf-8') as f:
+                questions = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if image_folder is not None:
+            images = os.path.join(entry, self.IMAGES_FOLDER)
+            os.makedirs(image_folder, exist_ok=True)
+            for img in os.listdir(images):
+                shutil.copyfile(os.path.join(images, img),
+                                os.path.join(image_folder, img))
+
+        # mark as recently used
+        os.utime(questions_file)
+        logging.debug(f'Result cache hit: {key}')
+        return questions
+
+    def put(self, key, questions, image_folder=None):
+        """ Stores parsed questions
+
+        Arguments:
+
+        key: key built with make_key
+        questions: list of parsed questions
+        image_folder: folder where the images of the questions were saved
+        """
+        entry = os.path.join(self.cache_dir, key)
+        # build the entry aside so that readers never see half of it
+        tmp_entry = os.path.join(self.cache_dir,
+                                 f'.{key}.{uuid.uuid4().hex}.tmp')
+        tmp_images = os.path.join(tmp_entry, self.IMAGES_FOLDER)
+        os.makedirs(tmp_images)
+        try:
+            if image_folder is not None:
+                for img in set(_referenced_images(questions)):
+                    src = os.path.join(image_folder, img)
+                    if os.path.isfile(src):
+                        shutil.copyfile(src, os.path.join(tmp_images, img))
+
+            with open(os.path.join(tmp_entry, self.QUESTIONS_FILE), 'w',
+                      encoding='utf-8') as f:
+                json.dump(questions, f)
+
+            size = self._entry_size(tmp_entry)
+            if os.path.isdir(entry):
+                shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp_entry, entry)
+            self._total_size += size - self._sizes.get(key, 0)
+            self._sizes[key] = size
+        except OSError:
+            # most likely another process stored the same entry
+            logging.debug(f'Could not store result cache entry {key}')
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+        self._update_sizes()
+        if self._total_size > self.max_size_mb * 2 ** 20:
+            self._evict()
+
+    def clear(self):
+        """ Removes all entries
+        """
+        for name in os.listdir(self.cache_dir):
+            shutil.rmtree(os.path.join(self.cache_dir, name),
+                          ignore_errors=True)
+        self._set_sizes([])
+
+    @staticmethod
+    def _entry_size(entry):
+        """ Size in bytes of the files of an entry
+        """
+        size = 0
+        for root, _, files in os.walk(entry):
+            size += sum(os.path.getsize(os.path.join(root, x))
+                        for x in files)
+        return size
+
+    def _is_entry(self, name):
+        return not name.startswith('.') and os.path.isfile(
+            os.path.join(self.cache_dir, name, self.QUESTIONS_FILE)
+        )
+
+    def _scan(self):
+        """ Lists the complete entries of the cache folder
+
+        Returns: [(last use time, size, key)]
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not self._is_entry(name):
+                continue
+            entry = os.path.join(self.cache_dir, name)
+            questions_file = os.path.join(entry, self.QUESTIONS_FILE)
+            entries.append((os.path.getmtime(questions_file),
+                            self._entry_size(entry), name))
+        return entries
+
+    def _set_sizes(self, entries):
+        """ Sizes of the entries listed by _scan
+        """
+        self._sizes = {name: size for _, size, name in entries}
+        self._total_size = sum(self._sizes.values())
+
+    def _update_sizes(self):
+        """ Accounts for the entries that other processes stored or
+            removed since the last put. Only new entries are measured
+        """
+        names = set(os.listdir(self.cache_dir))
+        for name in [x for x in self._sizes if x not in names]:
+            self._total_size -= self._sizes.pop(name)
+        for name in names:
+            if name not in self._sizes and self._is_entry(name):
+                size = self._entry_size(os.path.join(self.cache_dir, name))
+                self._sizes[name] = size
+                self._total_size += size
+
+    def _evict(self):
+        """ Removes least recently used entries until
+            the cache fits in max_size_mb
+        """
+        # oldest first
+        entries = sorted(self._scan(), reverse=True)
+        total_size = sum(x[1] for x in entries)
+        max_size = self.max_size_mb * 2 ** 20
+        while len(entries) > 0 and total_size > max_size:
+            _, size, name = entries.pop()
+            shutil.rmtree(os.path.join(self.cache_dir, name),
+                          ignore_errors=True)
+            total_size -= size
+        self._set_sizes(entries)
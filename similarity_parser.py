@@ -1,18 +1,26 @@
+import os
 import re
+import copy
 import string
+import types
+import hashlib
 import logging
 
-from bs4 import BeautifulSoup
-from docx2python import docx2python
+from bs4 import BeautifulSoup, Tag
 
 import text_utils
 import pdf_parsing.pdf_extractor as pdf_e
+import docx_parsing.docx_extractor as docx_e
+from parse_stats import ParseStats
 from pdf_parsing.enem_specific import enem_lines_parser
 from nlp_models.structured_incremental_parser import IncrementalParser
 
 
 LOWERCASE_CHARS = string.ascii_lowercase
 
+# bump when a change alters parsed output: invalidates cached results
+PARSER_VERSION = 2
+
 DEFAULTCONFIG = {
     # minimum number of questions
     # trigger AI to split more if this is not reached
@@ -42,12 +50,18 @@ DEFAULTCONFIG = {
         'pergunta'
     ],
     'exercise_dist_tol': 2,
+    # cosine similarity to accept a synonym of the exercise strings
+    # only used when the parser is given word embeddings
+    'exercise_semantic_threshold': 0.8,
     'exercise_delimiter_tokens': [
         '.', ',', '-', ')',  # in documentation
         # seems reasonable
         ':', '|', '/', '\\', ']', '}', '>',
     ],
     'tag_dist_tol': 2,
+    # cosine similarity to accept a synonym of a tag
+    # only used when the parser is given word embeddings
+    'tag_semantic_threshold': 0.8,
     'tag_delimiter_tokens': [
         ')', ':', '='  # in documentation
     ],
@@ -72,23 +86,166 @@ DEFAULTCONFIG = {
 }
 
 
+def _freeze(value):
+    """ Read-only copy of a configuration: dictionaries become
+        mappingproxy objects and lists become tuples
+    """
+    if isinstance(value, (dict, types.MappingProxyType)):
+        return types.MappingProxyType(
+            {k: _freeze(v) for k, v in value.items()}
+        )
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(x) for x in value)
+    return copy.deepcopy(value)
+
+
+def _thaw(value):
+    """ Plain (mutable, JSON serializable) copy of a configuration,
+        frozen or not
+    """
+    if isinstance(value, (dict, types.MappingProxyType)):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_thaw(x) for x in value]
+    return copy.deepcopy(value)
+
+
+class ParserSession:
+    """ Everything a SimilarityParser derives from its configuration:
+        compiled regular expressions, keyword matchers and the
+        IncrementalParser, built once
+
+    Sessions are immutable and picklable, so one session can be
+    shared by any number of parsers, threads or worker processes.
+    Creating a session is the expensive step; parsers built from
+    it (SimilarityParser(session=...)) are cheap
+    """
+
+    def __init__(self, config=None, embeddings=None):
+        """ Prepares a configuration for parsing
+
+        Arguments:
+
+        config: parser configuration, DEFAULTCONFIG if None.
+            The session keeps its own read-only copy (config
+            attribute: dictionaries are mappingproxy objects
+            and lists are tuples)
+        embeddings: see SimilarityParser
+        """
+        set_attr = super().__setattr__
+        config = _thaw(config if config is not None else DEFAULTCONFIG)
+        set_attr('config', _freeze(config))
+        set_attr('ans', self.config['ans_strings'])
+        set_attr('ans_pat', re.compile('[' + '\\'.join(
+            config['exercise_delimiter_tokens']
+        ) + ']'))
+
+        # second word of a question header: <number><delimiter>
+        # rejects lines before any edit distance is computed
+        delimiters = [re.escape(x) for x in
+                      config['exercise_delimiter_tokens']
+                      if len(x) == 1]
+        set_attr('question_id_pattern', re.compile(
+            '[^\\W_]+[' + ''.join(delimiters) + ']'
+            if len(delimiters) > 0 else '(?!)'
+        ))
+        set_attr('source_pattern', re.compile('^\\(.+\\)'))
+
+        # fuzzy matchers only need exact distances up to the tolerances
+        set_attr('exercise_matcher', text_utils.KeywordMatcher(
+            {'exercise': config['exercise_strings']},
+            max_dist=config['exercise_dist_tol']
+        ))
+        set_attr('tag_matcher', text_utils.KeywordMatcher(
+            config['possible_tags'],
+            max_dist=config['tag_dist_tol'] - 1,
+            remove_last_char=True,
+            last_char_match_list=config['tag_delimiter_tokens']
+        ))
+
+        semantic_matcher = None
+        if embeddings is not None:
+            keyword_groups = {
+                ('tag', t): config['possible_tags'][t]
+                for t in config['possible_tags']
+            }
+            keyword_groups[('exercise',)] = config['exercise_strings']
+            semantic_matcher = text_utils.SemanticKeywordMatcher(
+                keyword_groups, embeddings
+            )
+        set_attr('semantic_matcher', semantic_matcher)
+
+        # fallback question splitter, stateless
+        set_attr('incremental_parser', IncrementalParser())
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # mappingproxy objects cannot be pickled
+        state['config'] = _thaw(self.config)
+        del state['ans']
+        return state
+
+    def __setstate__(self, state):
+        state['config'] = _freeze(state['config'])
+        state['ans'] = state['config']['ans_strings']
+        self.__dict__.update(state)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ParserSession is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('ParserSession is immutable')
+
+
 class SimilarityParser:
     """ Implements a text parser that is tolerant
         to multiple mistakes
         This is a hand engineered parser
     """
 
-    def __init__(self, config=None):
-        if config is not None:
-            self.config = config
-        else:
-            self.config = DEFAULTCONFIG
-        self.ans = self.config['ans_strings']
-        self.ans_pat = '[' + '\\'.join(
-            self.config['exercise_delimiter_tokens']
-        ) + ']'
+    def __init__(self, config=None, embeddings=None, cache=None,
+                 pdf_workers=1, session=None, stats_hook=None):
+        """ Initializes the parser
+
+        Arguments:
 
-    def parse_pdf(self, file_name, image_folder=None, answers=None):
+        config: parser configuration, DEFAULTCONFIG if None. The
+            config attribute is a read-only copy, see ParserSession
+        embeddings: optional text_utils.EmbeddingStore (or dictionary
+            {word: vector}). When given, first words that are not close
+            enough in edit distance can still match exercise strings and
+            tags by embedding similarity (see *_semantic_threshold)
+        cache: optional result_cache.ResultCache. parse_pdf and parse_docx
+            return cached results for files that were already parsed
+        pdf_workers: number of processes that extract the pages of
+            a PDF in parallel. Speeds up parsing a single large PDF
+        session: optional ParserSession to reuse instead of preparing
+            config and embeddings again
+        stats_hook: optional function called with the
+            parse_stats.ParseStats of every parse_pdf and parse_docx
+            call (stage timings, counters...). Nothing is measured
+            without it
+        """
+        if session is None:
+            session = ParserSession(config, embeddings)
+        else:
+            assert config is None and embeddings is None,\
+                'config and embeddings come from the session'
+        self.session = session
+        self.cache = cache
+        self.pdf_workers = pdf_workers
+        self.stats_hook = stats_hook
+
+        self.config = session.config
+        self.ans = session.ans
+        self.ans_pat = session.ans_pat
+        self.question_id_pattern = session.question_id_pattern
+        self.exercise_matcher = session.exercise_matcher
+        self.tag_matcher = session.tag_matcher
+        self.semantic_matcher = session.semantic_matcher
+
+    def parse_pdf(self, file_name, image_folder=None, answers=None,
+                  image_store=None):
         """ Attempts to parse a PDF file into questions
 
         Arguments:
@@ -96,36 +253,99 @@ class SimilarityParser:
         file_name: PDF file to process
         image_folder: folder to save images
         answers: PDF file containing the corresponding answers
+        image_store: ImageStore to save images into instead of image_folder
+        """
+        specific_parser = self._get_specific_parser(file_name)
+        stats = self._new_stats(file_name, 'parse_pdf')
+        questions = self._cached_parse(
+            [file_name, answers], image_folder,
+            {'method': 'parse_pdf',
+             'specific_parser': getattr(specific_parser, '__name__', None)},
+            lambda: self._parse_pdf(file_name, image_folder, answers,
+                                    image_store, stats),
+            image_store, stats
+        )
+        self._report_stats(stats)
+        return questions
+
+    def _parse_pdf(self, file_name, image_folder=None, answers=None,
+                   image_store=None, stats=None):
+        """ parse_pdf without cache
         """
-        lines = pdf_e.read_pdf_lines(file_name, image_folder)
+        questions = list(self.iter_pdf_questions(file_name, image_folder,
+                                                 image_store, stats))
+        if answers is not None:
+            if stats is not None:
+                stats.start_stage('answers')
+            self._match_answers(questions, pdf_e.read_pdf_lines(answers),
+                                file_name, stats)
+
+        return questions
+
+    def _match_answers(self, questions, ans_lines, file_name, stats=None):
+        """ Sets the correct answer of every question from the lines
+            of its answers file, if there is one answer per question
 
+        Arguments:
+
+        questions: parsed questions, changed in place
+        ans_lines: lines extracted from the answers file
+        file_name: file the questions come from, for logging
+        stats: optional ParseStats to fill in
+        """
+        ans_lines_no_html = self._extract_lines_without_html(ans_lines)
+        candidate_ans = self._parse_answers(ans_lines_no_html)
+        if stats is not None:
+            stats.count('answer_lines', len(ans_lines))
+            stats.answers = 'matched'\
+                if len(candidate_ans) == len(questions)\
+                else 'count_mismatch'
+        if len(candidate_ans) == len(questions):
+            logging.debug('Number of questions and answers match')
+            for q, ans in zip(questions, candidate_ans):
+                if q['type'] == self.ans['multiple_choice']:
+                    ans_char = ans[-1].lower()
+                    ans_idx = LOWERCASE_CHARS.index(ans_char)
+                    q[self.ans['correct_answer']] = ans_idx
+                else:
+                    q[self.ans['correct_answer']] = ans
+        else:
+            logging.warning(
+                'Number of questions and answers do not match. '
+                f'Ignoring answers for {file_name}'
+            )
+
+    def iter_pdf_questions(self, file_name, image_folder=None,
+                           image_store=None, stats=None):
+        """ Lazily parses a PDF file into questions
+
+        Pages are extracted one at a time and each question is
+        yielded as soon as the next question delimiter is found.
+        Answers need the full list of questions to be matched,
+        use parse_pdf for that
+
+        Arguments:
+
+        file_name: PDF file to process
+        image_folder: folder to save images
+        image_store: ImageStore to save images into instead of image_folder
+        stats: optional ParseStats to fill in
+        """
+        lines = pdf_e.iter_pdf_lines(file_name, image_folder, image_store,
+                                     self.pdf_workers)
+        return self._iter_questions(
+            lines, self._get_specific_parser(file_name), stats
+        )
+
+    def _get_specific_parser(self, file_name):
+        """ Picks a provider-specific lines parser from the file name
+        """
         # could probably find a better way than hard coding here
         # TO DO later
         specific_parser = None
         if 'enem' in file_name.lower():
             specific_parser = enem_lines_parser
-
-        questions = self._parse_questions(lines, specific_parser)
-        if answers is not None:
-            ans_lines = pdf_e.read_pdf_lines(answers)
-            ans_lines_no_html = self._extract_lines_without_html(ans_lines)
-            candidate_ans = self._parse_answers(ans_lines_no_html)
-            if len(candidate_ans) == len(questions):
-                logging.debug('Number of questions and answers match')
-                for q, ans in zip(questions, candidate_ans):
-                    if q['type'] == self.ans['multiple_choice']:
-                        ans_char = ans[-1].lower()
-                        ans_idx = LOWERCASE_CHARS.index(ans_char)
-                        q[self.ans['correct_answer']] = ans_idx
-                    else:
-                        q[self.ans['correct_answer']] = ans
-            else:
-                logging.warning(
-                    'Number of questions and answers do not match. '
-                    f'Ignoring answers for {file_name}'
-                )
-
-        return questions
+        return specific_parser
 
     def _parse_answers(self, ans_lines_no_html):
         """ Parses answers in the format
@@ -186,36 +406,162 @@ class SimilarityParser:
         else:
             logging.debug('Numbers in answer text did not come as expected')
 
-    def parse_docx(self, file_name, image_folder=None):
+    def parse_docx(self, file_name, image_folder=None, image_store=None):
         """ Attempts to parse a DOCX file into questions
 
         Arguments:
 
         file_name: DOCX file to process
+        image_folder: folder to save images
+        image_store: ImageStore to save images into instead of image_folder
         """
-        if image_folder is not None:
-            contents = docx2python(file_name, image_folder, html=True)
-        else:
-            contents = docx2python(file_name, html=True)
+        stats = self._new_stats(file_name, 'parse_docx')
+        questions = self._cached_parse(
+            [file_name], image_folder, {'method': 'parse_docx'},
+            lambda: self._parse_docx(file_name, image_folder, image_store,
+                                     stats),
+            image_store, stats
+        )
+        self._report_stats(stats)
+        return questions
+
+    def _parse_docx(self, file_name, image_folder=None, image_store=None,
+                    stats=None):
+        """ parse_docx without cache
+        """
+        return list(self.iter_docx_questions(file_name, image_folder,
+                                             image_store, stats))
+
+    def iter_docx_questions(self, file_name, image_folder=None,
+                            image_store=None, stats=None):
+        """ Lazily parses a DOCX file into questions
+
+        The document is streamed one table at a time, so memory
+        does not grow with its size. Images are copied first.
+
+        Arguments:
+
+        file_name: DOCX file to process
+        image_folder: folder to save images
+        image_store: ImageStore to save images into instead of image_folder
+        stats: optional ParseStats to fill in
+        """
+        return self._iter_questions(
+            self._iter_docx_lines(file_name, image_folder, image_store,
+                                  stats),
+            stats=stats
+        )
+
+    def _iter_docx_lines(self, file_name, image_folder=None,
+                         image_store=None, stats=None):
+        """ Lines of a DOCX file, the same _html_to_lines
+            returns for the html_map of docx2python
+        """
+        if stats is not None:
+            stats.start_stage('extract')
+        image_names = {}
+        if image_folder is not None or image_store is not None:
+            image_names = docx_e.save_docx_images(file_name, image_folder,
+                                                  image_store)
+        image_pattern = None
+        if image_store is not None and len(image_names) > 0:
+            image_pattern = re.compile('----media/({})----'.format(
+                '|'.join(re.escape(x) for x in image_names)
+            ))
 
         pattern = "\(\d+, \d+, \d+, \d+\) "  # noqa
-        html_txt = contents.html_map
-        html_txt = re.sub(pattern, '', html_txt)
+        for table in docx_e.iter_docx_tables(file_name):
+            if stats is not None:
+                stats.start_stage('html_to_lines')
+            # as in the html_map, text that looks like
+            # a paragraph index is removed
+            html_txt = re.sub(pattern, '', docx_e.table_to_html(table))
+            if image_pattern is not None:
+                html_txt = image_pattern.sub(
+                    lambda m: f'----media/{image_names[m.group(1)]}----',
+                    html_txt
+                )
+            lines = self._html_to_lines(html_txt)
+            if stats is not None:
+                stats.start_stage('extract')
+            yield from lines
 
-        lines = self._html_to_lines(html_txt)
-        return self._parse_questions(lines)
+    def _cached_parse(self, files, image_folder, options, parse_function,
+                      image_store=None, stats=None):
+        """ Returns the cached result of parsing files if available.
+            Otherwise calls parse_function() and caches its result
+
+        Arguments:
+
+        files: list of files that are parsed
+        image_folder: folder to save images
+        options: what else changes the result, besides the configuration
+        parse_function: function that does the actual parsing
+        image_store: ImageStore the images are saved into, if any
+        stats: optional ParseStats to fill in
+        """
+        if self.cache is None:
+            return parse_function()
+
+        options = dict(options)
+        options['images'] = image_folder is not None
+        options['image_store'] = image_store is not None
+        if image_store is not None:
+            image_folder = image_store.folder
+        options['embeddings'] = self._embeddings_fingerprint()
+        key = self.cache.make_key(files, _thaw(self.config), PARSER_VERSION,
+                                  options)
+
+        if stats is not None:
+            stats.start_stage('cache')
+        questions = self.cache.get(key, image_folder)
+        if questions is None:
+            questions = parse_function()
+            if stats is not None:
+                stats.start_stage('cache')
+            self.cache.put(key, questions, image_folder)
+        elif stats is not None:
+            stats.cache_hit = True
+            stats.count('questions', len(questions))
+        return questions
+
+    def _new_stats(self, file_name, method):
+        """ ParseStats of a call, None when nobody listens
+        """
+        if self.stats_hook is None:
+            return None
+        return ParseStats(file_name, method)
+
+    def _report_stats(self, stats):
+        if stats is not None:
+            stats.finish()
+            self.stats_hook(stats)
+
+    def _embeddings_fingerprint(self):
+        """ Identifies the embeddings in use, for cache keys
+        """
+        if self.semantic_matcher is None:
+            return None
+
+        embeddings = self.semantic_matcher.embeddings
+        if isinstance(embeddings, text_utils.EmbeddingStore):
+            stat = os.stat(embeddings.prefix + '.npy')
+            return [os.path.abspath(embeddings.prefix),
+                    stat.st_size, stat.st_mtime]
+
+        h = hashlib.sha256()
+        for word in sorted(embeddings):
+            h.update(repr((word, [float(x) for x in embeddings[word]]))
+                     .encode())
+        return h.hexdigest()
 
     def _extract_lines_without_html(self, lines):
         """ Remove html tags from lines
         """
-        text_lines_no_html = []
-        # look for question splitters
-        for cur_line in lines:
-            soup = BeautifulSoup(cur_line, features="lxml")
-            text_lines_no_html.append(soup.text)
-        return text_lines_no_html
+        return [text_utils.html_to_text(cur_line) for cur_line in lines]
 
-    def _parse_questions(self, lines, specific_lines_parser=None):
+    def _parse_questions(self, lines, specific_lines_parser=None,
+                         stats=None):
         """ Parses questions into response dictionaries
 
         Arguments:
@@ -225,37 +571,151 @@ class SimilarityParser:
             lines[] and text_lines_no_html[]
             and returns them modified in some provider-specific way
             (to handle corner cases for ENEM or Unicamp for example)
+        stats - optional ParseStats to fill in
         """
-        text_lines_no_html = self._extract_lines_without_html(lines)
-        question_idxs = self._split_questions(lines, text_lines_no_html)
+        return list(self._iter_questions(lines, specific_lines_parser,
+                                         stats))
+
+    def _iter_questions(self, lines, specific_lines_parser=None,
+                        stats=None):
+        """ Lazily parses questions into response dictionaries
+
+        Arguments:
 
-        if len(question_idxs) < self.config['min_expected_questions']:
+        lines - iterable with parsed question lines
+        specific_lines_parser - see _parse_questions
+        stats - optional ParseStats to fill in
+
+        A question is yielded as soon as the delimiter of the next one
+        is seen. Until `min_expected_questions` delimiters are found,
+        lines are buffered so that the whole document can still be
+        handed over to the IncrementalParser
+        """
+        if stats is None:
+            lines_with_text = (
+                (x, text_utils.html_to_text(x)) for x in lines
+            )
+        else:
+            lines_with_text = self._timed_lines_with_text(lines, stats)
+        semantic_scores = None
+        if self.semantic_matcher is not None:
+            # the whole document is scored at once
+            lines_with_text = list(lines_with_text)
+            if stats is not None:
+                stats.start_stage('semantic_scores')
+            semantic_scores = self._score_first_words(
+                [x[1] for x in lines_with_text]
+            )
+
+        min_questions = self.config['min_expected_questions']
+        n_found = 0
+        buf_lines = []
+        buf_lines_no_html = []
+        question_idxs = []
+        for cur_line, cur_line_no_html in lines_with_text:
+            if stats is not None:
+                stats.start_stage('split_questions')
+            is_question, cur_line, cur_line_no_html = \
+                self._split_question_line(
+                    cur_line, cur_line_no_html, semantic_scores
+                )
+
+            if is_question:
+                n_found += 1
+                question_idxs.append(len(buf_lines))
+                if n_found >= min_questions:
+                    # no need to fall back anymore:
+                    # every buffered question is finished
+                    yield from self._parse_question_ranges(
+                        buf_lines, buf_lines_no_html, question_idxs,
+                        specific_lines_parser, semantic_scores, stats
+                    )
+                    buf_lines = []
+                    buf_lines_no_html = []
+                    question_idxs = [0]
+
+            buf_lines.append(cur_line)
+            buf_lines_no_html.append(cur_line_no_html)
+
+        if n_found < min_questions:
             logging.debug('Extending attempts to split document questions')
-            ip = IncrementalParser()
+            if stats is not None:
+                stats.start_stage('incremental_parser')
+                stats.incremental_fallback = True
+            ip = self.session.incremental_parser
             question_idxs = ip.parse_text_lines_inc_numbers(
-                lines, text_lines_no_html)
+                buf_lines, buf_lines_no_html)
 
-        questions = []
         if len(question_idxs) > 0:
             # don't forget last question
-            question_idxs.append(len(lines))
-
-            for (n1, n2) in zip(question_idxs[0:-1], question_idxs[1:]):
-                cur_lines = lines[n1:n2]
-                cur_text_lines_no_html = text_lines_no_html[n1:n2]
-                if specific_lines_parser is not None:
-                    cur_lines, cur_text_lines_no_html = specific_lines_parser(
-                        cur_lines, cur_text_lines_no_html
-                    )
-
-                # maybe question ends up having no good lines
-                if len(lines) > 0:
-                    q = self._parse_question(
-                        cur_lines, cur_text_lines_no_html
-                    )
-                    questions.append(q)
+            question_idxs.append(len(buf_lines))
+            yield from self._parse_question_ranges(
+                buf_lines, buf_lines_no_html, question_idxs,
+                specific_lines_parser, semantic_scores, stats
+            )
+
+    def _timed_lines_with_text(self, lines, stats):
+        """ Pairs lines with their text, like _iter_questions does
+            without stats, timing extraction and html_to_text
+        """
+        stats.start_stage('extract')
+        for x in lines:
+            stats.start_stage('html_to_text')
+            x_no_html = text_utils.html_to_text(x)
+            stats.count('lines')
+            yield x, x_no_html
+            stats.start_stage('extract')
+
+    def _parse_question_ranges(self, lines, text_lines_no_html,
+                               question_idxs, specific_lines_parser=None,
+                               semantic_scores=None, stats=None):
+        """ Parses the questions between consecutive split indexes
+        """
+        for (n1, n2) in zip(question_idxs[0:-1], question_idxs[1:]):
+            if stats is not None:
+                stats.start_stage('parse_questions')
+            cur_lines = lines[n1:n2]
+            cur_text_lines_no_html = text_lines_no_html[n1:n2]
+            if specific_lines_parser is not None:
+                cur_lines, cur_text_lines_no_html = specific_lines_parser(
+                    cur_lines, cur_text_lines_no_html
+                )
 
-        return questions
+            # maybe question ends up having no good lines
+            if len(cur_lines) > 0:
+                question = self._parse_question(
+                    cur_lines, cur_text_lines_no_html, semantic_scores
+                )
+                if stats is not None:
+                    stats.count('questions')
+                    # the caller's time is not ours
+                    stats.stop_stage()
+                yield question
+
+    def _score_first_words(self, text_lines_no_html):
+        """ Embedding similarity of the first word of each line
+            with the exercise strings and tags, in a single batch
+
+        Returns:
+
+        dictionary {lowercased word: {group: similarity}}, where group
+            is ('exercise',) or ('tag', <tag type>). Words that end in a
+            tag delimiter are also scored without it. After a question
+            id (e.g. 'Questão 1. Solução: b'), the word that becomes the
+            first one once the header is removed is scored as well
+        """
+        candidates = []
+        for line in text_lines_no_html:
+            words = line.split()
+            first_words = words[:1]
+            if len(words) > 2 and\
+                    self.question_id_pattern.fullmatch(words[1]) is not None:
+                first_words.append(words[2])
+            for word in first_words:
+                candidates.append(word)
+                if word[-1] in self.config['tag_delimiter_tokens']:
+                    candidates.append(word[:-1])
+        return self.semantic_matcher.score(candidates)
 
     def _html_to_lines(self, html_text):
         """ Receives a html parsed from docx2python and returns relevant lines
@@ -263,15 +723,9 @@ class SimilarityParser:
         """
         lines = []
         soup = BeautifulSoup(html_text, features="lxml")
-        for tbl in soup.findAll('table'):
-            n_rows = len(tbl.findAll(
-                lambda tag: tag.name == 'tr' and tag.findParent('table') == tbl
-            ))
-            n_cols = len(tbl.findAll(
-                lambda tag: tag.name == 'td' and tag.findParent('table') == tbl
-            ))
+        for tbl, n_rows, n_cols, pres in self._scan_tables(soup):
             if n_rows == 1 and n_cols == 1:
-                for txt in tbl.findAll('pre'):
+                for txt in pres:
                     lines.append(
                         str(txt).replace('<pre>', '').replace('</pre>', '')
                     )
@@ -281,6 +735,42 @@ class SimilarityParser:
                 )
         return lines
 
+    def _scan_tables(self, soup):
+        """ Walks a parsed html tree once and describes
+            each of its tables, in document order
+
+        Returns list of [table, number of rows, number of cells, pres]:
+            rows (tr) and cells (td) are only counted in the closest
+            table around them, while pres lists every pre element
+            inside the table, nested tables included
+        """
+        tables = []
+        open_tables = []
+        # (tag, True) when entering a tag, (tag, False) when leaving it
+        to_visit = [(soup, True)]
+        while len(to_visit) > 0:
+            tag, entering = to_visit.pop()
+            if not entering:
+                open_tables.pop()
+                continue
+
+            if tag.name == 'table':
+                tables.append([tag, 0, 0, []])
+                open_tables.append(tables[-1])
+                to_visit.append((tag, False))
+            elif len(open_tables) > 0:
+                if tag.name == 'tr':
+                    open_tables[-1][1] += 1
+                elif tag.name == 'td':
+                    open_tables[-1][2] += 1
+                elif tag.name == 'pre':
+                    for tbl in open_tables:
+                        tbl[3].append(tag)
+
+            to_visit.extend((x, True) for x in reversed(tag.contents)
+                            if isinstance(x, Tag))
+        return tables
+
     def _split_questions(self, text_lines, text_lines_no_html):
         """ Receives a list of lines and identifies
             where to split into different questions
@@ -291,52 +781,85 @@ class SimilarityParser:
         for idx, (cur_line, cur_line_no_html) in enumerate(
                 zip(text_lines, text_lines_no_html)
         ):
-            words = cur_line_no_html.split()
-            if len(words) > 1:
-                question_distance = text_utils.min_word_distance(
-                    words[0], self.config['exercise_strings']
+            is_question, text_lines[idx], text_lines_no_html[idx] = \
+                self._split_question_line(cur_line, cur_line_no_html)
+            if is_question:
+                question_idxs.append(idx)
+
+        return question_idxs
+
+    def _split_question_line(self, cur_line, cur_line_no_html,
+                             semantic_scores=None):
+        """ Checks if a line starts a new question
+
+        Arguments:
+
+        cur_line, cur_line_no_html - line to check, with and without html
+        semantic_scores - optional result of _score_first_words
+
+        Returns tuple (is_question, line, line_no_html). The question
+        delimiter text is removed from the lines that start a question
+        """
+        words = cur_line_no_html.split()
+        if len(words) > 1:
+            # special case: exercise 5, or exercise 6.
+            # are the only contents of a line
+            if len(words) == 2 and words[1].isnumeric():
+                is_question_id = True
+            else:
+                is_question_id = \
+                    self.question_id_pattern.fullmatch(words[1]) is not None\
+                    and words[1][:-1].isnumeric()
+            if not is_question_id:
+                return False, cur_line, cur_line_no_html
+
+            question_distance = self.exercise_matcher.min_word_distance(
+                words[0]
+            )
+            is_exercise = \
+                question_distance <= self.config['exercise_dist_tol']
+            if not is_exercise and semantic_scores is not None:
+                is_exercise = self._is_semantic_match(
+                    words[0], ('exercise',), semantic_scores,
+                    self.config['exercise_semantic_threshold']
+                )
+            if is_exercise:
+                if len(words) == 2:
+                    # line contains only question id - remove
+                    return True, '', ''
+
+                # get rid of the delimiter text
+                # this is robust to multiple spaces
+                cur_val = text_utils.remove_first_text_occurrence(
+                    cur_line, words[0], '_split_questions'
+                )
+                new_line = text_utils.remove_first_text_occurrence(
+                    cur_val, words[1], '_split_questions'
                 )
 
-                valid_question_delimiter = words[1][-1] in self.config['exercise_delimiter_tokens']  # noqa
-                is_valid_number = words[1][:-1].isnumeric()
-
-                # special case: exercise 5, or exercise 6.
-                # are the only contents of a line
-                if len(words) == 2 and words[1].isnumeric():
-                    is_valid_number = True
-                    valid_question_delimiter = True
-
-                if question_distance <= self.config['exercise_dist_tol'] and\
-                        valid_question_delimiter and is_valid_number:
-                    question_idxs.append(idx)
-                    if len(words) == 2:
-                        # line contains only question id - remove
-                        text_lines[idx] = ''
-                        text_lines_no_html[idx] = ''
-                    else:
-                        # get rid of the delimiter text
-                        # this is robust to multiple spaces
-                        cur_val = text_utils.remove_first_occurrence(
-                            cur_line, words[0], '_split_questions'
-                        )
-                        cur_val = text_utils.remove_first_occurrence(
-                            cur_val, words[1], '_split_questions'
-                        )
-                        text_lines[idx] = cur_val
+                # update the no_html version as well
+                cur_val = text_utils.remove_first_occurrence(
+                    cur_line_no_html, words[0], '_split_questions'
+                )
+                new_line_no_html = text_utils.remove_first_occurrence(
+                    cur_val, words[1], '_split_questions'
+                )
+                return True, new_line, new_line_no_html
 
-                        # update the no_html version as well
-                        cur_val = text_utils.remove_first_occurrence(
-                            cur_line_no_html, words[0], '_split_questions'
-                        )
-                        cur_val = text_utils.remove_first_occurrence(
-                            cur_val, words[1], '_split_questions'
-                        )
-                        text_lines_no_html[idx] = cur_val
+        return False, cur_line, cur_line_no_html
 
-        return question_idxs
+    def _is_semantic_match(self, word, group, semantic_scores, threshold):
+        """ Checks the embedding similarity of a word with a group
+            of keywords, see _score_first_words
+        """
+        if semantic_scores is None:
+            return False
+        word_scores = semantic_scores.get(word.lower(), {})
+        return word_scores.get(group, -1) >= threshold
 
     # parse question tags
-    def _parse_question_tags(self, question_lines, lines_no_html):
+    def _parse_question_tags(self, question_lines, lines_no_html,
+                             semantic_scores=None):
         """ Attempts to identify tags in a question
         """
         tags = {'lines': [], 'types': [], 'values': []}
@@ -344,30 +867,52 @@ class SimilarityParser:
                 question_lines, lines_no_html
         )):
             words = line_no_html.strip().split()
+            tag_matches = None
+            if self.tag_matcher.can_match(words):
+                tag_matches = self.tag_matcher.match_first_words(words)
+
+            # synonyms: a single word followed by a tag delimiter
+            semantic_candidate = None
+            if semantic_scores is not None and len(words) > 0 and\
+                    words[0][-1] in self.config['tag_delimiter_tokens']:
+                semantic_candidate = words[0][:-1]
+
+            if tag_matches is None and semantic_candidate is None:
+                continue
+
             for t in self.config['possible_tags']:
-                tag_dist, n_words = text_utils.min_first_words_match_list(
-                    words, self.config['possible_tags'][t],
-                    remove_last_char=True,
-                    last_char_match_list=self.config['tag_delimiter_tokens']
+                if tag_matches is not None and\
+                        tag_matches[t][0] < self.config['tag_dist_tol']:
+                    n_words = tag_matches[t][1]
+                elif semantic_candidate is not None and\
+                        self._is_semantic_match(
+                            semantic_candidate, ('tag', t), semantic_scores,
+                            self.config['tag_semantic_threshold']
+                        ):
+                    n_words = 1
+                else:
+                    continue
+
+                tags['lines'].append(idx)
+                tags['types'].append(t)
+
+                search_string = ' '.join(words[:n_words])
+                cur_val = text_utils.remove_first_text_occurrence(
+                    cur_line, search_string, '_parse_question_tags'
                 )
-                if tag_dist < self.config['tag_dist_tol']:
-                    tags['lines'].append(idx)
-                    tags['types'].append(t)
-
-                    search_string = ' '.join(words[:n_words])
-                    cur_val = text_utils.remove_first_occurrence(
-                        cur_line, search_string, '_parse_question_tags'
-                    )
-                    tags['values'].append(cur_val)
+                tags['values'].append(cur_val)
 
         return tags
 
     # question parsing section
-    def _parse_question(self, question_lines, lines_no_html):
+    def _parse_question(self, question_lines, lines_no_html,
+                        semantic_scores=None):
         """ Given a set of question lines,
             tries to parse text, options, answers and optionals
         """
-        q_tags = self._parse_question_tags(question_lines, lines_no_html)
+        q_tags = self._parse_question_tags(
+            question_lines, lines_no_html, semantic_scores
+        )
 
         # remove tag lines
         non_tag_lines_id = set(range(len(question_lines))) - set(q_tags['lines'])  # noqa
@@ -381,7 +926,9 @@ class SimilarityParser:
         if len(question_lines[0].split()) > 0:
             first_line_text = lines_no_html[0].strip()
 
-            source_candidate = re.search('^\(.+\)', first_line_text)
+            source_candidate = self.session.source_pattern.search(
+                first_line_text
+            )
             if source_candidate is not None:
                 source_candidate = source_candidate.group()
 
@@ -392,7 +939,7 @@ class SimilarityParser:
                     q_tags['types'].append('source')
                     q_tags['values'].append(source_candidate[1:-1])
 
-                    cur_val = text_utils.remove_first_occurrence(
+                    cur_val = text_utils.remove_first_text_occurrence(
                         question_lines[0], source_candidate, '_parse_question'
                     )
                     non_tag_lines[0] = cur_val
@@ -437,10 +984,9 @@ class SimilarityParser:
                 ans[self.ans['tags']] = val
             elif t == 'correct_answer':
                 # pick up the letter and make it become a number
-                question_ans_soup = BeautifulSoup(val, features="lxml")
-                candidate = question_ans_soup.text.strip().lower()
+                candidate = text_utils.html_to_text(val).strip().lower()
                 if len(candidate) > 0:
-                    candidate = question_ans_soup.text.strip().lower()[-1]
+                    candidate = candidate[-1]
                     candidate = LOWERCASE_CHARS.index(candidate)
                     if candidate >= 0:
                         ans[self.ans['correct_answer']] = candidate
@@ -475,7 +1021,7 @@ class SimilarityParser:
                     choice_chars.append(line_text[0].lower())
 
                     search_string = line_text[0:1 + len(delimiter)]
-                    cur_val = text_utils.remove_first_occurrence(
+                    cur_val = text_utils.remove_first_text_occurrence(
                         line, search_string, '_try_parse_multiple_choice'
                     )
                     question_lines[idx] = cur_val
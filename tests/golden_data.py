@@ -0,0 +1,173 @@
+""" Golden data of the regression tests
+
+For every document in DOCUMENTS, tests/regression_data holds:
+
+<name>.zip - questions expected from the parser (JSON)
+<name>_lines.zip - lines extracted from the document and from its
+    answers file (JSON: {"lines": [...], "answer_lines": [...] or null})
+
+test_golden_questions.py parses the line snapshots directly, so parsing
+is checked without reading DOCX / PDF files again. test_regression.py
+checks separately that extraction still gives the snapshot lines.
+
+After a change that is meant to alter the output, check which goldens
+differ, review the change and regenerate them (from the repository root):
+
+python tests/golden_data.py --check
+python tests/golden_data.py
+python tests/golden_data.py --documents enem2019 --workers 1
+"""
+import os
+import sys
+import json
+import inspect
+import zipfile
+import logging
+import argparse
+from multiprocessing import Pool
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from similarity_parser import SimilarityParser  # noqa
+import pdf_parsing.pdf_extractor as pdf_e  # noqa
+
+
+GOLDEN_FOLDER = 'tests/regression_data'
+# (name, document, answers file or None)
+DOCUMENTS = [
+    ('Questionario_exemplo_parser_no_images',
+     'data/Questionario_exemplo_parser_no_images.docx', None),
+    ('Open_questions', 'data/Open_questions.docx', None),
+    ('enem2019', 'data/ENEM_PPL_1_DIA_CADERNO_1_AZUL.pdf',
+     'data/ENEM_PPL_1_DIA_CADERNO_1_AZUL_gab.pdf'),
+]
+
+
+def expected_file(name):
+    return os.path.join(GOLDEN_FOLDER, name + '.zip')
+
+
+def lines_file(name):
+    return os.path.join(GOLDEN_FOLDER, name + '_lines.zip')
+
+
+def load_json_from_zip(zip_file):
+    with zipfile.ZipFile(zip_file, 'r') as zp:
+        file = zp.namelist()[0]
+        with zp.open(file) as f:
+            return json.loads(f.read().decode('utf-8'))
+
+
+def save_json_to_zip(zip_file, data):
+    """ Saves data as <name>.json inside zip_file (<name>.zip)
+        unless the zip already holds the same data
+
+    Returns: True if the file was written
+    """
+    if os.path.isfile(zip_file) and load_json_from_zip(zip_file) == data:
+        return False
+    name = os.path.splitext(os.path.basename(zip_file))[0]
+    with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED) as zp:
+        zp.writestr(name + '.json', json.dumps(data))
+    return True
+
+
+def extract_lines(sp, file_name, answers=None):
+    """ Lines of a document and of its answers file, as they
+        reach the parse stages
+
+    Returns: {'lines': [...], 'answer_lines': [...] or None}
+    """
+    if file_name.lower().endswith('.docx'):
+        lines = list(sp._iter_docx_lines(file_name))
+    else:
+        lines = pdf_e.read_pdf_lines(file_name)
+    answer_lines = None
+    if answers is not None:
+        answer_lines = pdf_e.read_pdf_lines(answers)
+    return {'lines': lines, 'answer_lines': answer_lines}
+
+
+def parse_lines(sp, file_name, snapshot):
+    """ Questions of a document, parsed from its extracted lines
+        the same way parse_docx / parse_pdf do
+    """
+    specific_parser = None
+    if not file_name.lower().endswith('.docx'):
+        specific_parser = sp._get_specific_parser(file_name)
+    questions = sp._parse_questions(snapshot['lines'], specific_parser)
+    if snapshot['answer_lines'] is not None:
+        sp._match_answers(questions, snapshot['answer_lines'], file_name)
+    return questions
+
+
+def _golden_status(document, check=False):
+    """ Extracts and parses a document and compares (check=True)
+        or updates its golden files
+
+    Returns: (name, [golden files that differ / were written])
+    """
+    name, file_name, answers = document
+    sp = SimilarityParser()
+    snapshot = extract_lines(sp, file_name, answers)
+    outputs = [(lines_file(name), snapshot),
+               (expected_file(name), parse_lines(sp, file_name, snapshot))]
+
+    changed = []
+    for zip_file, data in outputs:
+        if check:
+            if not os.path.isfile(zip_file) or\
+                    load_json_from_zip(zip_file) != data:
+                changed.append(zip_file)
+        elif save_json_to_zip(zip_file, data):
+            changed.append(zip_file)
+    return name, changed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Regenerates the golden files of the regression tests: '
+        'extracted lines and expected questions of every document'
+    )
+    parser.add_argument(
+        '-d', '--documents', nargs='+',
+        choices=[x[0] for x in DOCUMENTS],
+        default=[x[0] for x in DOCUMENTS],
+        help='Only regenerate these documents'
+    )
+    parser.add_argument(
+        '-w', '--workers', type=int, default=len(DOCUMENTS),
+        help='Number of processes, each one handles whole documents'
+    )
+    parser.add_argument(
+        '--check', action='store_true',
+        help='Only report the golden files that are out of date, '
+        'exit with status 1 if any'
+    )
+    args = parser.parse_args()
+    assert args.workers > 0, 'Expected at least 1 worker'
+    logging.basicConfig(level=logging.INFO)
+
+    documents = [x for x in DOCUMENTS if x[0] in args.documents]
+    jobs = [(x, args.check) for x in documents]
+    if args.workers == 1 or len(jobs) == 1:
+        results = [_golden_status(*x) for x in jobs]
+    else:
+        with Pool(min(args.workers, len(jobs))) as pool:
+            results = pool.starmap(_golden_status, jobs)
+
+    n_changed = 0
+    for name, changed in results:
+        n_changed += len(changed)
+        status = 'out of date' if args.check else 'written'
+        for zip_file in changed:
+            logging.info(f'{name}: {zip_file} {status}')
+        if len(changed) == 0:
+            logging.info(f'{name}: up to date')
+    if args.check and n_changed > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# ensure that the benchmark suite at least runs
+import os
+import sys
+import json
+import inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, os.path.join(parentdir, 'benchmarks'))
+import run_benchmarks  # noqa
+
+
+class _TestArgs:
+    def __init__(self, tmp_path):
+        self.stages = ['parse_answers', 'incremental_parser']
+        self.scales = [1, 2]
+        self.repeat = 1
+        self.output = str(tmp_path / 'latest.json')
+        self.baseline = str(tmp_path / 'baseline.json')
+        self.save_baseline = False
+        self.tolerance = 0.2
+
+
+def test_benchmarks_run(tmp_path):
+    ta = _TestArgs(tmp_path)
+    ta.save_baseline = True
+    assert run_benchmarks.main(ta) == []
+    assert os.path.isfile(ta.baseline)
+
+    ta.save_baseline = False
+    ta.tolerance = 1000
+    assert run_benchmarks.main(ta) == []
+    assert os.path.isfile(ta.output)
+
+
+def test_compare_flags_regressions():
+    baseline = {'results': {
+        'a[x1]': {'time_s': 1.0, 'peak_mb': 10.0},
+        'b[x1]': {'time_s': 0.0001, 'peak_mb': 0.0},
+    }}
+    current = {'results': {
+        'a[x1]': {'time_s': 1.5, 'peak_mb': 10.5},
+        'b[x1]': {'time_s': 0.0003, 'peak_mb': 0.1},
+        'c[x1]': {'time_s': 9.0, 'peak_mb': 9.0},
+    }}
+    assert run_benchmarks.compare(current, baseline, 0.2) ==\
+        [('a[x1]', 'time_s', 1.0, 1.5)]
+
+
+def test_zero_baseline(tmp_path, capsys):
+    assert run_benchmarks.format_regression('b[x1]', 'peak_mb', 0.0, 1.0) ==\
+        'REGRESSION b[x1] peak_mb: 0.0000 -> 1.0000 (+100%)'
+
+    ta = _TestArgs(tmp_path)
+    ta.save_baseline = True
+    run_benchmarks.main(ta)
+    with open(ta.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    for result in baseline['results'].values():
+        result['time_s'] = result['peak_mb'] = 0.0
+    with open(ta.baseline, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f)
+
+    ta.save_baseline = False
+    regressions = run_benchmarks.main(ta)
+    assert capsys.readouterr().out.count('REGRESSION') == len(regressions)
@@ -0,0 +1,29 @@
+# parse stages only, from the line snapshots of the golden data:
+# no DOCX / PDF file is read, so this runs in seconds
+import os
+import sys
+import inspect
+
+import pytest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from similarity_parser import SimilarityParser  # noqa
+import tests.golden_data as golden_data  # noqa
+
+
+sp = SimilarityParser()
+REGENERATE = 'If the change is expected, run python tests/golden_data.py'
+
+
+@pytest.mark.parametrize('name, in_file, answers', golden_data.DOCUMENTS,
+                         ids=[x[0] for x in golden_data.DOCUMENTS])
+def test_golden_questions(name, in_file, answers):
+    snapshot = golden_data.load_json_from_zip(golden_data.lines_file(name))
+    computed_json = golden_data.parse_lines(sp, in_file, snapshot)
+    expected_json = golden_data.load_json_from_zip(
+        golden_data.expected_file(name)
+    )
+    assert computed_json == expected_json,\
+        f'Regression test failed for {in_file}. {REGENERATE}'
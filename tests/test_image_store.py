@@ -0,0 +1,55 @@
+import os
+import sys
+import inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from image_store import ImageStore  # noqa
+from similarity_parser import SimilarityParser  # noqa
+from result_cache import ResultCache  # noqa
+
+
+def test_same_contents_are_stored_once(tmp_path):
+    store = ImageStore(str(tmp_path / 'store'))
+    name1 = store.put(b'logo', 'png')
+    name2 = store.put(b'logo', 'png')
+    name3 = store.put(b'figure', 'png')
+    assert name1 == name2 != name3
+    assert name1 == ImageStore.image_name(b'logo', 'png')
+    assert name1 in store
+    assert sorted(os.listdir(store.folder)) == sorted([name1, name3])
+
+
+def test_pdf_images_are_deduplicated(tmp_path):
+    sp = SimilarityParser()
+    pdf_file = 'data/ENEM_PPL_1_DIA_CADERNO_1_AZUL.pdf'
+    store = ImageStore(str(tmp_path / 'store'))
+    stored = sp.parse_pdf(pdf_file, image_store=store)
+    (tmp_path / 'plain').mkdir()
+    plain = sp.parse_pdf(pdf_file, image_folder=str(tmp_path / 'plain'))
+
+    assert len(stored) == len(plain)
+    assert len(os.listdir(store.folder)) <= len(os.listdir(tmp_path / 'plain'))
+    # parsing again does not add anything
+    before = sorted(os.listdir(store.folder))
+    assert sp.parse_pdf(pdf_file, image_store=store) == stored
+    assert sorted(os.listdir(store.folder)) == before
+
+
+def test_docx_images_use_store_names(tmp_path):
+    store = ImageStore(str(tmp_path / 'store'))
+    cache = ResultCache(str(tmp_path / 'cache'))
+    sp = SimilarityParser(cache=cache)
+    docx_file = 'data/Questionario_exemplo_parser.docx'
+    questions = sp.parse_docx(docx_file, image_store=store)
+    txt = str(questions)
+    assert 'image1.png' not in txt
+    images = os.listdir(store.folder)
+    assert len(images) > 0
+    assert all(x in txt for x in images)
+
+    # cache hits restore the images into the store
+    other_store = ImageStore(str(tmp_path / 'other'))
+    assert sp.parse_docx(docx_file, image_store=other_store) == questions
+    assert sorted(os.listdir(other_store.folder)) == sorted(images)
@@ -0,0 +1,55 @@
+import os
+import sys
+import inspect
+
+import pytest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from nlp_models.structured_incremental_parser import IncrementalParser  # noqa
+
+
+def split(lines, **kwargs):
+    return IncrementalParser(**kwargs).parse_text_lines_inc_numbers(
+        lines, lines
+    )
+
+
+def test_numbers_at_line_start():
+    lines = ['Some text', '1. Do this', 'with 2 words',
+             '2. Do that', '3. And that']
+    assert split(lines) == [1, 3, 4]
+
+
+def test_text_before_numbers():
+    lines = ['Intro 2020', 'Question 1. This', 'Text 3 and 4',
+             'Question 2. That', 'Question 3. Other']
+    assert split(lines) == [1, 3, 4]
+
+
+def test_spaces_and_same_chars():
+    """ `1 )`, `2.` and `3-` are the same delimiter
+    """
+    lines = ['1 ) first', 'text', '2. second', '3- third', 'page 10']
+    assert split(lines) == [0, 2, 3]
+    # otherwise each delimiter is seen once: the first one wins
+    assert split(lines, ignore_spaces=False, same_char_list=['.']) == [0]
+
+
+def test_ties_go_to_first_seen():
+    lines = ['1) a', '2. b', '3) c', '4. d']
+    assert split(lines, same_char_list=[]) == [0, 2]
+    assert split(list(reversed(lines)), same_char_list=[]) == [0, 2]
+
+
+def test_look_behind_of_zero():
+    """ Only numbers that start the line can be matched
+    """
+    lines = ['a 1) x', 'b 2) y', '3) z']
+    assert split(lines, look_behind=0) == [2]
+
+
+def test_no_numbers():
+    with pytest.raises(ValueError):
+        split(['no', 'numbers', 'here'])
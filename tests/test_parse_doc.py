@@ -1,8 +1,14 @@
 # ensure that parse_doc at least runs
 import os
+import re
 import sys
+import gzip
+import json
+import shutil
 import inspect
 
+import pytest
+
 currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
@@ -13,8 +19,360 @@ class _TestArgs:
     def __init__(self):
         self.input = 'data'
         self.output = 'output'
+        self.workers = 1
+        self.pdf_workers = 1
+        self.unordered = False
+        self.cache_dir = None
+        self.cache_size_mb = 1024
+        self.refresh_cache = False
+        self.clear_cache = False
+        self.incremental = False
+        self.shared_images = False
+        self.stats = None
+        self.format = ['html']
+        self.compress = False
 
 
 def test_parse_doc_run():
     ta = _TestArgs()
     parse_doc.main(ta)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_parse_doc_workers_isolate_failures(workers, tmp_path):
+    """ A corrupt document must not abort the other ones
+    """
+    in_folder = tmp_path / 'input'
+    in_folder.mkdir()
+    shutil.copy('data/Open_questions.docx', in_folder)
+    with open(in_folder / 'corrupt.pdf', 'wb') as f:
+        f.write(b'this is not a pdf')
+
+    ta = _TestArgs()
+    ta.input = str(in_folder)
+    ta.output = str(tmp_path / 'output')
+    ta.workers = workers
+    ta.unordered = True
+    failed = parse_doc.main(ta)
+
+    assert failed == ['corrupt.pdf']
+    assert os.path.isfile(
+        os.path.join(ta.output, 'Open_questions', '00000001.html')
+    )
+
+
+def test_parse_doc_with_cache(tmp_path):
+    ta = _TestArgs()
+    ta.output = str(tmp_path / 'output')
+    ta.cache_dir = str(tmp_path / 'cache')
+    parse_doc.main(ta)
+    first_run = sorted(os.listdir(ta.cache_dir))
+    assert len(first_run) == len(parse_doc._list_documents(ta.input))
+
+    # second run only reads from the cache
+    shutil.rmtree(ta.output)
+    parse_doc.main(ta)
+    assert sorted(os.listdir(ta.cache_dir)) == first_run
+    assert os.path.isfile(os.path.join(
+        ta.output, 'Questionario_exemplo_parser', '00000001.html'
+    ))
+
+    ta.clear_cache = True
+    ta.refresh_cache = True
+    parse_doc.main(ta)
+    assert sorted(os.listdir(ta.cache_dir)) == first_run
+
+
+def test_parse_doc_incremental(tmp_path):
+    in_folder = tmp_path / 'input'
+    in_folder.mkdir()
+    shutil.copy('data/Open_questions.docx', in_folder)
+    shutil.copy('data/Questionario_exemplo_parser.docx', in_folder)
+
+    ta = _TestArgs()
+    ta.input = str(in_folder)
+    ta.output = str(tmp_path / 'output')
+    ta.incremental = True
+    parse_doc.main(ta)
+    manifest = parse_doc._load_manifest(ta.output)
+    assert sorted(manifest['documents']) == sorted(os.listdir(in_folder))
+
+    page = os.path.join(ta.output, 'Open_questions', '00000001.html')
+    os.utime(page, (0, 0))
+
+    # nothing changed: no document is parsed again
+    parse_calls = []
+    original_parse = parse_doc.parse_document
+
+    def counting_parse(*args, **kwargs):
+        parse_calls.append(args[2])
+        return original_parse(*args, **kwargs)
+
+    parse_doc.parse_document = counting_parse
+    try:
+        parse_doc.main(ta)
+        assert parse_calls == []
+
+        # a touched document with the same contents is skipped as well
+        os.utime(in_folder / 'Open_questions.docx')
+        parse_doc.main(ta)
+        assert parse_calls == []
+
+        # a changed document is parsed, but unchanged pages are not rewritten
+        manifest = parse_doc._load_manifest(ta.output)
+        inputs = manifest['documents']['Open_questions.docx']['inputs']
+        inputs['files']['Open_questions.docx'].update(
+            sha256='changed', mtime=0
+        )
+        parse_doc._save_manifest(ta.output, manifest)
+        parse_doc.main(ta)
+        assert parse_calls == ['Open_questions.docx']
+        assert os.path.getmtime(page) == 0
+
+        # a missing page is written again
+        os.remove(page)
+        parse_doc.main(ta)
+        assert parse_calls == ['Open_questions.docx'] * 2
+        assert os.path.isfile(page)
+    finally:
+        parse_doc.parse_document = original_parse
+
+    # removed documents are dropped from the manifest
+    os.remove(in_folder / 'Open_questions.docx')
+    parse_doc.main(ta)
+    manifest = parse_doc._load_manifest(ta.output)
+    assert list(manifest['documents']) == ['Questionario_exemplo_parser.docx']
+
+
+def test_parse_doc_shared_images(tmp_path):
+    ta = _TestArgs()
+    ta.output = str(tmp_path / 'output')
+    ta.shared_images = True
+    parse_doc.main(ta)
+
+    shared = os.path.join(ta.output, parse_doc.SHARED_IMAGES_FOLDER)
+    images = os.listdir(shared)
+    assert len(images) > 0
+    assert all(len(x.split('.')[0]) == 64 for x in images)
+    # no document keeps its own copy
+    for document in parse_doc._list_documents(ta.input):
+        out_folder = os.path.join(ta.output, document.split('.')[0])
+        assert not os.path.isdir(os.path.join(out_folder, 'images'))
+
+    # pages point to the shared folder
+    pages = []
+    out_folder = os.path.join(ta.output, 'Questionario_exemplo_parser')
+    for page in os.listdir(out_folder):
+        with open(os.path.join(out_folder, page), encoding='utf-8') as f:
+            pages.append(f.read())
+    referenced = set()
+    for page in pages:
+        referenced.update(re.findall('<img src="../_images/([^"]+)">', page))
+    assert len(referenced) > 0
+    assert referenced <= set(images)
+
+
+def test_parse_doc_stats(tmp_path):
+    ta = _TestArgs()
+    ta.output = str(tmp_path / 'output')
+    ta.stats = str(tmp_path / 'stats.json')
+    ta.workers = 2
+    parse_doc.main(ta)
+
+    with open(ta.stats, encoding='utf-8') as f:
+        stats = json.load(f)
+    n_documents = len(parse_doc._list_documents(ta.input))
+    assert stats['summary']['documents'] == n_documents
+    assert len(stats['documents']) == n_documents
+    assert stats['summary']['counters']['questions'] > 0
+    assert stats['summary']['answers'] == {'matched': 1}
+    assert 'extract' in stats['summary']['stage_times']
+
+
+def _read_jsonl(file_name):
+    opener = gzip.open if file_name.endswith('.gz') else open
+    with opener(file_name, 'rt', encoding='utf-8') as f:
+        return [json.loads(x) for x in f]
+
+
+def test_parse_doc_jsonl(tmp_path):
+    ta = _TestArgs()
+    ta.output = str(tmp_path / 'output')
+    ta.format = ['html', 'jsonl']
+    parse_doc.main(ta)
+    records = _read_jsonl(os.path.join(ta.output, parse_doc.JSONL_FILE))
+
+    documents = parse_doc._list_documents(ta.input)
+    assert [x['document_id'] for x in records if x['question_index'] == 0]\
+        == documents
+    for document in documents:
+        questions = [x['question'] for x in records
+                     if x['document_id'] == document]
+        assert [x['question_index'] for x in records
+                if x['document_id'] == document] ==\
+            list(range(len(questions)))
+        # one page per question
+        out_folder = os.path.join(ta.output, document.split('.')[0])
+        pages = [x for x in os.listdir(out_folder) if x.endswith('.html')]
+        assert len(pages) == len(questions)
+
+    sp = parse_doc.SimilarityParser()
+    docx_file = 'Open_questions.docx'
+    assert [x['question'] for x in records
+            if x['document_id'] == docx_file] ==\
+        sp.parse_docx(os.path.join(ta.input, docx_file))
+
+    # compressed, without html, with workers: same records
+    ta.output = str(tmp_path / 'output_gz')
+    ta.format = ['jsonl']
+    ta.compress = True
+    ta.workers = 2
+    parse_doc.main(ta)
+    assert _read_jsonl(os.path.join(ta.output, parse_doc.JSONL_FILE + '.gz'))\
+        == records
+    out_folder = os.path.join(ta.output, 'Open_questions')
+    assert not any(x.endswith('.html') for x in os.listdir(out_folder))
+
+
+def test_parse_doc_jsonl_incremental(tmp_path):
+    in_folder = tmp_path / 'input'
+    in_folder.mkdir()
+    shutil.copy('data/Open_questions.docx', in_folder)
+    shutil.copy('data/Questionario_exemplo_parser.docx', in_folder)
+
+    ta = _TestArgs()
+    ta.input = str(in_folder)
+    ta.output = str(tmp_path / 'output')
+    ta.format = ['jsonl']
+    ta.incremental = True
+    jsonl_file = os.path.join(ta.output, parse_doc.JSONL_FILE)
+
+    def documents_of(records):
+        return sorted(set(x['document_id'] for x in records))
+
+    parse_doc.main(ta)
+    records = _read_jsonl(jsonl_file)
+    assert documents_of(records) == sorted(os.listdir(in_folder))
+
+    # nothing changed: the lines are carried over
+    parse_doc.main(ta)
+    assert _read_jsonl(jsonl_file) == records
+
+    # only the changed document is parsed again, compressed as well
+    manifest = parse_doc._load_manifest(ta.output)
+    inputs = manifest['documents']['Open_questions.docx']['inputs']
+    inputs['files']['Open_questions.docx']['sha256'] = 'changed'
+    parse_doc._save_manifest(ta.output, manifest)
+    ta.compress = True
+    parse_doc.main(ta)
+    carried = _read_jsonl(jsonl_file + '.gz')
+    assert sorted(carried, key=lambda x: x['document_id']) ==\
+        sorted(records, key=lambda x: x['document_id'])
+    assert not any(x.endswith('.tmp') for x in os.listdir(ta.output))
+
+    # documents missing from the previous file are parsed again next time
+    os.remove(jsonl_file)
+    os.remove(jsonl_file + '.gz')
+    parse_doc.main(ta)
+    assert _read_jsonl(jsonl_file + '.gz') == []
+    assert parse_doc._load_manifest(ta.output)['documents'] == {}
+    parse_doc.main(ta)
+    assert documents_of(_read_jsonl(jsonl_file + '.gz')) ==\
+        documents_of(records)
+
+
+def test_parse_doc_store(tmp_path):
+    from question_store import QuestionStore
+
+    ta = _TestArgs()
+    ta.output = str(tmp_path / 'output')
+    ta.format = ['store']
+    parse_doc.main(ta)
+    store = QuestionStore(
+        os.path.join(ta.output, parse_doc.QUESTION_STORE_FOLDER)
+    )
+    assert store.documents == parse_doc._list_documents(ta.input)
+    sp = parse_doc.SimilarityParser()
+    questions = sp.parse_docx(os.path.join(ta.input, 'Open_questions.docx'))
+    stored = [store[x] for x in store.document_rows('Open_questions.docx')]
+    assert [x['stem'] for x in stored] == [x['stem'] for x in questions]
+
+
+def test_parse_doc_store_incremental(tmp_path):
+    from question_store import QuestionStore
+
+    in_folder = tmp_path / 'input'
+    in_folder.mkdir()
+    shutil.copy('data/Open_questions.docx', in_folder)
+    shutil.copy('data/Questionario_exemplo_parser.docx', in_folder)
+
+    ta = _TestArgs()
+    ta.input = str(in_folder)
+    ta.output = str(tmp_path / 'output')
+    ta.format = ['store']
+    ta.incremental = True
+    store_folder = os.path.join(ta.output, parse_doc.QUESTION_STORE_FOLDER)
+
+    def stored_questions():
+        store = QuestionStore(store_folder)
+        return {x: [store[y] for y in store.document_rows(x)]
+                for x in store.documents}
+
+    parse_doc.main(ta)
+    expected = stored_questions()
+    assert sorted(expected) == sorted(os.listdir(in_folder))
+    assert all(len(x) > 0 for x in expected.values())
+
+    # nothing changed: the questions are carried over
+    parse_doc.main(ta)
+    assert stored_questions() == expected
+
+    # only the changed document is parsed again
+    manifest = parse_doc._load_manifest(ta.output)
+    inputs = manifest['documents']['Open_questions.docx']['inputs']
+    inputs['files']['Open_questions.docx']['sha256'] = 'changed'
+    parse_doc._save_manifest(ta.output, manifest)
+    parse_doc.main(ta)
+    assert stored_questions() == expected
+    assert not any(x.endswith('.previous') for x in os.listdir(ta.output))
+
+    # documents missing from the previous store are parsed again next time
+    shutil.rmtree(store_folder)
+    parse_doc.main(ta)
+    assert stored_questions() == {}
+    assert parse_doc._load_manifest(ta.output)['documents'] == {}
+    parse_doc.main(ta)
+    assert stored_questions() == expected
+
+
+def test_question_html():
+    question = {
+        'stem': 'Which one? ----media/image1.png----',
+        'type': 'choice',
+        'choices': [{'text': 'this ----media/image2.png----'},
+                    {'text': 'that'}],
+        'correct_answer': 1,
+        'number': 3,
+        'all_parsed_tags': {'types': ['stem', 'choice'],
+                            'values': [None, 'a ----media/image3.png----']}
+    }
+    html = parse_doc.question2html(question, next_html='2.html',
+                                   img_folder='imgs')
+    assert html == (
+        '<html><body><a href="2.html">Next</a><br><hr>'
+        'Which one? <img src="imgs/image1.png">'
+        '<br><br>Option 1:<br>this <img src="imgs/image2.png">'
+        '<p style="color:green; font-weight: bold">'
+        '<br><br>Option 2:<br>that</p>'
+        '<hr>Remaining info:<hr><br>'
+        '<br><br>type:<br>choice'
+        '<br><br>correct_answer:<br>1'
+        '<br><br>number:<br>3'
+        '<br><br><hr>All parsed tags:<hr>'
+        # like the other lists, values that are
+        # not strings or dictionaries are left out
+        '<br><br>stem:<br>a <img src="imgs/image3.png">'
+        '</body></html>'
+    )
+    # the question is not changed
+    assert question['stem'] == 'Which one? ----media/image1.png----'
@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+import inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+import similarity_parser  # noqa
+from similarity_parser import SimilarityParser  # noqa
+from parse_stats import ParseStats, StatsAggregator  # noqa
+
+
+def test_stopwatch_accumulates_stages():
+    stats = ParseStats('file.pdf', 'parse_pdf')
+    stats.start_stage('a')
+    time.sleep(0.01)
+    stats.start_stage('b')
+    stats.start_stage('a')
+    time.sleep(0.01)
+    stats.stop_stage()
+    time.sleep(0.01)
+    stats.finish()
+    assert set(stats.stage_times) == {'a', 'b'}
+    assert 0.02 <= stats.stage_times['a'] < stats.total_time
+    assert stats.counters['distance_computations'] == 0
+
+
+def test_hook_gets_stats_of_each_call():
+    agg = StatsAggregator()
+    sp = SimilarityParser(stats_hook=agg)
+    questions = sp.parse_docx('data/Open_questions.docx')
+    sp.parse_docx('data/Questionario_exemplo_parser.docx')
+
+    assert len(agg.documents) == 2
+    first = agg.documents[0]
+    assert first['method'] == 'parse_docx'
+    assert first['incremental_fallback']
+    assert first['counters']['questions'] == len(questions)
+    assert first['counters']['lines'] > 0
+    assert {'extract', 'html_to_lines', 'incremental_parser'} <=\
+        set(first['stage_times'])
+    assert not agg.documents[1]['incremental_fallback']
+
+    summary = agg.summary()
+    assert summary['documents'] == 2
+    assert summary['incremental_fallbacks'] == 1
+
+
+def test_nothing_is_measured_without_hook(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('ParseStats created without a hook')
+    monkeypatch.setattr(similarity_parser, 'ParseStats', fail)
+    SimilarityParser().parse_docx('data/Open_questions.docx')
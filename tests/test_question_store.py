@@ -0,0 +1,139 @@
+import os
+import sys
+import pickle
+import inspect
+
+import pytest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from similarity_parser import SimilarityParser  # noqa
+from question_store import QuestionStore, QuestionStoreWriter  # noqa
+
+
+STORED_FIELDS = ['stem', 'type', 'choices', 'correct_answer', 'hints',
+                 'tags', 'comment', 'source']
+
+
+def _stored(question):
+    """ What the store keeps of a parsed question
+    """
+    ans = {k: v for k, v in question.items() if k in STORED_FIELDS}
+    tags = question['all_parsed_tags']
+    if 'source' in tags['types']:
+        ans['source'] = tags['values'][tags['types'].index('source')]
+    return ans
+
+
+@pytest.fixture(scope='module')
+def documents():
+    sp = SimilarityParser()
+    return {
+        'Open_questions.docx': sp.parse_docx('data/Open_questions.docx'),
+        'Questionario_exemplo_parser.docx':
+            sp.parse_docx('data/Questionario_exemplo_parser.docx'),
+        'ENEM.pdf': sp.parse_pdf(
+            'data/ENEM_PPL_1_DIA_CADERNO_1_AZUL.pdf',
+            answers='data/ENEM_PPL_1_DIA_CADERNO_1_AZUL_gab.pdf'
+        ),
+        # open questions with textual answers
+        'text_answers': [{'stem': 'Name it', 'type': 'long',
+                          'correct_answer': 'PNG', 'hints': [],
+                          'all_parsed_tags': {'types': [], 'values': []}}],
+        'empty': []
+    }
+
+
+@pytest.fixture(scope='module')
+def store(documents, tmp_path_factory):
+    folder = str(tmp_path_factory.mktemp('store'))
+    with QuestionStoreWriter(folder) as writer:
+        for document_id, questions in documents.items():
+            writer.add_document(document_id, questions)
+    return QuestionStore(folder)
+
+
+def test_round_trip(documents, store):
+    assert store.documents == list(documents)
+    assert len(store) == sum(len(x) for x in documents.values())
+    row = 0
+    for document_id, questions in documents.items():
+        assert store.document_rows(document_id) ==\
+            range(row, row + len(questions))
+        for idx, question in enumerate(questions):
+            assert store.get(document_id, idx) == _stored(question)
+            assert store[row] == _stored(question)
+            assert store.document_of(row) == (document_id, idx)
+            row += 1
+
+
+def test_find(documents, store):
+    all_questions = [x for questions in documents.values() for x in questions]
+    rows = store.find(type='choice', has_correct_answer=True)
+    assert list(rows) == [
+        idx for idx, x in enumerate(all_questions)
+        if x['type'] == 'choice' and 'correct_answer' in x
+    ]
+    assert len(rows) > 0
+
+    rows = store.find(has_correct_answer=False, document_id='ENEM.pdf')
+    assert all(store.document_of(x)[0] == 'ENEM.pdf' for x in rows)
+    assert all('correct_answer' not in store[x] for x in rows)
+    assert list(store.find(type='long', document_id='text_answers')) ==\
+        list(store.document_rows('text_answers'))
+    assert len(store.find(type='unknown')) == 0
+
+
+def test_errors_and_pickle(store):
+    with pytest.raises(IndexError):
+        store.get('Open_questions.docx', 1000)
+    with pytest.raises(KeyError):
+        store.get('missing.docx', 0)
+    assert pickle.loads(pickle.dumps(store))[-1] == store[-1]
+
+
+def test_empty_store(tmp_path):
+    QuestionStoreWriter(str(tmp_path)).close()
+    store = QuestionStore(str(tmp_path))
+    assert len(store) == 0
+    assert len(store.find(has_correct_answer=True)) == 0
+
+
+def test_keep_documents(documents, store, tmp_path, caplog):
+    folder = str(tmp_path / 'store')
+    with QuestionStoreWriter(folder) as writer:
+        for document_id, questions in documents.items():
+            writer.add_document(document_id, questions)
+
+    kept = ['ENEM.pdf', 'text_answers', 'missing.docx']
+    with QuestionStoreWriter(folder, keep_documents=kept) as writer:
+        writer.add_document('new.docx', documents['Open_questions.docx'])
+    assert 'missing.docx' in caplog.text
+    assert os.listdir(str(tmp_path)) == ['store']
+
+    replaced = QuestionStore(folder)
+    assert replaced.documents == ['ENEM.pdf', 'text_answers', 'new.docx']
+    for document_id in ['ENEM.pdf', 'text_answers']:
+        assert [replaced[x] for x in replaced.document_rows(document_id)] ==\
+            [store[x] for x in store.document_rows(document_id)]
+    assert writer.missing_documents == ['missing.docx']
+
+
+def test_keep_documents_after_interruption(documents, store, tmp_path):
+    folder = str(tmp_path / 'store')
+    with QuestionStoreWriter(folder) as writer:
+        writer.add_document('ENEM.pdf', documents['ENEM.pdf'])
+
+    # a run killed before close: no meta.json, previous store left aside
+    writer = QuestionStoreWriter(folder, keep_documents=[])
+    writer._strings.close()
+    assert sorted(os.listdir(str(tmp_path))) == ['store', 'store.previous']
+
+    with QuestionStoreWriter(folder, keep_documents=['ENEM.pdf']) as writer:
+        pass
+    assert writer.missing_documents == []
+    assert os.listdir(str(tmp_path)) == ['store']
+    replaced = QuestionStore(folder)
+    assert [replaced[x] for x in replaced.document_rows('ENEM.pdf')] ==\
+        [store[x] for x in store.document_rows('ENEM.pdf')]
@@ -1,60 +1,217 @@
-# ensure that the output for some files is as expected
+# ensure that the output for some files is as expected, from the
+# DOCX / PDF files (see test_golden_questions.py for the parse stages)
 import os
 import sys
-import json
 import inspect
 import zipfile
 
+import io
+import re
+import copy
+
+import fitz
 import pytest
+from docx2python import docx2python
+from docx2python.docx_text import get_text
+from docx2python.docx_context import get_context
 
 currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
 parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
 from similarity_parser import SimilarityParser  # noqa
+import pdf_parsing.pdf_extractor as pdf_e  # noqa
+import docx_parsing.docx_extractor as docx_e  # noqa
+import tests.golden_data as golden_data  # noqa
 
 
-docx_files = [
-    ('data/Questionario_exemplo_parser_no_images.docx',
-     'tests/regression_data/Questionario_exemplo_parser_no_images.zip'),
-    ('data/Open_questions.docx',
-     'tests/regression_data/Open_questions.zip'),
-]
-pdf_files = [
-    ('data/ENEM_PPL_1_DIA_CADERNO_1_AZUL.pdf',
-     'data/ENEM_PPL_1_DIA_CADERNO_1_AZUL_gab.pdf',
-     'tests/regression_data/enem2019.zip')
-]
+all_docx_files = [x[1] for x in golden_data.DOCUMENTS
+                  if x[1].endswith('.docx')] +\
+    ['data/Questionario_exemplo_parser.docx']
+# (questions, answers)
+pdf_files = [x[1:] for x in golden_data.DOCUMENTS
+             if x[1].endswith('.pdf')]
 
 
 sp = SimilarityParser()
+REGENERATE = 'If the change is expected, run python tests/golden_data.py'
 
 
-def load_json_from_zip(out_zip):
-    with zipfile.ZipFile(out_zip, 'r') as zp:
-        file = zp.namelist()[0]
-        with zp.open(file) as f:
-            data = f.read()
-            expected_json = json.loads(data.decode("utf-8"))
-    return expected_json
-
+@pytest.mark.parametrize('name, in_file, answers', golden_data.DOCUMENTS,
+                         ids=[x[0] for x in golden_data.DOCUMENTS])
+def test_golden_lines(name, in_file, answers):
+    """ Extraction only: DOCX / PDF files to lines
+    """
+    computed = golden_data.extract_lines(sp, in_file, answers)
+    expected = golden_data.load_json_from_zip(golden_data.lines_file(name))
+    assert computed == expected,\
+        f'Extracted lines changed for {in_file}. {REGENERATE}'
 
-@pytest.mark.parametrize("in_file, out_zip", docx_files)
-def test_docx_results(in_file, out_zip):
-    computed_json = sp.parse_docx(in_file)
-    # with open('docx_data.json', 'w') as f:
-    #    json.dump(computed_json, f)
-    expected_json = load_json_from_zip(out_zip)
 
+@pytest.mark.parametrize('name, in_file, answers', golden_data.DOCUMENTS,
+                         ids=[x[0] for x in golden_data.DOCUMENTS])
+def test_golden_end_to_end(name, in_file, answers):
+    """ Public API: parse_docx / parse_pdf on the documents
+    """
+    if in_file.endswith('.docx'):
+        computed_json = sp.parse_docx(in_file)
+    else:
+        computed_json = sp.parse_pdf(in_file, answers=answers)
+    expected_json = golden_data.load_json_from_zip(
+        golden_data.expected_file(name)
+    )
     assert computed_json == expected_json,\
-        f'Regression test failed for {in_file}'
+        f'Regression test failed for {in_file}. {REGENERATE}'
 
 
-@pytest.mark.parametrize("in_raw_file, in_raw_ans_file, out_zip", pdf_files)
-def test_pdf_results(in_raw_file, in_raw_ans_file, out_zip):
-    computed_json = sp.parse_pdf(in_raw_file, answers=in_raw_ans_file)
-    # with open('pdf_data.json', 'w') as f:
-    #    json.dump(computed_json, f)
+def test_pdf_streaming_matches_batch():
+    in_file = pdf_files[0][0]
+    streamed = list(sp.iter_pdf_questions(in_file))
+    expected = sp._parse_questions(
+        pdf_e.read_pdf_lines(in_file), sp._get_specific_parser(in_file)
+    )
+    assert streamed == expected
 
-    expected_json = load_json_from_zip(out_zip)
-    assert computed_json == expected_json,\
-        f'Regression test failed for {in_raw_file}'
+
+def test_questions_are_yielded_lazily():
+    """ Finished questions must come out before the input is exhausted
+    """
+    def lines():
+        yield 'Questão 1. First question'
+        yield 'Resposta: a'
+        yield 'Questão 2. Second question'
+        yield 'Questão 3. Third question'
+        raise RuntimeError('Read past the third question')
+
+    questions = sp._iter_questions(lines())
+    assert next(questions)['stem'].strip() == 'First question'
+    assert next(questions)['stem'].strip() == 'Second question'
+    with pytest.raises(RuntimeError):
+        next(questions)
+
+
+def test_pdf_images_are_saved_in_background(tmp_path):
+    pdf_file = pdf_files[0][0]
+    lines = pdf_e.read_pdf_lines(pdf_file, image_folder=str(tmp_path))
+    referenced = [x[len('----media/'):-len('----')] for x in lines
+                  if x.startswith('----media/')]
+    assert len(referenced) > 0
+    assert sorted(os.listdir(tmp_path)) == sorted(referenced)
+
+    # images are written as extracted, without re-encoding
+    with fitz.open(pdf_file) as doc:
+        blocks = [b for page in doc for b in page.get_text('dict')['blocks']
+                  if 'image' in b]
+    with open(tmp_path / referenced[0], 'rb') as f:
+        assert f.read() == blocks[0]['image']
+
+
+def test_pdf_image_errors_are_raised(tmp_path):
+    missing_folder = str(tmp_path / 'missing')
+    with pytest.raises(FileNotFoundError):
+        pdf_e.read_pdf_lines(pdf_files[0][0], image_folder=missing_folder)
+
+
+@pytest.mark.parametrize('pdf_file', [pdf_files[0][0], pdf_files[0][1]])
+def test_pdf_text_only_lines_match(pdf_file, tmp_path):
+    """ Skipping image data must not change any line or placeholder
+    """
+    text_only = pdf_e.read_pdf_lines(pdf_file)
+    assert text_only == pdf_e.read_pdf_lines(pdf_file, str(tmp_path))
+    with fitz.open(pdf_file) as doc:
+        n_images = sum(len(page.get_image_info()) for page in doc)
+    assert sum(x.startswith('----media/') for x in text_only) == n_images
+
+
+def test_pdf_answers_take_text_only_path():
+    """ Its only image has no xref: MuPDF renders it from a
+        transparency group
+    """
+    with fitz.open(pdf_files[0][1]) as doc:
+        for page in doc:
+            assert any(x['xref'] == 0 for x in page.get_image_info(xrefs=True))
+            blocks = pdf_e._text_only_blocks(page)
+            assert blocks is not None
+            assert [x['ext'] for x in blocks if x['type'] == 1] ==\
+                [x['ext'] for x in page.get_text('dict')['blocks']
+                 if x['type'] == 1]
+
+
+def test_pdf_page_parallel_matches_sequential(tmp_path):
+    pdf_file = pdf_files[0][0]
+    (tmp_path / 'seq').mkdir()
+    (tmp_path / 'par').mkdir()
+    sequential = pdf_e.read_pdf_lines(pdf_file, str(tmp_path / 'seq'))
+    parallel = pdf_e.read_pdf_lines(pdf_file, str(tmp_path / 'par'),
+                                    workers=3)
+    assert parallel == sequential
+
+    images = sorted(os.listdir(tmp_path / 'seq'))
+    assert sorted(os.listdir(tmp_path / 'par')) == images
+    for img in images:
+        with open(tmp_path / 'seq' / img, 'rb') as f1,\
+                open(tmp_path / 'par' / img, 'rb') as f2:
+            assert f1.read() == f2.read()
+
+    assert pdf_e.read_pdf_lines(pdf_file, workers=3) ==\
+        pdf_e.read_pdf_lines(pdf_file)
+
+
+@pytest.mark.parametrize('docx_file', all_docx_files)
+def test_docx_streamed_tables_match_docx2python(docx_file):
+    expected = docx2python(docx_file, html=True).document
+    assert list(docx_e.iter_docx_tables(docx_file)) == expected
+
+
+@pytest.mark.parametrize('docx_file', all_docx_files)
+def test_docx_streamed_lines_match_html_map(docx_file):
+    html_txt = re.sub(r'\(\d+, \d+, \d+, \d+\) ', '',
+                      docx2python(docx_file, html=True).html_map)
+    assert list(sp._iter_docx_lines(docx_file)) ==\
+        sp._html_to_lines(html_txt)
+
+
+def test_docx_streamed_nested_tables():
+    """ Nested tables, text boxes and hyperlinks, as docx2python reads them
+    """
+    ns = ('xmlns:w="http://schemas.openxmlformats.org/'
+          'wordprocessingml/2006/main" '
+          'xmlns:r="http://schemas.openxmlformats.org/'
+          'officeDocument/2006/relationships" '
+          'xmlns:v="urn:schemas-microsoft-com:vml"')
+    par = '<w:p><w:r><w:rPr><w:b/></w:rPr><w:t>{}</w:t></w:r></w:p>'
+    link = ('<w:p><w:hyperlink r:id="rIdLink"><w:r><w:t>link</w:t></w:r>'
+            '</w:hyperlink><w:r><w:t>&lt;a&gt;</w:t><w:tab/></w:r></w:p>')
+    text_box = ('<w:p><w:r><w:pict><v:shape><v:textbox><w:txbxContent>' +
+                par.format('boxed') +
+                '</w:txbxContent></v:textbox></v:shape></w:pict></w:r></w:p>')
+    nested = ('<w:tbl><w:tr><w:tc>' + par.format('inner') +
+              '</w:tc></w:tr></w:tbl>')
+    body = (par.format('1. first') + text_box +
+            '<w:tbl><w:tr><w:tc>' + par.format('a') + nested +
+            par.format('b') + '</w:tc><w:tc>' + link +
+            '</w:tc></w:tr><w:tr></w:tr></w:tbl>' + par.format('2. last'))
+    xml = f'<w:document {ns}><w:body>{body}</w:body></w:document>'.encode()
+
+    with zipfile.ZipFile(all_docx_files[0]) as zipf:
+        context = get_context(zipf)
+    context['do_html'] = True
+    context['rId2Target'] = {'rIdLink': 'http://example.com'}
+    expected = get_text(xml, copy.deepcopy(context))
+    assert len(expected) > 3
+    assert list(docx_e._iter_streamed_tables(io.BytesIO(xml), context)) ==\
+        expected
+
+
+def test_docx_images_are_copied(tmp_path):
+    docx_file = 'data/Questionario_exemplo_parser.docx'
+    (tmp_path / 'expected').mkdir()
+    docx2python(docx_file, str(tmp_path / 'expected'), html=True)
+    images = sorted(os.listdir(tmp_path / 'expected'))
+    assert len(images) > 0
+
+    names = docx_e.save_docx_images(docx_file, str(tmp_path / 'copied'))
+    assert sorted(names) == images
+    for img in images:
+        with open(tmp_path / 'expected' / img, 'rb') as f1,\
+                open(tmp_path / 'copied' / img, 'rb') as f2:
+            assert f1.read() == f2.read()
@@ -0,0 +1,129 @@
+# ensure that cached results are the same as parsed ones
+import os
+import sys
+import json
+import inspect
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from result_cache import ResultCache  # noqa
+from similarity_parser import SimilarityParser, DEFAULTCONFIG  # noqa
+
+
+docx_with_images = 'data/Questionario_exemplo_parser.docx'
+
+
+def _fail(*args, **kwargs):
+    raise AssertionError('Document parsed although it was cached')
+
+
+def test_docx_hit_restores_images(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    sp = SimilarityParser(cache=cache)
+    first_images = tmp_path / 'images1'
+    expected = sp.parse_docx(docx_with_images, image_folder=str(first_images))
+
+    monkeypatch.setattr(sp, '_parse_docx', _fail)
+    second_images = tmp_path / 'images2'
+    cached = sp.parse_docx(docx_with_images, image_folder=str(second_images))
+
+    assert cached == expected
+    referenced = set(
+        x for x in os.listdir(first_images)
+        if f'----media/{x}----' in json.dumps(expected)
+    )
+    assert len(referenced) > 0
+    assert set(os.listdir(second_images)) == referenced
+
+
+def test_pdf_hit_includes_answers(tmp_path, monkeypatch):
+    pdf = 'data/ENEM_PPL_1_DIA_CADERNO_1_AZUL.pdf'
+    answers = 'data/ENEM_PPL_1_DIA_CADERNO_1_AZUL_gab.pdf'
+    sp = SimilarityParser(cache=ResultCache(str(tmp_path)))
+    expected = sp.parse_pdf(pdf, answers=answers)
+    without_answers = sp.parse_pdf(pdf)
+    assert without_answers != expected
+
+    monkeypatch.setattr(sp, '_parse_pdf', _fail)
+    assert sp.parse_pdf(pdf, answers=answers) == expected
+    assert sp.parse_pdf(pdf) == without_answers
+
+
+def test_key_depends_on_config_and_version(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    config = dict(DEFAULTCONFIG, exercise_dist_tol=1)
+    key = cache.make_key([docx_with_images], DEFAULTCONFIG, 1)
+    assert key == cache.make_key([docx_with_images], DEFAULTCONFIG, 1)
+    assert key != cache.make_key([docx_with_images], config, 1)
+    assert key != cache.make_key([docx_with_images], DEFAULTCONFIG, 2)
+    assert key != cache.make_key([docx_with_images, None], DEFAULTCONFIG, 1)
+
+
+def test_refresh_bypasses_reads(tmp_path):
+    ResultCache(str(tmp_path)).put('key', [{'stem': 'old'}])
+    cache = ResultCache(str(tmp_path), refresh=True)
+    assert cache.get('key') is None
+    cache.put('key', [{'stem': 'new'}])
+    assert ResultCache(str(tmp_path)).get('key') == [{'stem': 'new'}]
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    # room for about 2 entries
+    cache = ResultCache(str(tmp_path), max_size_mb=2.5 / 2 ** 20 * 1000)
+    questions = [{'stem': 'x' * 980}]
+    cache.put('first', questions)
+    cache.put('second', questions)
+    os.utime(os.path.join(str(tmp_path), 'first', 'questions.json'),
+             (0, 0))
+    os.utime(os.path.join(str(tmp_path), 'second', 'questions.json'),
+             (1, 1))
+    # reading marks 'first' as recently used
+    assert cache.get('first') == questions
+    cache.put('third', questions)
+
+    assert cache.get('second') is None
+    assert cache.get('first') == questions
+    assert cache.get('third') == questions
+
+
+def test_folder_is_only_scanned_to_evict(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path), max_size_mb=2.5 / 2 ** 20 * 1000)
+    scans = []
+    scan = cache._scan
+    monkeypatch.setattr(cache, '_scan', lambda: scans.append(1) or scan())
+    questions = [{'stem': 'x' * 980}]
+    cache.put('first', questions)
+    cache.put('second', questions)
+    # replacing an entry does not count it twice
+    cache.put('second', questions)
+    assert len(scans) == 0
+    assert cache._total_size == _folder_size(tmp_path)
+
+    cache.put('third', questions)
+    assert len(scans) == 1
+    assert cache._total_size == _folder_size(tmp_path) < 2500
+
+
+def _folder_size(folder):
+    return sum(os.path.getsize(os.path.join(root, x))
+               for root, _, files in os.walk(str(folder)) for x in files)
+
+
+def test_size_is_shared_by_processes(tmp_path):
+    # e.g. the caches pickled into every parse_doc worker
+    max_size_mb = 2.5 / 2 ** 20 * 1000
+    caches = [ResultCache(str(tmp_path), max_size_mb) for _ in range(3)]
+    questions = [{'stem': 'x' * 980}]
+    for idx in range(3):
+        for cache in caches:
+            cache.put(f'{idx}_{id(cache)}', questions)
+            assert _folder_size(tmp_path) < 2500
+            assert cache._total_size == _folder_size(tmp_path)
+
+
+def test_clear(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put('key', [{'stem': 'text'}])
+    cache.clear()
+    assert cache.get('key') is None
@@ -0,0 +1,160 @@
+# parser behaviour that is not covered by the regression files
+import os
+import sys
+import copy
+import pickle
+import inspect
+
+import pytest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from similarity_parser import SimilarityParser, ParserSession,\
+    DEFAULTCONFIG  # noqa
+
+
+# synonyms point roughly in the same direction
+dummy_embeddings = {
+    'questão': [0.0, 1.0, 0.0],
+    'problema': [0.05, 0.98, 0.0],
+    'resposta': [1.0, 0.0, 0.0],
+    'gabarito': [1.0, 0.0, 0.1],
+    'solução': [0.95, 0.1, 0.0],
+    'texto': [0.0, 0.0, 1.0],
+    'detalhada': [0.0, 0.0, 1.0],
+    'comentado': [0.0, 0.0, 1.0],
+}
+
+synonym_lines = [
+    'Problema 1. Quanto é 1 + 1?',
+    'a) 1', 'b) 2', 'c) 3',
+    'Solução: b',
+    'Problema 2. Quanto é 1 + 2?',
+    'a) 3', 'b) 4', 'c) 5',
+    'Solução: a',
+]
+
+
+class TestSemanticMatching:
+    def test_synonyms_are_matched(self):
+        sp = SimilarityParser(embeddings=dummy_embeddings)
+        questions = sp._parse_questions(list(synonym_lines))
+
+        assert len(questions) == 2
+        assert [q['type'] for q in questions] == ['choice', 'choice']
+        assert [q['correct_answer'] for q in questions] == [1, 0]
+        assert questions[0]['all_parsed_tags']['types'] == ['correct_answer']
+
+    def test_synonym_tag_after_question_id(self):
+        # the tag is the first word once the header is removed
+        sp = SimilarityParser(embeddings=dummy_embeddings)
+        questions = sp._parse_questions(
+            ['Problema 1. Solução: b', 'a) 1', 'b) 2', 'Problema 2. x']
+        )
+        assert questions[0]['all_parsed_tags']['types'] == ['correct_answer']
+        assert questions[0] == sp._parse_questions(
+            ['Problema 1. Resposta: b', 'a) 1', 'b) 2', 'Problema 2. x']
+        )[0]
+
+    def test_unrelated_words_are_not_matched(self):
+        sp = SimilarityParser(embeddings=dummy_embeddings)
+        lines = ['Questão 1. Um texto', 'Texto: qualquer',
+                 'Questão 2. Outro texto']
+        questions = sp._parse_questions(lines)
+        assert len(questions) == 2
+        assert questions[0]['all_parsed_tags']['types'] == []
+
+    def test_disabled_without_embeddings(self):
+        sp = SimilarityParser()
+        questions = sp._parse_questions(list(synonym_lines))
+        for q in questions:
+            assert 'correct_answer' not in q['all_parsed_tags']['types']
+
+    def test_threshold_from_config(self):
+        config = dict(SimilarityParser().config)
+        config['tag_semantic_threshold'] = 0.999
+        sp = SimilarityParser(config=config, embeddings=dummy_embeddings)
+        questions = sp._parse_questions(list(synonym_lines))
+        assert len(questions) == 2
+        assert 'correct_answer' not in questions[0]
+
+    def test_thresholds_optional_without_embeddings(self):
+        # configs written before semantic matching lack the thresholds
+        config = copy.deepcopy(DEFAULTCONFIG)
+        del config['exercise_semantic_threshold']
+        del config['tag_semantic_threshold']
+        sp = SimilarityParser(config=config)
+        questions = sp._parse_questions(
+            ['Quiz 1. first', 'Resposta: a', 'Quiz 2. second']
+        )
+        assert len(questions) == 2
+
+
+class TestParserSession:
+    def test_session_is_immutable(self):
+        session = ParserSession()
+        with pytest.raises(AttributeError):
+            session.config = {}
+        with pytest.raises(AttributeError):
+            del session.tag_matcher
+
+    def test_session_owns_its_config(self):
+        config = copy.deepcopy(DEFAULTCONFIG)
+        session = ParserSession(config)
+        config['exercise_strings'].append('problema')
+        assert 'problema' not in session.config['exercise_strings']
+
+    def test_config_is_read_only(self):
+        session = ParserSession()
+        sp = SimilarityParser(session=session)
+        with pytest.raises(TypeError):
+            sp.config['exercise_dist_tol'] = 0
+        with pytest.raises(TypeError):
+            session.config['possible_tags']['hint'] = ['tip']
+        with pytest.raises(AttributeError):
+            sp.config['exercise_strings'].append('problema')
+        assert session.config['exercise_dist_tol'] ==\
+            DEFAULTCONFIG['exercise_dist_tol']
+
+    def test_pickled_session_parses_the_same(self):
+        session = ParserSession(embeddings=dummy_embeddings)
+        restored = pickle.loads(pickle.dumps(session))
+        questions = SimilarityParser(session=session)._parse_questions(
+            list(synonym_lines)
+        )
+        assert restored.config == session.config
+        assert SimilarityParser(session=restored)._parse_questions(
+            list(synonym_lines)
+        ) == questions
+
+    def test_parsers_share_the_session(self):
+        session = ParserSession()
+        sp1 = SimilarityParser(session=session)
+        sp2 = SimilarityParser(session=session)
+        assert sp1.tag_matcher is sp2.tag_matcher
+        assert sp1._parse_questions(list(synonym_lines)) ==\
+            SimilarityParser()._parse_questions(list(synonym_lines))
+        with pytest.raises(AssertionError):
+            SimilarityParser(config=DEFAULTCONFIG, session=session)
+
+
+class TestHtmlToLines:
+    def test_cells_are_counted_in_closest_table(self):
+        # the outer table has a single cell: only its pre elements
+        # are kept, including those of the tables inside it
+        html = ('<table><tr><td><pre>a</pre>'
+                '<table><tr><td><pre>x</pre></td><td>y</td></tr></table>'
+                '</td></tr></table>')
+        assert SimilarityParser()._html_to_lines(html) == [
+            'a', 'x', '<table><tr><td>x</td><td>y</td></tr></table>'
+        ]
+
+    def test_tables_in_document_order(self):
+        html = ('<table><tr><td><pre>1</pre></td></tr></table>'
+                '<table><tr><td>2</td></tr><tr><td>3</td></tr></table>'
+                '<table><tr><td><pre>4</pre><pre>5</pre></td></tr></table>')
+        assert SimilarityParser()._html_to_lines(html) == [
+            '1', '<table><tr><td>2</td></tr><tr><td>3</td></tr></table>',
+            '4', '5'
+        ]
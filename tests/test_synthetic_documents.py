@@ -0,0 +1,66 @@
+# ensure that synthetic questionnaires parse into their ground truth
+import os
+import sys
+import json
+import inspect
+
+import pytest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, os.path.join(parentdir, 'benchmarks'))
+import synthetic_documents as sd  # noqa
+
+
+OPTIONS = [
+    {},
+    {'image_ratio': 0.2, 'table_ratio': 0.2, 'tag_density': 0.8,
+     'noise': 0.5, 'n_choices': 4},
+    {'headers': False, 'noise': 0.5, 'image_ratio': 0.2},
+]
+
+
+@pytest.fixture(scope='module')
+def sp():
+    return sd.SimilarityParser()
+
+
+def _parse(sp, document):
+    with open(document['truth'], encoding='utf-8') as f:
+        truth = json.load(f)
+    if document['document'].endswith('.docx'):
+        questions = sp.parse_docx(document['document'])
+    else:
+        questions = sp.parse_pdf(document['document'],
+                                 answers=document['answers'])
+    return sd.normalize_questions(questions), truth
+
+
+@pytest.mark.parametrize('options', OPTIONS)
+def test_documents_match_ground_truth(options, sp, tmp_path):
+    documents = sd.generate_documents(str(tmp_path), 40, **options)
+    assert [os.path.basename(x['document']) for x in documents] ==\
+        ['synthetic_40.docx', 'synthetic_40.pdf']
+    for document in documents:
+        questions, truth = _parse(sp, document)
+        assert len(truth) == 40
+        assert questions == truth, document['document']
+
+
+def test_answers_file(sp, tmp_path):
+    documents = sd.generate_documents(str(tmp_path), 30, formats=['pdf'],
+                                      answers=True, open_ratio=0, noise=0.3)
+    assert os.path.basename(documents[0]['answers']) == 'synthetic_30_gab.pdf'
+    questions, truth = _parse(sp, documents[0])
+    assert questions == truth
+
+    result = sd.evaluate(documents[0], sp)
+    assert result['matched'] == result['expected'] == 30
+
+
+def test_same_seed_same_questions():
+    options = {'image_ratio': 0.5, 'noise': 0.5}
+    assert sd.generate_questions(20, seed=3, **options) ==\
+        sd.generate_questions(20, seed=3, **options)
+    assert sd.generate_questions(20, seed=3, **options) !=\
+        sd.generate_questions(20, seed=4, **options)
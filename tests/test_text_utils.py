@@ -1,4 +1,10 @@
+import os
+import pickle
+import zipfile
+
 import pytest
+import numpy as np
+from bs4 import BeautifulSoup
 
 from .. import text_utils
 
@@ -23,6 +29,26 @@ class TestRemoveFirstOccurrence:
         assert out == out_text
 
 
+class TestRemoveFirstTextOccurrence:
+    texts = TestRemoveFirstOccurrence.texts + [
+        ('<p style="font-size:10.0pt">Exercise 10. Text</p>', '10.',
+         '<p style="font-size:10.0pt">Exercise  Text</p>'),
+        ('<b>a)</b> a) <i class="a)">x</i>', 'a)',
+         '<b></b> a) <i class="a)">x</i>'),
+        ('<p title="only here">text</p>', 'only here',
+         '<p title="only here">text</p>'),
+    ]
+
+    @pytest.mark.parametrize("text, txt_find, out_text", texts)
+    def test_remove_first_text_occurrence(self, text, txt_find, out_text,
+                                          caplog):
+        out = text_utils.remove_first_text_occurrence(text, txt_find)
+        if text == out:
+            assert len(caplog.record_tuples) == 1 and\
+                caplog.record_tuples[0][1] == 30, 'Expected a logging warning'
+        assert out == out_text
+
+
 class TestMatchFirstWords:
     # note: returns sum of edit distances + number of checked words
     match_list = ['correct answer', 'answer', 'expected response']
@@ -95,3 +121,152 @@ class TestReadEmbeddings:
     def test_read_dummy_embedding(self):
         _ = text_utils.read_embeddings('tests/dummy_emb.zip',
                                        print_errors=True)
+
+
+class TestHtmlToText:
+    """ html_to_text must behave exactly like BeautifulSoup's .text
+    """
+    markups = [
+        '',
+        ' ',
+        '  a ',
+        '<p style="font-family:\'ArialMT\'; font-size:10.0pt">Questão 1</p>',
+        '<p>a</p> <p>b</p>',
+        '<p>a</p>\t<p>b</p>',
+        '\n<p>a</p>\n',
+        '  <p>  a  </p>  ',
+        '<pre>  keep   spaces </pre>',
+        '<table><tr><td><pre> x </pre></td></tr></table>',
+        '<b>Resposta:</b> <b>C</b>',
+        'a < b',
+        'a <3 b',
+        'x &amp; y &lt;b&gt; &#x41;&#65; &nbsp;',
+        'a &amp b',
+        '<!-- comment -->text',
+        '<script>x = 1</script>after script',
+        '<br>x<br/>',
+        '﻿byte order mark',
+    ]
+
+    @pytest.mark.parametrize("markup", markups)
+    def test_same_as_beautifulsoup(self, markup):
+        expected = BeautifulSoup(markup, features='lxml').text
+        assert text_utils.html_to_text(markup) == expected
+
+
+class TestKeywordMatcher:
+    match_list = TestMatchFirstWords.match_list
+
+    @pytest.mark.parametrize(
+        "words, word_list, remove_last_char, last_char_match_list, "
+        "expected_dist, expected_n_words", TestMatchFirstWords.match_tests
+    )
+    @pytest.mark.parametrize("max_dist", [0, 1, 2])
+    def test_same_as_match_first_words(
+        self, words, word_list, remove_last_char, last_char_match_list,
+        expected_dist, expected_n_words, max_dist
+    ):
+        """ Exact results up to max_dist, no match beyond it
+        """
+        matcher = text_utils.KeywordMatcher(
+            {'answer': word_list}, max_dist=max_dist,
+            remove_last_char=remove_last_char,
+            last_char_match_list=last_char_match_list
+        )
+        dist, n_words = matcher.match_first_words(words.split())['answer']
+        if expected_dist <= max_dist:
+            assert (dist, n_words) == (expected_dist, expected_n_words)
+        else:
+            assert (dist, n_words) == (text_utils.NO_MATCH_DIST, 0)
+
+    def test_min_word_distance(self):
+        keywords = ['exercício', 'questão']
+        matcher = text_utils.KeywordMatcher({'exercise': keywords}, 2)
+        for word, expected in [('Questão', 0), ('Qestão', 1),
+                               ('Exrcicio', 2), ('Resposta', None)]:
+            if expected is None:
+                expected = text_utils.NO_MATCH_DIST
+                assert text_utils.min_word_distance(word, keywords) > 2
+            else:
+                assert text_utils.min_word_distance(word, keywords) == expected
+            assert matcher.min_word_distance(word) == expected
+
+    def test_can_match_length_window(self):
+        matcher = text_utils.KeywordMatcher(
+            {'hint': ['dica'], 'answer': ['resposta esperada']}, max_dist=1,
+            remove_last_char=True, last_char_match_list=[':']
+        )
+        # the last char is removed from single word keywords only
+        assert matcher.can_match(['dica:'])
+        assert matcher.can_match(['dic:'])
+        assert matcher.can_match(['resposta', 'esperada:'])
+        assert not matcher.can_match(['di:'])
+        assert not matcher.can_match(['a', 'paragraph'])
+        assert not matcher.can_match([])
+
+
+class TestWordDistanceCache:
+    def teardown_method(self):
+        text_utils.set_word_distance_cache_size(
+            text_utils.DEFAULT_DISTANCE_CACHE_SIZE
+        )
+
+    def test_hits_and_misses(self):
+        text_utils.clear_word_distance_cache()
+        assert text_utils.word_distance('Questão', 'questao') == 1
+        # normalized pair: case and order do not matter
+        assert text_utils.word_distance('QUESTAO', 'questão') == 1
+        info = text_utils.word_distance_cache_info()
+        assert (info.hits, info.misses, info.currsize) == (1, 1, 1)
+
+    def test_bounded_size(self):
+        text_utils.set_word_distance_cache_size(2)
+        for w in ['a', 'b', 'c', 'a']:
+            text_utils.word_distance(w, 'z')
+        info = text_utils.word_distance_cache_info()
+        assert info.currsize == 2
+        # 'a' was evicted before being used again
+        assert (info.hits, info.misses) == (0, 4)
+
+    def test_disabled(self):
+        text_utils.set_word_distance_cache_size(0)
+        assert text_utils.min_word_distance('dica', ['dica', 'fonte']) == 0
+        assert text_utils.word_distance_cache_info().currsize == 0
+
+
+class TestEmbeddingStore:
+    def test_round_trip_dummy_embedding(self, tmp_path):
+        emb_dict = text_utils.read_embeddings('tests/dummy_emb.zip')
+        prefix = str(tmp_path / 'dummy_emb')
+        n_words = text_utils.convert_embeddings('tests/dummy_emb.zip', prefix)
+        store = text_utils.EmbeddingStore(prefix)
+
+        assert n_words == len(emb_dict) == len(store)
+        assert list(store) == list(emb_dict)
+        assert isinstance(store.matrix, np.memmap)
+        assert store.matrix.dtype == np.float32
+        for word, vector in emb_dict.items():
+            assert word in store
+            np.testing.assert_allclose(store[word], vector, rtol=1e-6)
+        assert store.get('not a word') is None
+
+    def test_pickle_reopens_files(self, tmp_path):
+        prefix = str(tmp_path / 'dummy_emb')
+        text_utils.convert_embeddings('tests/dummy_emb.zip', prefix)
+        store = text_utils.EmbeddingStore(prefix)
+        data = pickle.dumps(store)
+        assert len(data) < 1000, 'Matrix should not be pickled'
+
+        loaded = pickle.loads(data)
+        assert list(loaded) == list(store)
+        np.testing.assert_array_equal(loaded.matrix, store.matrix)
+
+    def test_raw_file_removed_on_error(self, tmp_path):
+        emb_zip = str(tmp_path / 'two_files.zip')
+        with zipfile.ZipFile(emb_zip, 'w') as z:
+            z.writestr('a.txt', '1 2\nword 0.1 0.2\n')
+            z.writestr('b.txt', '')
+        prefix = str(tmp_path / 'bad_emb')
+        with pytest.raises(AssertionError):
+            text_utils.convert_embeddings(emb_zip, prefix)
+        assert not os.path.exists(prefix + '.raw')
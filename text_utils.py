@@ -1,12 +1,28 @@
-import copy
+import os
+import re
 import zipfile
 import logging
+import functools
+import threading
 
 import jellyfish
 import numpy as np
+from lxml import etree
 from tqdm.auto import tqdm
 
 
+# distance reported when nothing matches
+NO_MATCH_DIST = 99999
+
+# number of word pairs kept in the word distance cache
+DEFAULT_DISTANCE_CACHE_SIZE = 2 ** 16
+
+# same whitespace definition as BeautifulSoup
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+HTML_TAG_PATTERN = re.compile('<[^>]*>')
+
+
 def read_embeddings(embeddings_file, print_errors=False):
     emb_dict = {}
     with zipfile.ZipFile(embeddings_file) as z:
@@ -26,10 +42,175 @@ def read_embeddings(embeddings_file, print_errors=False):
     return emb_dict
 
 
+def convert_embeddings(embeddings_file, out_prefix, print_errors=False):
+    """ Converts a word vector zip, in the format read by read_embeddings,
+        into files that EmbeddingStore can memory map:
+
+        <out_prefix>.npy - float32 matrix with one row per word
+        <out_prefix>.vocab - one word per line, in row order
+
+    Rows are streamed to disk, so memory does not grow with the
+    number of words. As in read_embeddings, the last vector
+    of a repeated word wins
+
+    Returns the number of words
+    """
+    raw_file = out_prefix + '.raw'
+    word2idx = {}
+    n_dims = None
+    try:
+        with zipfile.ZipFile(embeddings_file) as z, open(raw_file, 'w+b') as raw:
+            emb_file = z.namelist()
+            assert len(emb_file) == 1, 'Embedding zip has more than 1 file'
+            with z.open(emb_file[0]) as f:
+                first_line = next(f)
+                n_items = int(first_line.decode(encoding='UTF-8').split()[0])
+                for line in tqdm(f, total=n_items):
+                    try:
+                        items = line.decode(encoding='UTF-8').split()
+                        if len(items) > 2:
+                            vector = np.array(items[1:], dtype=np.float32)
+                            if n_dims is None:
+                                n_dims = len(vector)
+                            if len(vector) != n_dims:
+                                raise ValueError('Unexpected vector length')
+
+                            idx = word2idx.setdefault(items[0], len(word2idx))
+                            raw.seek(idx * n_dims * vector.itemsize)
+                            raw.write(vector.tobytes())
+                    except ValueError:
+                        if print_errors:
+                            print(f'Problem with {line}')
+
+            raw.flush()
+            matrix = np.lib.format.open_memmap(
+                out_prefix + '.npy', mode='w+', dtype=np.float32,
+                shape=(len(word2idx), n_dims or 0)
+            )
+            if len(word2idx) > 0:
+                matrix[:] = np.memmap(
+                    raw_file, dtype=np.float32, mode='r', shape=matrix.shape
+                )
+            matrix.flush()
+            del matrix
+    finally:
+        if os.path.isfile(raw_file):
+            os.remove(raw_file)
+
+    # dictionaries keep insertion order: same as the rows
+    with open(out_prefix + '.vocab', 'w', encoding='utf-8') as f:
+        for word in word2idx:
+            f.write(word + '\n')
+
+    return len(word2idx)
+
+
+class EmbeddingStore:
+    """ Read-only word embeddings created by convert_embeddings
+
+    The matrix is memory mapped: only the rows that are used get
+    read from disk, and processes that open the same files share
+    the same pages. Pickling only keeps the file prefix, so a
+    store can be sent to worker processes at no cost
+
+    Example:
+
+    convert_embeddings('embeddings.zip', 'embeddings')
+    store = EmbeddingStore('embeddings')
+    vector = store['questão']
+    """
+
+    def __init__(self, prefix):
+        """ Opens the store
+
+        Arguments:
+
+        prefix: out_prefix given to convert_embeddings
+        """
+        self.prefix = prefix
+        self.matrix = np.load(prefix + '.npy', mmap_mode='r')
+        with open(prefix + '.vocab', encoding='utf-8') as f:
+            words = f.read().split('\n')[:-1]
+        self.word2idx = {w: idx for idx, w in enumerate(words)}
+
+    def __len__(self):
+        return len(self.word2idx)
+
+    def __contains__(self, word):
+        return word in self.word2idx
+
+    def __getitem__(self, word):
+        return self.matrix[self.word2idx[word]]
+
+    def __iter__(self):
+        return iter(self.word2idx)
+
+    def get(self, word, default=None):
+        idx = self.word2idx.get(word, None)
+        if idx is None:
+            return default
+        return self.matrix[idx]
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    def __getstate__(self):
+        return {'prefix': self.prefix}
+
+    def __setstate__(self, state):
+        self.__init__(state['prefix'])
+
+
 def word_distance(w1, w2):
     """ Computes word distance
     """
-    return jellyfish.damerau_levenshtein_distance(w1.lower(), w2.lower())
+    return _lowered_distance(w1.lower(), w2.lower())
+
+
+def _lowered_distance(w1, w2):
+    """ Word distance between already lowercased words
+    """
+    # the distance is symmetric: one cache entry per pair
+    if w2 < w1:
+        w1, w2 = w2, w1
+    return _cached_distance(w1, w2)
+
+
+def _build_distance_cache(maxsize):
+    return functools.lru_cache(maxsize=maxsize)(
+        jellyfish.damerau_levenshtein_distance
+    )
+
+
+# process-local cache of distances between lowercased word pairs
+_cached_distance = _build_distance_cache(DEFAULT_DISTANCE_CACHE_SIZE)
+
+
+def set_word_distance_cache_size(maxsize):
+    """ Replaces the word distance cache with an empty one
+
+    Arguments:
+
+    maxsize: maximum number of word pairs to keep, the least
+        recently used ones get evicted first.
+        0 disables caching, None never evicts
+    """
+    global _cached_distance
+    _cached_distance = _build_distance_cache(maxsize)
+
+
+def word_distance_cache_info():
+    """ Returns the statistics of the word distance cache:
+        named tuple (hits, misses, maxsize, currsize)
+    """
+    return _cached_distance.cache_info()
+
+
+def clear_word_distance_cache():
+    """ Empties the word distance cache and resets its statistics
+    """
+    _cached_distance.cache_clear()
 
 
 def min_word_distance(word, word_list):
@@ -69,8 +250,8 @@ def min_first_words_match_list(
         assert type(last_char_match_list) == list,\
             'Possible delimiters must be a list'
 
-    distances = []
-    n_compared_words = []
+    min_dist = None
+    n_compared_words = 0
     for ww in word_list:
         wsplit = ww.split()
         n_words = len(wsplit)
@@ -84,24 +265,362 @@ def min_first_words_match_list(
 
             if last_char_match:
                 cur_dist = 0
+                cur_words = words[0:n_words]
                 if remove_last_char:
-                    cur_words = copy.deepcopy(words[0:n_words])
                     cur_words[-1] = cur_words[-1][:-1]
-                else:
-                    cur_words = words[0:n_words]
 
                 for (query, truth) in zip(cur_words, wsplit):
                     # print(f'Comparing `{query}` with `{truth}`')
                     cur_dist += word_distance(query, truth)
-                distances.append(cur_dist)
-                n_compared_words.append(n_words)
 
-    if len(distances) > 0:
-        min_idx = np.argmin(distances)
-        return distances[min_idx], n_compared_words[min_idx]
+                # keep the first minimum
+                if min_dist is None or cur_dist < min_dist:
+                    min_dist = cur_dist
+                    n_compared_words = n_words
+
+    if min_dist is not None:
+        return min_dist, n_compared_words
     else:
         # some big number
-        return 99999, 0
+        return NO_MATCH_DIST, 0
+
+
+class KeywordMatcher:
+    """ Fuzzy matcher precompiled from groups of keywords
+
+    Gives the same answers as min_word_distance and
+    min_first_words_match_list for every distance up to `max_dist`,
+    but prunes candidates that cannot get there: the edit distance
+    between two words is at least their length difference, and
+    the sum over the words of a keyword stops being computed as
+    soon as it goes over the budget.
+
+    Example:
+
+    matcher = KeywordMatcher(
+        {'hint': ['dica'], 'correct_answer': ['resposta', 'gabarito']},
+        max_dist=1, remove_last_char=True, last_char_match_list=[':']
+    )
+    matcher.match_first_words(['Respsta:', 'B'])
+    # {'hint': (99999, 0), 'correct_answer': (1, 1)}
+    """
+
+    def __init__(
+        self, keyword_groups, max_dist,
+        remove_last_char=False, last_char_match_list=None
+    ):
+        """ Precompiles the keywords
+
+        Arguments:
+
+        keyword_groups: dictionary {group: list of keywords}
+        max_dist: largest distance that has to be exact.
+            Anything farther away is reported as no match
+        remove_last_char, last_char_match_list:
+            same as in min_first_words_match_list
+        """
+        if remove_last_char:
+            assert last_char_match_list is not None, 'Need delimiters'
+            assert type(last_char_match_list) == list,\
+                'Possible delimiters must be a list'
+
+        self.max_dist = max_dist
+        self.remove_last_char = remove_last_char
+        self.last_char_match_list = last_char_match_list
+
+        # (group, [(keyword words, keyword word lengths)])
+        self.groups = []
+        # whole keywords, for single word matching
+        self.keywords = []
+        # first word lengths, split by single / multiple word keywords
+        first_lens = ([], [])
+        for group, keywords in keyword_groups.items():
+            compiled = []
+            for keyword in keywords:
+                kw_words = tuple(x.lower() for x in keyword.split())
+                compiled.append((kw_words, tuple(len(x) for x in kw_words)))
+                self.keywords.append(keyword.lower())
+                if len(kw_words) > 0:
+                    first_lens[len(kw_words) > 1].append(len(kw_words[0]))
+            self.groups.append((group, compiled))
+
+        # range of first word lengths that can get within max_dist
+        self.first_len_windows = [
+            (min(x) - max_dist, max(x) + max_dist) if len(x) > 0 else None
+            for x in first_lens
+        ]
+
+    def min_word_distance(self, word):
+        """ Same as min_word_distance(word, <all keywords>)
+            when the result is at most max_dist, NO_MATCH_DIST otherwise
+        """
+        word = word.lower()
+        best = self.max_dist + 1
+        for keyword in self.keywords:
+            # distance is at least the length difference
+            if abs(len(word) - len(keyword)) < best:
+                best = min(best, _lowered_distance(word, keyword))
+                if best == 0:
+                    break
+
+        return best if best <= self.max_dist else NO_MATCH_DIST
+
+    def can_match(self, words):
+        """ Cheap check before match_first_words: False means
+            that no group can match the first words
+        """
+        if len(words) == 0:
+            return False
+        first_word = words[0].lower()
+        for multiple_words, window in enumerate(self.first_len_windows):
+            if window is None:
+                continue
+            if self.remove_last_char and not multiple_words:
+                first_len = len(words[0][:-1].lower())
+            else:
+                first_len = len(first_word)
+            if window[0] <= first_len <= window[1]:
+                return True
+        return False
+
+    def match_first_words(self, words):
+        """ Matches the first words of a line against every group
+
+        Returns:
+
+        dictionary {group: (min_dist, n_compared_words)} with the same
+            values as min_first_words_match_list when min_dist is at most
+            max_dist, and (NO_MATCH_DIST, 0) otherwise
+        """
+        assert type(words) == list,\
+            'Words in the sentence should be already splitted'
+
+        # lowercased first words, by number of words. None: no match
+        queries = {}
+        ans = {}
+        for group, keywords in self.groups:
+            best = (NO_MATCH_DIST, 0)
+            for kw_words, kw_lens in keywords:
+                n_words = len(kw_words)
+                if n_words not in queries:
+                    queries[n_words] = self._query_words(words, n_words)
+                query = queries[n_words]
+                if query is None:
+                    continue
+
+                # only strictly better distances replace the best one
+                budget = min(self.max_dist, best[0] - 1)
+                lower_bound = 0
+                for q, kw_len in zip(query, kw_lens):
+                    lower_bound += abs(len(q) - kw_len)
+                if lower_bound > budget:
+                    continue
+
+                cur_dist = 0
+                for q, truth in zip(query, kw_words):
+                    cur_dist += _lowered_distance(q, truth)
+                    if cur_dist > budget:
+                        break
+                if cur_dist <= budget:
+                    best = (cur_dist, n_words)
+
+            ans[group] = best
+        return ans
+
+    def _query_words(self, words, n_words):
+        """ Lowercased first n_words words to compare,
+            None if they cannot match
+        """
+        if len(words) < n_words:
+            return None
+        if self.last_char_match_list is not None and\
+                words[n_words - 1][-1] not in self.last_char_match_list:
+            return None
+
+        query = [x.lower() for x in words[0:n_words]]
+        if self.remove_last_char:
+            query[-1] = words[n_words - 1][:-1].lower()
+        return query
+
+
+class SemanticKeywordMatcher:
+    """ Matches words with groups of keywords by the cosine
+        similarity of their word embeddings, so that synonyms
+        (e.g. `solução` and `resposta`) can be found
+
+    Keyword vectors are normalized once. Scoring a batch of
+    words costs a single matrix product
+
+    Example:
+
+    matcher = SemanticKeywordMatcher(
+        {'correct_answer': ['resposta', 'gabarito']}, store
+    )
+    matcher.score(['Solução', 'texto'])
+    # {'solução': {'correct_answer': 0.83}, 'texto': {...}}
+    """
+
+    def __init__(self, keyword_groups, embeddings):
+        """ Precomputes the normalized keyword matrix
+
+        Arguments:
+
+        keyword_groups: dictionary {group: list of keywords}
+        embeddings: EmbeddingStore or dictionary {word: vector}.
+            A keyword with many words is the mean of its word vectors,
+            keywords without any known word are ignored
+        """
+        self.embeddings = embeddings
+        self.groups = list(keyword_groups)
+
+        rows = []
+        row_groups = []
+        for group_idx, group in enumerate(self.groups):
+            for keyword in keyword_groups[group]:
+                vectors = [embeddings[x] for x in keyword.lower().split()
+                           if x in embeddings]
+                if len(vectors) > 0:
+                    rows.append(np.mean(vectors, axis=0))
+                    row_groups.append(group_idx)
+
+        if len(rows) > 0:
+            self.matrix = _normalize_rows(np.array(rows, dtype=np.float32))
+        else:
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.group_rows = [
+            np.flatnonzero(np.array(row_groups, dtype=int) == group_idx)
+            for group_idx in range(len(self.groups))
+        ]
+
+    def score(self, words):
+        """ Similarity between words and each group of keywords
+
+        Returns:
+
+        dictionary {lowercased word: {group: best similarity}}
+            for every word that has an embedding
+        """
+        known = [x for x in dict.fromkeys(w.lower() for w in words)
+                 if x in self.embeddings]
+        if len(known) == 0 or len(self.matrix) == 0:
+            return {}
+
+        queries = _normalize_rows(np.array(
+            [self.embeddings[x] for x in known], dtype=np.float32
+        ))
+        similarities = queries @ self.matrix.T
+
+        ans = {w: {} for w in known}
+        for group, rows in zip(self.groups, self.group_rows):
+            if len(rows) > 0:
+                best = similarities[:, rows].max(axis=1)
+                for w, sim in zip(known, best.tolist()):
+                    ans[w][group] = sim
+        return ans
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+class _HtmlTextTarget:
+    """ lxml parser target that collects text exactly like
+        BeautifulSoup(markup, features='lxml').text
+
+        - comments, processing instructions and doctypes are dropped
+        - contents of script, style and template tags are dropped
+        - strings made only of whitespace become a single
+          space or newline, unless inside pre or textarea
+    """
+    PRESERVE_WHITESPACE_TAGS = ('pre', 'textarea')
+    SKIPPED_TAGS = ('script', 'style', 'template')
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.texts = []
+        self.cur_data = []
+        self.n_preserve = 0
+        self.n_skip = 0
+
+    def _end_data(self):
+        if len(self.cur_data) > 0:
+            data = ''.join(self.cur_data)
+            self.cur_data = []
+            if self.n_skip > 0:
+                return
+            if self.n_preserve == 0 and len(data.strip(ASCII_SPACES)) == 0:
+                data = '\n' if '\n' in data else ' '
+            self.texts.append(data)
+
+    def start(self, tag, attrib):
+        self._end_data()
+        if tag in self.PRESERVE_WHITESPACE_TAGS:
+            self.n_preserve += 1
+        if tag in self.SKIPPED_TAGS:
+            self.n_skip += 1
+
+    def end(self, tag):
+        self._end_data()
+        if tag in self.PRESERVE_WHITESPACE_TAGS:
+            self.n_preserve -= 1
+        if tag in self.SKIPPED_TAGS:
+            self.n_skip -= 1
+
+    def data(self, data):
+        self.cur_data.append(data)
+
+    def comment(self, text):
+        self._end_data()
+
+    def pi(self, target, data):
+        self._end_data()
+
+    def doctype(self, *args):
+        pass
+
+    def close(self):
+        self._end_data()
+        ans = ''.join(self.texts)
+        self._reset()
+        return ans
+
+
+# lxml parsers are not thread safe: keep one per thread
+_html_text_parsers = threading.local()
+
+
+def _get_html_text_parser():
+    parser = getattr(_html_text_parsers, 'parser', None)
+    if parser is None:
+        parser = etree.HTMLParser(
+            target=_HtmlTextTarget(), strip_cdata=False, recover=True
+        )
+        _html_text_parsers.parser = parser
+    return parser
+
+
+def html_to_text(markup):
+    """ Extracts the text of an HTML snippet
+
+    Produces the same output as BeautifulSoup(markup, features='lxml').text
+    (entity decoding included) without building a tree
+    """
+    # BeautifulSoup drops the byte order mark
+    if markup.startswith('\ufeff'):
+        markup = markup[1:]
+
+    parser = _get_html_text_parser()
+    try:
+        parser.feed(markup)
+        return parser.close()
+    except Exception:
+        # leave no half-parsed state behind
+        _html_text_parsers.parser = None
+        raise
 
 
 def remove_first_occurrence(text, txt_find, caller_name=''):
@@ -113,3 +632,24 @@ def remove_first_occurrence(text, txt_find, caller_name=''):
         logging.warning(f'{caller_name}: Could not '
                         f'replace {txt_find}')
     return ans
+
+
+def remove_first_text_occurrence(markup, txt_find, caller_name=''):
+    """ Removes the first occurrence in the text of an HTML snippet,
+        leaving tags and their attributes untouched (e.g. `10.` is not
+        removed from `<p style="font-size:10.0pt">`)
+        Throws a logging warning if it is not found
+    """
+    start = 0
+    for tag in HTML_TAG_PATTERN.finditer(markup):
+        idx = markup.find(txt_find, start, tag.start())
+        if idx >= 0:
+            return markup[:idx] + markup[idx + len(txt_find):]
+        start = tag.end()
+    idx = markup.find(txt_find, start)
+    if idx >= 0:
+        return markup[:idx] + markup[idx + len(txt_find):]
+
+    logging.warning(f'{caller_name}: Could not '
+                    f'replace {txt_find}')
+    return markup